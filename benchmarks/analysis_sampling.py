@@ -0,0 +1,75 @@
+"""Compare sampled map-faces analysis (--analysis-sample-fps) with exhaustive analysis on a video.
+
+Reports detector calls and wall time for both, and how many faces on unsampled
+frames get the same identity from store.nearest_clusters as from exhaustive
+clustering. Needs the face analyser models and ffmpeg.
+
+Run from the repository root: python -m benchmarks.analysis_sampling VIDEO [--sample-fps 2]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from tqdm import tqdm
+
+import modules.globals
+from modules.cluster_analysis import find_cluster_centroids
+from modules.face_analyser import get_many_faces, sample_target_faces
+from modules.face_store import FaceStore
+from modules.utilities import clean_temp, create_temp, extract_frames, get_temp_frame_paths
+
+
+def build_store(frame_faces: dict) -> FaceStore:
+    store = FaceStore()
+    for temp_frame_path, faces in frame_faces.items():
+        store.add_frame(temp_frame_path, faces)
+    store.finalize()
+    store.assign_clusters(find_cluster_centroids(store.embedding))
+    return store
+
+
+def main() -> None:
+    program = argparse.ArgumentParser()
+    program.add_argument('target_path')
+    program.add_argument('--sample-fps', type=float, default=2.0)
+    program.add_argument('--execution-provider', default='CPUExecutionProvider')
+    args = program.parse_args()
+
+    modules.globals.target_path = args.target_path
+    modules.globals.analysis_sample_fps = args.sample_fps
+    modules.globals.execution_providers = [args.execution_provider]
+    create_temp(args.target_path)
+    extract_frames(args.target_path)
+    try:
+        temp_frame_paths = sorted(get_temp_frame_paths(args.target_path))
+        # load the models before timing either pass
+        get_many_faces(cv2.imread(temp_frame_paths[0]))
+
+        start_time = time.perf_counter()
+        exhaustive_faces = {temp_frame_path: get_many_faces(cv2.imread(temp_frame_path)) or [] for temp_frame_path in tqdm(temp_frame_paths, desc='Exhaustive')}
+        exhaustive_store = build_store(exhaustive_faces)
+        exhaustive_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        sampled_faces = sample_target_faces(temp_frame_paths)
+        sampled_store = build_store(sampled_faces)
+        sampled_time = time.perf_counter() - start_time
+
+        lazy_frame_paths = [temp_frame_path for temp_frame_path in temp_frame_paths if temp_frame_path not in sampled_faces and exhaustive_faces[temp_frame_path]]
+        expected = np.concatenate([exhaustive_store.cluster[exhaustive_store.frame_rows(temp_frame_path)] for temp_frame_path in lazy_frame_paths] or [np.empty(0, dtype=np.int32)])
+        actual = np.concatenate([sampled_store.nearest_clusters(exhaustive_faces[temp_frame_path]) for temp_frame_path in lazy_frame_paths] or [np.empty(0, dtype=np.int32)])
+
+        print(f'{"":>12} {"frames":>8} {"faces":>8} {"clusters":>8} {"time":>9}')
+        print(f'{"exhaustive":>12} {len(temp_frame_paths):>8} {len(exhaustive_store):>8} {len(exhaustive_store.centroids):>8} {exhaustive_time:>8.1f}s')
+        print(f'{"sampled":>12} {len(sampled_faces):>8} {len(sampled_store):>8} {len(sampled_store.centroids):>8} {sampled_time:>8.1f}s')
+        if len(expected):
+            # adjusted rand index, 1.0 means the lazily assigned faces split into the same identities
+            print(f'lazy faces {len(expected)}, identity agreement (ARI) {adjusted_rand_score(expected, actual):.3f}')
+    finally:
+        clean_temp(args.target_path)
+
+
+if __name__ == '__main__':
+    main()
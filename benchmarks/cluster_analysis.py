@@ -0,0 +1,67 @@
+"""Time map-faces clustering against the original exhaustive fit and compare assignments.
+
+Run from the repository root: python -m benchmarks.cluster_analysis [--sizes 2000 20000]
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+
+from modules.cluster_analysis import find_cluster_centroids
+
+
+def make_embeddings(count: int, families: int = 3, identities: int = 3, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    family_centers = rng.normal(size=(families, 1, 512))
+    centers = (family_centers + rng.normal(scale=0.3, size=(families, identities, 512))).reshape(-1, 512)
+    # a video yields runs of near-identical faces, ten frames per run here
+    runs = max(1, count // 10)
+    run_embeddings = centers[rng.integers(0, len(centers), size=runs)] + rng.normal(scale=0.1, size=(runs, 512))
+    embeddings = np.repeat(run_embeddings, 10, axis=0)[:count] + rng.normal(scale=1e-3, size=(count, 512))
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(np.float32)
+
+
+def find_cluster_centroids_exhaustive(embeddings: np.ndarray, max_k: int = 10) -> np.ndarray:
+    inertia = []
+    cluster_centroids = []
+    for k in range(1, max_k + 1):
+        kmeans = KMeans(n_clusters=k, random_state=0).fit(embeddings)
+        inertia.append(kmeans.inertia_)
+        cluster_centroids.append(kmeans.cluster_centers_)
+    diffs = [inertia[i] - inertia[i + 1] for i in range(len(inertia) - 1)]
+    return cluster_centroids[diffs.index(max(diffs)) + 1]
+
+
+def assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(embeddings @ np.asarray(centroids, dtype=np.float32).T, axis=1)
+
+
+def main() -> None:
+    program = argparse.ArgumentParser()
+    program.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 100000])
+    program.add_argument('--exhaustive-limit', help='largest size the original fit is timed on', type=int, default=100000)
+    args = program.parse_args()
+
+    # the first fit pays for thread pool and BLAS start-up, which would be billed to whichever runs first
+    find_cluster_centroids_exhaustive(make_embeddings(500))
+    print(f"{'embeddings':>10} {'current':>10} {'exhaustive':>10} {'k':>5} {'agreement':>9}")
+    for size in args.sizes:
+        embeddings = make_embeddings(size)
+        start_time = time.perf_counter()
+        centroids = find_cluster_centroids(embeddings)
+        current_time = time.perf_counter() - start_time
+        if size > args.exhaustive_limit:
+            print(f'{size:>10} {current_time:>9.2f}s {"-":>10} {len(centroids):>5} {"-":>9}')
+            continue
+        start_time = time.perf_counter()
+        expected = find_cluster_centroids_exhaustive(embeddings)
+        exhaustive_time = time.perf_counter() - start_time
+        # adjusted rand index of the face assignments, 1.0 means identical clusters
+        agreement = adjusted_rand_score(assign(embeddings, expected), assign(embeddings, centroids))
+        print(f'{size:>10} {current_time:>9.2f}s {exhaustive_time:>9.2f}s {len(centroids)}/{len(expected):<3} {agreement:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
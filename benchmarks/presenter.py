@@ -0,0 +1,90 @@
+"""Time preview frame presentation: the old fromarray/LANCZOS/new-CTkImage path against FramePresenter.
+
+Each frame size (720p and 1080p by default) is timed for the conversion on its
+own, then together with the Tk update when a display is available.
+Run from the repository root: python -m benchmarks.presenter [--frame-sizes 1280x720 1920x1080]
+"""
+import argparse
+import time
+import tkinter
+
+import customtkinter as ctk
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from modules.presenter import FramePresenter, prepare_frame
+
+
+def prepare_frame_original(temp_frame: np.ndarray, size: tuple) -> Image.Image:
+    image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
+    return ImageOps.contain(image, size, Image.LANCZOS)
+
+
+def time_frames(frames: list, show: callable) -> float:
+    # a few untimed frames first, so first-call setup is not billed to whichever path runs first
+    for frame in frames[:3]:
+        show(frame)
+    start_time = time.perf_counter()
+    for frame in frames:
+        show(frame)
+    return (time.perf_counter() - start_time) / len(frames) * 1000
+
+
+def parse_size(value: str) -> tuple:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def make_frames(frame_size: tuple, count: int) -> list:
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, size=(frame_size[1], frame_size[0], 3), dtype=np.uint8) for _ in range(8)]
+    return [frames[i % len(frames)] for i in range(count)]
+
+
+def main() -> None:
+    program = argparse.ArgumentParser()
+    program.add_argument('--frame-sizes', type=parse_size, nargs='+', default=[(1280, 720), (1920, 1080)])
+    program.add_argument('--display-size', type=int, nargs=2, default=[1200, 700])
+    program.add_argument('--frames', type=int, default=100)
+    args = program.parse_args()
+
+    size = tuple(args.display_size)
+    try:
+        root = ctk.CTk()
+    except tkinter.TclError:
+        root = None
+
+    print(f'frames into {size[0]}x{size[1]}, ms per frame')
+    for frame_size in args.frame_sizes:
+        frames = make_frames(frame_size, args.frames)
+        print(f'{frame_size[0]}x{frame_size[1]}')
+        print(f'  convert    original {time_frames(frames, lambda frame: prepare_frame_original(frame, size)):7.2f}  presenter {time_frames(frames, lambda frame: prepare_frame(frame, size)):7.2f}')
+        if root is None:
+            print('  no display, tk update not timed')
+        else:
+            time_tk(root, frames, size)
+    if root is not None:
+        root.destroy()
+
+
+def time_tk(root: ctk.CTk, frames: list, size: tuple) -> None:
+    label = ctk.CTkLabel(root, text=None)
+    label.pack()
+    presenter = FramePresenter(label)
+
+    def show_original(frame: np.ndarray) -> None:
+        image = prepare_frame_original(frame, size)
+        label.configure(image=ctk.CTkImage(image, size=image.size))
+        root.update()
+
+    def show_presenter(frame: np.ndarray) -> None:
+        presenter.show_frame(frame, size)
+        root.update()
+
+    print(f'  convert+tk original {time_frames(frames, show_original):7.2f}  presenter {time_frames(frames, show_presenter):7.2f}')
+    label.destroy()
+
+
+if __name__ == '__main__':
+    main()
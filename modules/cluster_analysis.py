@@ -1,20 +1,69 @@
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.metrics import silhouette_score
-from typing import Any
+from typing import Any, List, Tuple
 
+# embeddings closer than this (after rounding) are fitted once with their count as weight
+DEDUPLICATE_DECIMALS = 2
+# below this many embeddings the dedupe saves less than it costs, they are fitted as they are
+DEDUPLICATE_THRESHOLD = 10000
+# below this many unique embeddings a full KMeans fit is cheap enough
+MINI_BATCH_THRESHOLD = 50000
+MINI_BATCH_SIZE = 4096
+MAX_SAMPLES = 100000
+
+
+def deduplicate_embeddings(embeddings) -> Tuple[Any, Any]:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    # rounded rows as integer bytes compare with one memcmp, np.unique(axis=0) sorts column by column
+    rounded = np.ascontiguousarray(np.round(embeddings * 10 ** DEDUPLICATE_DECIMALS).astype(np.int32))
+    _, unique_indices, counts = np.unique(rounded.view(np.dtype((np.void, rounded.shape[1] * rounded.itemsize))).ravel(), return_index=True, return_counts=True)
+    # first appearance order, so the seeding walks the faces in the order an unweighted fit would
+    order = np.argsort(unique_indices)
+    return embeddings[unique_indices[order]], counts[order].astype(np.float32)
+
+
+def reservoir_sample(embeddings, max_samples: int, random_state: int = 0) -> Any:
+    embeddings = np.asarray(embeddings)
+    if len(embeddings) <= max_samples:
+        return embeddings
+    rng = np.random.default_rng(random_state)
+    reservoir = np.arange(max_samples)
+    # algorithm R with the replacement draws vectorised, only accepted draws are applied in order
+    candidates = np.arange(max_samples, len(embeddings))
+    draws = rng.integers(0, candidates + 1)
+    for i, j in zip(candidates[draws < max_samples], draws[draws < max_samples]):
+        reservoir[j] = i
+    return embeddings[np.sort(reservoir)]
+
+
+def find_cluster_centroids(embeddings, max_k=10, max_samples: int = MAX_SAMPLES) -> Any:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) == 0:
+        return np.empty((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype=np.float32)
+    embeddings = reservoir_sample(embeddings, max_samples)
+    weights = None
+    if len(embeddings) > DEDUPLICATE_THRESHOLD:
+        embeddings, weights = deduplicate_embeddings(embeddings)
+    max_k = min(max_k, len(embeddings))
 
-def find_cluster_centroids(embeddings, max_k=10) -> Any:
     inertia = []
     cluster_centroids = []
     K = range(1, max_k+1)
 
     for k in K:
-        kmeans = KMeans(n_clusters=k, random_state=0)
-        kmeans.fit(embeddings)
+        # k-means++ seeding as before, the sampling and weighting only shrink what each fit sees
+        if len(embeddings) > MINI_BATCH_THRESHOLD:
+            kmeans = MiniBatchKMeans(n_clusters=k, n_init=1, batch_size=MINI_BATCH_SIZE, random_state=0)
+        else:
+            kmeans = KMeans(n_clusters=k, random_state=0)
+        kmeans.fit(embeddings, sample_weight=weights)
         inertia.append(kmeans.inertia_)
         cluster_centroids.append({"k": k, "centroids": kmeans.cluster_centers_})
 
+    if len(inertia) < 2:
+        return cluster_centroids[0]['centroids']
+
     diffs = [inertia[i] - inertia[i+1] for i in range(len(inertia)-1)]
     optimal_centroids = cluster_centroids[diffs.index(max(diffs)) + 1]['centroids']
 
@@ -26,7 +75,30 @@ def find_closest_centroid(centroids: list, normed_face_embedding) -> list:
         normed_face_embedding = np.array(normed_face_embedding)
         similarities = np.dot(centroids, normed_face_embedding)
         closest_centroid_index = np.argmax(similarities)
-        
+
         return closest_centroid_index, centroids[closest_centroid_index]
     except ValueError:
-        return None
\ No newline at end of file
+        return None
+
+
+def match_embeddings(normed_embeddings, target_embeddings, threshold: float = 0.0) -> List[Tuple[int, int]]:
+    """One-to-one greedy assignment of embeddings to targets by cosine similarity."""
+    if len(normed_embeddings) == 0 or len(target_embeddings) == 0:
+        return []
+    similarities = np.asarray(normed_embeddings, dtype=np.float32) @ target_embeddings.T
+    matches = []
+    used_embeddings = set()
+    used_targets = set()
+    # best pairs first, so a strong match is never displaced by a weaker one
+    for flat_index in np.argsort(similarities, axis=None)[::-1]:
+        embedding_index, target_index = np.unravel_index(flat_index, similarities.shape)
+        if similarities[embedding_index, target_index] < threshold:
+            break
+        if embedding_index in used_embeddings or target_index in used_targets:
+            continue
+        matches.append((int(embedding_index), int(target_index)))
+        used_embeddings.add(embedding_index)
+        used_targets.add(target_index)
+        if len(matches) == min(similarities.shape):
+            break
+    return matches
@@ -6,19 +6,27 @@ if any(arg.startswith('--execution-provider') for arg in sys.argv):
 # reduce tensorflow log level
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import warnings
-from typing import List
+from types import ModuleType
+from typing import Callable, List, Optional, Tuple
 import platform
 import signal
 import shutil
 import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import onnxruntime
-import tensorflow
+import cv2
 
 import modules.globals
 import modules.metadata
 import modules.ui as ui
-from modules.processors.frame.core import get_frame_processors_modules
+import modules.face_analyser
+from modules.live import LivePipeline, QualityController
+from modules.stream_writer import create_live_recorder, create_stream_writer
+from modules.video_capture import VideoCapturer
+from modules.render_cache import prepare_incremental_render, save_incremental_render
+from modules.processors.frame.core import get_frame_processors_modules, get_job_status_reporter, check_cancelled
 from modules.utilities import has_image_extension, is_image, is_video, detect_fps, create_video, extract_frames, get_temp_frame_paths, restore_audio, create_temp, move_temp, clean_temp, normalize_output_path
 
 if 'ROCMExecutionProvider' in modules.globals.execution_providers:
@@ -43,13 +51,41 @@ def parse_args() -> None:
     program.add_argument('--keep-frames', help='keep temporary frames', dest='keep_frames', action='store_true', default=False)
     program.add_argument('--many-faces', help='process every face', dest='many_faces', action='store_true', default=False)
     program.add_argument('--nsfw-filter', help='filter the NSFW image or video', dest='nsfw_filter', action='store_true', default=False)
+    program.add_argument('--nsfw-backend', help='classifier backend for the NSFW filter', dest='nsfw_backend', default='onnx', choices=['onnx', 'opennsfw2'])
     program.add_argument('--map-faces', help='map source target faces', dest='map_faces', action='store_true', default=False)
+    program.add_argument('--map-faces-threshold', help='minimum cosine similarity for a live face to use a mapping', dest='map_faces_threshold', type=float, default=0.2)
+    program.add_argument('--identity-gallery', help='route faces through an identity gallery file (map-faces runs add their mappings to it)', dest='identity_gallery_path')
+    program.add_argument('--identity-gallery-coarse', help='build a coarse quantizer when saving the identity gallery', dest='identity_gallery_coarse', action='store_true', default=False)
+    program.add_argument('--analysis-sample-fps', help='detect faces on this many frames per second (plus scene cuts) to discover map-faces identities, 0 analyses every frame', dest='analysis_sample_fps', type=float, default=0)
+    program.add_argument('--face-store-float16', help='store map-faces embeddings as float16', dest='face_store_float16', action='store_true', default=False)
+    program.add_argument('--face-store-mmap', help='memory-map map-faces analysis results from the analysis directory', dest='face_store_mmap', action='store_true', default=False)
+    program.add_argument('--incremental-render', help='keep map-faces output frames and only re-render frames whose mapping changed', dest='incremental_render', action='store_true', default=False)
     program.add_argument('--mouth-mask', help='mask the mouth region', dest='mouth_mask', action='store_true', default=False)
     program.add_argument('--video-encoder', help='adjust output video encoder', dest='video_encoder', default='libx264', choices=['libx264', 'libx265', 'libvpx-vp9'])
     program.add_argument('--video-quality', help='adjust output video quality', dest='video_quality', type=int, default=18, choices=range(52), metavar='[0-51]')
     program.add_argument('-l', '--lang', help='Ui language', default="en")
     program.add_argument('--live-mirror', help='The live camera display as you see it in the front-facing camera frame', dest='live_mirror', action='store_true', default=False)
     program.add_argument('--live-resizable', help='The live camera frame is resizable', dest='live_resizable', action='store_true', default=False)
+    program.add_argument('--live-pipeline-depth', help='frames buffered between live pipeline stages', dest='live_pipeline_depth', type=int, default=2)
+    program.add_argument('--live-latency-budget', help='drop live frames older than this many milliseconds, 0 disables', dest='live_latency_budget', type=int, default=0)
+    program.add_argument('--server', '-server', help='run a job server on warm models instead of a single run', dest='server', action='store_true', default=False)
+    program.add_argument('--server-port', help='port of the local job server', dest='server_port', type=int, default=8765)
+    program.add_argument('--server-max-jobs', help='jobs the server or queue runs at the same time', dest='server_max_jobs', type=int, default=2)
+    program.add_argument('--watch', help='keep watching the -sf/-tf folders and process new or changed files on warm models', dest='watch', action='store_true', default=False)
+    program.add_argument('--watch-interval', help='seconds between watch folder scans', dest='watch_interval', type=float, default=2.0)
+    program.add_argument('--watch-settle', help='seconds a watched file must stay unchanged before it is processed', dest='watch_settle', type=float, default=5.0)
+    program.add_argument('--queue', help='run jobs from this sqlite job queue, resuming interrupted ones (folder triples are added to it)', dest='queue_path')
+    program.add_argument('--queue-limits', help='concurrent jobs per resource class, e.g. image=2,video=1,enhancer=1', dest='queue_class_limits', default='video=1,enhancer=1')
+    program.add_argument('--job-retries', help='retries with backoff for a failed queued job', dest='job_retries', type=int, default=2)
+    program.add_argument('--job-priority', help='priority of the queued folder jobs, higher runs first', dest='job_priority', type=int, default=0)
+    program.add_argument('--live', help='run live mode without the ui, streaming processed frames to --live-output', dest='live', action='store_true', default=False)
+    program.add_argument('--live-camera', help='camera index for headless live mode', dest='live_camera_index', type=int, default=0)
+    program.add_argument('--live-output', help='headless live output: ffmpeg file or url (- for stdout), socket path or segment pattern', dest='live_output_path', default='-')
+    program.add_argument('--live-output-mode', help='headless live output sink', dest='live_output_mode', default='ffmpeg', choices=['ffmpeg', 'socket', 'segment'])
+    program.add_argument('--live-record', help='record the processed live output to this file', dest='live_record_path')
+    program.add_argument('--live-record-audio', help='ffmpeg audio input recorded with the live output, as format:device (e.g. pulse:default)', dest='live_record_audio')
+    program.add_argument('--live-video', help='play a video file at its native rate instead of the camera in live mode', dest='live_video_path')
+    program.add_argument('--live-target-fps', help='adapt live detection and processing quality to hold this fps, 0 disables', dest='live_target_fps', type=float, default=0)
     program.add_argument('--max-memory', help='maximum amount of RAM in GB', dest='max_memory', type=int, default=suggest_max_memory())
     program.add_argument('--execution-provider', help='execution provider', dest='execution_provider', default=['cpu'], choices=suggest_execution_providers(), nargs='+')
     program.add_argument('--execution-threads', help='number of execution threads', dest='execution_threads', type=int, default=suggest_execution_threads())
@@ -69,18 +105,46 @@ def parse_args() -> None:
     modules.globals.target_folder = args.target_path_folder
     modules.globals.output_path = normalize_output_path(modules.globals.source_path, modules.globals.target_path, args.output_path)
     modules.globals.frame_processors = args.frame_processor
-    modules.globals.headless = args.source_path or args.target_path or args.output_path
+    modules.globals.headless = args.source_path or args.target_path or args.output_path or args.live or args.server or args.watch or args.queue_path
     modules.globals.keep_fps = args.keep_fps
     modules.globals.keep_audio = args.keep_audio
     modules.globals.keep_frames = args.keep_frames
     modules.globals.many_faces = args.many_faces
     modules.globals.mouth_mask = args.mouth_mask
     modules.globals.nsfw_filter = args.nsfw_filter
+    modules.globals.nsfw_backend = args.nsfw_backend
     modules.globals.map_faces = args.map_faces
+    modules.globals.map_faces_threshold = args.map_faces_threshold
+    modules.globals.identity_gallery_path = args.identity_gallery_path
+    modules.globals.identity_gallery_coarse = args.identity_gallery_coarse
+    modules.globals.analysis_sample_fps = args.analysis_sample_fps
+    modules.globals.face_store_float16 = args.face_store_float16
+    modules.globals.face_store_mmap = args.face_store_mmap
+    modules.globals.incremental_render = args.incremental_render
     modules.globals.video_encoder = args.video_encoder
     modules.globals.video_quality = args.video_quality
     modules.globals.live_mirror = args.live_mirror
     modules.globals.live_resizable = args.live_resizable
+    modules.globals.live_pipeline_depth = args.live_pipeline_depth
+    modules.globals.live_latency_budget = args.live_latency_budget
+    modules.globals.live_target_fps = args.live_target_fps
+    modules.globals.live_video_path = args.live_video_path
+    modules.globals.live = args.live
+    modules.globals.server = args.server
+    modules.globals.server_port = args.server_port
+    modules.globals.server_max_jobs = args.server_max_jobs
+    modules.globals.watch = args.watch
+    modules.globals.watch_interval = args.watch_interval
+    modules.globals.watch_settle = args.watch_settle
+    modules.globals.queue_path = args.queue_path
+    modules.globals.queue_class_limits = args.queue_class_limits
+    modules.globals.job_retries = args.job_retries
+    modules.globals.job_priority = args.job_priority
+    modules.globals.live_camera_index = args.live_camera_index
+    modules.globals.live_output_path = args.live_output_path
+    modules.globals.live_output_mode = args.live_output_mode
+    modules.globals.live_record_path = args.live_record_path
+    modules.globals.live_record_audio = args.live_record_audio
     modules.globals.max_memory = args.max_memory
     modules.globals.execution_providers = decode_execution_providers(args.execution_provider)
     modules.globals.execution_threads = args.execution_threads
@@ -142,10 +206,12 @@ def suggest_execution_threads() -> int:
 
 
 def limit_resources() -> None:
-    # prevent tensorflow memory leak
-    gpus = tensorflow.config.experimental.list_physical_devices('GPU')
-    for gpu in gpus:
-        tensorflow.config.experimental.set_memory_growth(gpu, True)
+    # prevent tensorflow memory leak, only the opennsfw2 backend pulls tensorflow in
+    if modules.globals.nsfw_filter and modules.globals.nsfw_backend == 'opennsfw2':
+        import tensorflow
+        gpus = tensorflow.config.experimental.list_physical_devices('GPU')
+        for gpu in gpus:
+            tensorflow.config.experimental.set_memory_growth(gpu, True)
     # limit memory usage
     if modules.globals.max_memory:
         memory = modules.globals.max_memory * 1024 ** 3
@@ -172,101 +238,238 @@ def pre_check() -> bool:
     if not shutil.which('ffmpeg'):
         update_status('ffmpeg is not installed.')
         return False
+    # the face maps are process globals tied to one target, jobs running side by side would share them
+    if modules.globals.map_faces and (modules.globals.server or modules.globals.watch or modules.globals.queue_path):
+        update_status('Map faces is not supported in server, watch or queue mode.')
+        return False
+    if modules.globals.nsfw_filter:
+        # a plain import would make modules local to this function
+        from modules import predicter
+        if not predicter.pre_check():
+            return False
     return True
 
 
 def update_status(message: str, scope: str = 'DLC.CORE') -> None:
     print(f'[{scope}] {message}')
+    report_status = get_job_status_reporter()
+    if report_status:
+        report_status(message, scope)
     if not modules.globals.headless:
         ui.update_status(message)
 
-def start() -> None:
-
-    if modules.globals.source_folder is not None and  os.path.exists(modules.globals.source_folder):
+def get_job_paths() -> List[Tuple[str, str, str]]:
+    """Return the (source, target, output) triples of -s/-t/-o or of the cross product of -sf/-tf into -of."""
+    is_source_folder = modules.globals.source_folder is not None and os.path.exists(modules.globals.source_folder)
+    is_target_folder = modules.globals.target_folder is not None and os.path.exists(modules.globals.target_folder)
+    if is_source_folder:
         sourceFiles = next(os.walk(modules.globals.source_folder), (None, None, []))[2]
-        modules.globals.source_path = os.path.join(modules.globals.source_folder, sourceFiles[0])
+        source_paths = [os.path.join(modules.globals.source_folder, source_file) for source_file in sourceFiles]
     else:
-        sourceFiles = [modules.globals.source_path]
+        source_paths = [modules.globals.source_path]
 
-    if modules.globals.target_folder is not None and  os.path.exists(modules.globals.target_folder):
+    if is_target_folder:
         targetFiles = next(os.walk(modules.globals.target_folder), (None, None, []))[2]
-        modules.globals.target_path = os.path.join(modules.globals.target_folder, targetFiles[0])
+        target_paths = [os.path.join(modules.globals.target_folder, target_file) for target_file in targetFiles]
     else:
-        targetFiles = [modules.globals.target_path]
-    
-    
+        target_paths = [modules.globals.target_path]
+
+    job_paths = []
+    for source_path in source_paths:
+        for target_path in target_paths:
+            if is_source_folder or is_target_folder:
+                output_path = get_folder_output_path(source_path, target_path)
+            else:
+                output_path = modules.globals.output_path
+            job_paths.append((source_path, target_path, output_path))
+    return job_paths
+
+
+def get_folder_output_path(source_path: Optional[str], target_path: str) -> str:
+    source_name = os.path.splitext(os.path.basename(source_path))[0] if source_path else ''
+    return os.path.join(modules.globals.output_path, f"{source_name}_{os.path.basename(target_path)}")
+
+
+def start() -> None:
+    job_paths = get_job_paths()
+    if modules.globals.queue_path:
+        # imported here, the server module imports this one
+        from modules.server import run_queue
+        # --queue on its own only drains the jobs left in the queue
+        run_queue([job_path for job_path in job_paths if job_path[1]])
+        return
+    if job_paths:
+        modules.globals.source_path, modules.globals.target_path = job_paths[0][:2]
+
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
         if not frame_processor.pre_start():
             return
         
-    OUTPUT_FOLDER = modules.globals.output_path
-    for source_file in sourceFiles:
-        modules.globals.source_path = os.path.join(modules.globals.source_folder, source_file)
+    if modules.globals.map_faces and modules.globals.identity_gallery_path:
+        modules.face_analyser.add_maps_to_identity_gallery()
+
+    for source_path, target_path, output_path in job_paths:
+        modules.globals.source_path = source_path
+        modules.globals.target_path = target_path
+        modules.globals.output_path = output_path
         print("Source path:", modules.globals.source_path )
-        source_name = os.path.splitext(os.path.basename(source_file))[0]
-        for target_file in targetFiles:
-            modules.globals.target_path = os.path.join(modules.globals.target_folder, target_file)
-            modules.globals.output_path = os.path.join(OUTPUT_FOLDER, f"{source_name}_{os.path.basename(target_file)}")
-            
-            print("output path:", modules.globals.output_path )
-            
-            update_status('Processing...')
-            # process image to image
-            if has_image_extension(modules.globals.target_path):
-                if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(modules.globals.target_path, destroy):
-                    return
-                try:
-                    shutil.copy2(modules.globals.target_path, modules.globals.output_path)
-                except Exception as e:
-                    print("Error copying file:", str(e))
-                for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                    update_status('Progressing...', frame_processor.NAME)
-                    frame_processor.process_image(modules.globals.source_path, modules.globals.output_path, modules.globals.output_path)
-                    release_resources()
-                if is_image(modules.globals.target_path):
-                    update_status('Processing to image succeed!')
-                else:
-                    update_status('Processing to image failed!')
-                continue
-            # process image to videos
-            if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(modules.globals.target_path, destroy):
-                continue
+        print("output path:", modules.globals.output_path )
+        
+        if process_job(modules.globals.source_path, modules.globals.target_path, modules.globals.output_path) is None:
+            return
 
-            if not modules.globals.map_faces:
-                update_status('Creating temp resources...')
-                create_temp(modules.globals.target_path)
-                update_status('Extracting frames...')
-                extract_frames(modules.globals.target_path)
-
-            temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
-            for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-                update_status('Progressing...', frame_processor.NAME)
-                frame_processor.process_video(modules.globals.source_path, temp_frame_paths)
-                release_resources()
-            # handles fps
-            if modules.globals.keep_fps:
-                update_status('Detecting fps...')
-                fps = detect_fps(modules.globals.target_path)
-                update_status(f'Creating video with {fps} fps...')
-                create_video(modules.globals.target_path, fps)
-            else:
-                update_status('Creating video with 30.0 fps...')
-                create_video(modules.globals.target_path)
-            # handle audio
-            if modules.globals.keep_audio:
-                if modules.globals.keep_fps:
-                    update_status('Restoring audio...')
-                else:
-                    update_status('Restoring audio might cause issues as fps are not kept...')
-                restore_audio(modules.globals.target_path, modules.globals.output_path)
-            else:
-                move_temp(modules.globals.target_path, modules.globals.output_path)
-            # clean and validate
-            clean_temp(modules.globals.target_path)
-            if is_video(modules.globals.target_path):
-                update_status('Processing to video succeed!')
-            else:
-                update_status('Processing to video failed!')
+
+def process_job(source_path: str, target_path: str, output_path: str, frame_processors: List[ModuleType] = None) -> Optional[bool]:
+    """Process one source/target pair into output_path.
+
+    Paths are passed explicitly so jobs sharing the same options can run on
+    several threads. Returns whether an output was produced, or None when an
+    NSFW image target stops the run.
+    """
+    if frame_processors is None:
+        frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    update_status('Processing...')
+    # process image to image
+    if has_image_extension(target_path):
+        if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(target_path):
+            return None
+        try:
+            shutil.copy2(target_path, output_path)
+        except Exception as e:
+            print("Error copying file:", str(e))
+        for frame_processor in frame_processors:
+            update_status('Progressing...', frame_processor.NAME)
+            frame_processor.process_image(source_path, output_path, output_path)
+            release_resources()
+        if is_image(target_path):
+            update_status('Processing to image succeed!')
+            return True
+        update_status('Processing to image failed!')
+        return False
+    # process image to videos
+    if not modules.globals.map_faces:
+        update_status('Creating temp resources...')
+        create_temp(target_path)
+        update_status('Extracting frames...')
+        extract_frames(target_path)
+    check_cancelled()
+
+    temp_frame_paths = get_temp_frame_paths(target_path)
+    # screen the extracted frames instead of decoding the target a second time
+    if modules.globals.nsfw_filter:
+        from modules.predicter import predict_frame_paths
+        update_status('Screening frames...')
+        if predict_frame_paths(temp_frame_paths):
+            clean_temp(target_path)
+            update_status('Processing ignored!')
+            return False
+    changed_frame_paths = prepare_incremental_render(temp_frame_paths)
+    if len(changed_frame_paths) < len(temp_frame_paths):
+        update_status(f'Re-rendering {len(changed_frame_paths)} of {len(temp_frame_paths)} frames...')
+    for frame_processor in frame_processors:
+        update_status('Progressing...', frame_processor.NAME)
+        if changed_frame_paths:
+            frame_processor.process_video(source_path, changed_frame_paths)
+        release_resources()
+    save_incremental_render(temp_frame_paths, changed_frame_paths)
+    # handles fps
+    if modules.globals.keep_fps:
+        update_status('Detecting fps...')
+        fps = detect_fps(target_path)
+        update_status(f'Creating video with {fps} fps...')
+        create_video(target_path, fps)
+    else:
+        update_status('Creating video with 30.0 fps...')
+        create_video(target_path)
+    # handle audio
+    if modules.globals.keep_audio:
+        if modules.globals.keep_fps:
+            update_status('Restoring audio...')
+        else:
+            update_status('Restoring audio might cause issues as fps are not kept...')
+        restore_audio(target_path, output_path)
+    else:
+        move_temp(target_path, output_path)
+    # clean and validate
+    clean_temp(target_path)
+    if is_video(target_path):
+        update_status('Processing to video succeed!')
+        return True
+    update_status('Processing to video failed!')
+    return False
+
+
+def start_live() -> None:
+    if not modules.globals.identity_gallery_path and not is_image(modules.globals.source_path):
+        update_status('Select an image for source path.')
+        return
+    capturer = VideoCapturer(modules.globals.live_video_path or modules.globals.live_camera_index)
+    if not capturer.start():
+        update_status('Failed to start camera')
+        return
+    controller = None
+    if modules.globals.live_target_fps:
+        controller = QualityController(modules.globals.live_target_fps, modules.globals.live_latency_budget / 1000)
+    fps = capturer.cap.get(cv2.CAP_PROP_FPS) or 30
+    recorder = create_live_recorder(fps)
+    pipeline = LivePipeline(
+        capturer,
+        get_frame_processors_modules(modules.globals.frame_processors),
+        depth=modules.globals.live_pipeline_depth,
+        latency_budget=modules.globals.live_latency_budget / 1000,
+        controller=controller,
+        recorder=recorder,
+    )
+    writer = create_stream_writer(modules.globals.live_output_mode, modules.globals.live_output_path)
+    update_status('Streaming live frames...')
+    pipeline.start()
+    # no event loop here, the main thread only moves finished frames to the sink
+    try:
+        while pipeline.is_running:
+            frame = pipeline.get_frame(timeout=0.1)
+            if frame is None:
+                continue
+            if not writer.is_open:
+                writer.open(frame.shape[1], frame.shape[0], fps)
+            if not writer.write(frame):
+                update_status('Live output closed.')
+                break
+    finally:
+        pipeline.stop()
+        capturer.release()
+        writer.close()
+        if pipeline.error:
+            update_status(f'Live session stopped: {pipeline.error}')
+        if recorder:
+            recorder.close()
+            update_status(f'Recorded {recorder.frame_count} frames, dropped {recorder.dropped}')
+        if pipeline.latencies:
+            update_status(f'Live session {pipeline.get_latency_text()}, dropped {capturer.dropped + pipeline.dropped} frames')
+
+
+def warm_up() -> None:
+    warm_ups = {'DLC.FACE-ANALYSER': modules.face_analyser.warm_up}
+    for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
+        if hasattr(frame_processor, 'warm_up'):
+            warm_ups[frame_processor.NAME] = frame_processor.warm_up
+    if modules.globals.nsfw_filter:
+        # a plain import would make modules local to this function
+        from modules import predicter
+        warm_ups['DLC.PREDICTER'] = predicter.warm_up
+
+    def timed_warm_up(warm_up_model: Callable[[], None]) -> float:
+        start_time = time.perf_counter()
+        warm_up_model()
+        return time.perf_counter() - start_time
+
+    update_status('Warming up models...')
+    with ThreadPoolExecutor(max_workers=len(warm_ups)) as executor:
+        futures = {name: executor.submit(timed_warm_up, warm_up_model) for name, warm_up_model in warm_ups.items()}
+    for name, future in futures.items():
+        try:
+            update_status(f'Model ready in {future.result():.2f}s', name)
+        except Exception as exception:
+            update_status(f'Warm-up failed: {exception}', name)
 
 
 def destroy(to_quit=True) -> None:
@@ -277,6 +480,9 @@ def destroy(to_quit=True) -> None:
 
 def run() -> None:
     parse_args()
+    # the stream owns stdout, status messages go to stderr instead
+    if modules.globals.live and modules.globals.live_output_mode == 'ffmpeg' and modules.globals.live_output_path == '-':
+        sys.stdout = sys.stderr
     if not pre_check():
         return
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
@@ -284,7 +490,16 @@ def run() -> None:
         if not frame_processor.pre_check():
             return
     limit_resources()
-    if modules.globals.headless:
+    warm_up()
+    if modules.globals.server:
+        from modules.server import serve
+        serve()
+    elif modules.globals.watch:
+        from modules.watcher import watch
+        watch()
+    elif modules.globals.live:
+        start_live()
+    elif modules.globals.headless:
         start()
     else:
         window = ui.init(start, destroy, modules.globals.lang)
@@ -1,29 +1,192 @@
+import hashlib
+import json
 import os
 import shutil
-from typing import Any
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 import insightface
 
 import cv2
 import numpy as np
 import modules.globals
 from tqdm import tqdm
-from modules.typing import Frame
-from modules.cluster_analysis import find_cluster_centroids, find_closest_centroid
-from modules.utilities import get_temp_directory_path, create_temp, extract_frames, clean_temp, get_temp_frame_paths
+from modules.typing import Face, Frame
+from modules.cluster_analysis import find_cluster_centroids
+from modules.face_store import FaceStore
+from modules.processors.frame.core import check_cancelled
+from modules.utilities import get_temp_directory_path, create_temp, extract_frames, clean_temp, get_temp_frame_paths, get_analysis_directory_path, get_file_hash, detect_fps
 from pathlib import Path
 
 FACE_ANALYSER = None
+FACE_ANALYSER_NAME = 'buffalo_l'
+FACE_ANALYSER_DET_SIZE = (640, 640)
+IDENTITY_GALLERY = None
+SCENE_CUT_CORRELATION = 0.6
+LOW_CONFIDENCE_MEMBERS = 3
+LOW_CONFIDENCE_SIMILARITY = 0.5
+IDENTITY_GALLERY_LOCK = threading.Lock()
+# a mapper session picks a handful of images, the oldest detections are dropped beyond this
+FILE_FACES_SIZE = 64
+FILE_FACES: 'OrderedDict[Tuple[str, float, int], Any]' = OrderedDict()
+FILE_FACES_LOCK = threading.Lock()
 
 
 def get_face_analyser() -> Any:
     global FACE_ANALYSER
 
     if FACE_ANALYSER is None:
-        FACE_ANALYSER = insightface.app.FaceAnalysis(name='buffalo_l', providers=modules.globals.execution_providers)
-        FACE_ANALYSER.prepare(ctx_id=0, det_size=(640, 640))
+        FACE_ANALYSER = insightface.app.FaceAnalysis(name=FACE_ANALYSER_NAME, providers=modules.globals.execution_providers)
+        FACE_ANALYSER.prepare(ctx_id=0, det_size=FACE_ANALYSER_DET_SIZE)
     return FACE_ANALYSER
 
 
+def set_detection_size(size: int) -> None:
+    # the detector reads input_size per call, so live mode can trade accuracy for speed on the fly
+    get_face_analyser().det_model.input_size = (size, size)
+
+
+def reset_detection_size() -> None:
+    get_face_analyser().det_model.input_size = FACE_ANALYSER_DET_SIZE
+
+
+def warm_up() -> None:
+    face_analyser = get_face_analyser()
+    # an empty frame only reaches the detector, the recognition model needs its own aligned crop
+    face_analyser.get(np.zeros((640, 640, 3), dtype=np.uint8))
+    if 'recognition' in face_analyser.models:
+        face_analyser.models['recognition'].get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+
+
+class IdentityGallery:
+    """On-disk gallery of target identities with the source face each one swaps to.
+
+    Target and source embeddings are kept as row-normalized float32 matrices, so a
+    top-k cosine search is a blocked matmul. Large galleries can add a coarse
+    quantizer (inverted lists over k-means cells) and only probe the closest cells.
+    """
+
+    BLOCK_SIZE = 65536
+    # a rerun of the same target detects the same faces again, nearly identical embeddings are one identity
+    DUPLICATE_SIMILARITY = 0.98
+
+    def __init__(self, target_embeddings: Any = None, source_embeddings: Any = None):
+        self.target_embeddings = np.empty((0, 512), dtype=np.float32) if target_embeddings is None else np.asarray(target_embeddings, dtype=np.float32)
+        self.source_embeddings = np.empty((0, 512), dtype=np.float32) if source_embeddings is None else np.asarray(source_embeddings, dtype=np.float32)
+        self.coarse_centroids = None
+        self.coarse_assignments = None
+        # bumped on every change, so caches of swapped frames can tell the gallery changed
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.target_embeddings)
+
+    def add(self, target_embedding: Any, source_embedding: Any) -> bool:
+        """Add a mapping, or point a known target at the new source; returns whether a row was added."""
+        target_embedding = np.asarray(target_embedding, dtype=np.float32).reshape(1, -1)
+        source_embedding = np.asarray(source_embedding, dtype=np.float32).reshape(1, -1)
+        target_embedding = target_embedding / np.linalg.norm(target_embedding)
+        source_embedding = source_embedding / np.linalg.norm(source_embedding)
+        self.version += 1
+        if len(self):
+            similarities = self.target_embeddings @ target_embedding[0]
+            index = int(np.argmax(similarities))
+            if similarities[index] >= self.DUPLICATE_SIMILARITY:
+                self.source_embeddings[index] = source_embedding[0]
+                return False
+        self.target_embeddings = np.vstack([self.target_embeddings, target_embedding])
+        self.source_embeddings = np.vstack([self.source_embeddings, source_embedding])
+        self.coarse_centroids = None
+        self.coarse_assignments = None
+        return True
+
+    def build_coarse_index(self, n_lists: int = None) -> None:
+        from sklearn.cluster import MiniBatchKMeans
+
+        if not len(self):
+            return
+        n_lists = min(max(1, n_lists or int(np.sqrt(len(self)))), len(self))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=1, random_state=0).fit(self.target_embeddings)
+        self.coarse_centroids = (kmeans.cluster_centers_ / np.linalg.norm(kmeans.cluster_centers_, axis=1, keepdims=True)).astype(np.float32)
+        self.coarse_assignments = kmeans.labels_.astype(np.int32)
+
+    def search(self, normed_embeddings: Any, k: int = 1, n_probe: int = 16) -> Any:
+        queries = np.asarray(normed_embeddings, dtype=np.float32).reshape(-1, self.target_embeddings.shape[1])
+        if self.coarse_centroids is not None:
+            return self._search_coarse(queries, k, n_probe)
+        return self._search_blocks(queries, np.arange(len(self)), k)
+
+    def _search_blocks(self, queries: Any, candidates: Any, k: int) -> Any:
+        scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        indices = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(candidates), self.BLOCK_SIZE):
+            block = candidates[start:start + self.BLOCK_SIZE]
+            scores = np.hstack([scores, queries @ self.target_embeddings[block].T])
+            indices = np.hstack([indices, np.broadcast_to(block, (len(queries), len(block)))])
+            # keep only the running top-k so memory stays bounded by the block size
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                indices = np.take_along_axis(indices, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def _search_coarse(self, queries: Any, k: int, n_probe: int) -> Any:
+        cells = np.argsort(-(queries @ self.coarse_centroids.T), axis=1)[:, :n_probe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.flatnonzero(np.isin(self.coarse_assignments, cells[i]))
+            query_scores, query_indices = self._search_blocks(query[None, :], candidates, k)
+            scores[i, :query_scores.shape[1]] = query_scores[0]
+            indices[i, :query_indices.shape[1]] = query_indices[0]
+        return scores, indices
+
+    def source_face(self, index: int) -> Any:
+        return Face(embedding=self.source_embeddings[index])
+
+    def save(self, path: str) -> None:
+        arrays = {'target_embeddings': self.target_embeddings, 'source_embeddings': self.source_embeddings}
+        if self.coarse_centroids is not None:
+            arrays.update(coarse_centroids=self.coarse_centroids, coarse_assignments=self.coarse_assignments)
+        Path(os.path.dirname(os.path.abspath(path))).mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as file:
+            np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'IdentityGallery':
+        with np.load(path) as arrays:
+            gallery = cls(arrays['target_embeddings'], arrays['source_embeddings'])
+            if 'coarse_centroids' in arrays:
+                gallery.coarse_centroids = arrays['coarse_centroids']
+                gallery.coarse_assignments = arrays['coarse_assignments']
+        return gallery
+
+
+def get_identity_gallery() -> Any:
+    global IDENTITY_GALLERY
+
+    with IDENTITY_GALLERY_LOCK:
+        if IDENTITY_GALLERY is None and modules.globals.identity_gallery_path:
+            if os.path.isfile(modules.globals.identity_gallery_path):
+                IDENTITY_GALLERY = IdentityGallery.load(modules.globals.identity_gallery_path)
+            else:
+                IDENTITY_GALLERY = IdentityGallery()
+    return IDENTITY_GALLERY
+
+
+def add_maps_to_identity_gallery() -> None:
+    gallery = get_identity_gallery()
+    if gallery is None:
+        return
+    for map in modules.globals.source_target_map:
+        if "source" in map and "target" in map:
+            gallery.add(map['target']['face'].normed_embedding, map['source']['face'].normed_embedding)
+    if modules.globals.identity_gallery_coarse and gallery.coarse_centroids is None:
+        gallery.build_coarse_index()
+    gallery.save(modules.globals.identity_gallery_path)
+
+
 def get_one_face(frame: Frame) -> Any:
     face = get_face_analyser().get(frame)
     try:
@@ -32,6 +195,28 @@ def get_one_face(frame: Frame) -> Any:
         return None
 
 
+def get_one_face_from_file(image_path: str) -> Optional[Tuple[Face, Frame]]:
+    """Detect the face used for mapping in an image file, with its crop; cached per file version."""
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime, stat.st_size)
+    with FILE_FACES_LOCK:
+        if key in FILE_FACES:
+            FILE_FACES.move_to_end(key)
+            return FILE_FACES[key]
+    image = cv2.imread(image_path)
+    face = get_one_face(image)
+    result = None
+    if face:
+        x_min, y_min, x_max, y_max = face["bbox"]
+        # copied so the cache does not keep the whole image alive
+        result = face, image[int(y_min): int(y_max), int(x_min): int(x_max)].copy()
+    with FILE_FACES_LOCK:
+        FILE_FACES[key] = result
+        while len(FILE_FACES) > FILE_FACES_SIZE:
+            FILE_FACES.popitem(last=False)
+    return result
+
+
 def get_many_faces(frame: Frame) -> Any:
     try:
         return get_face_analyser().get(frame)
@@ -58,7 +243,10 @@ def simplify_maps() -> Any:
             centroids.append(map['target']['face'].normed_embedding)
             faces.append(map['source']['face'])
 
-    modules.globals.simple_map = {'source_faces': faces, 'target_embeddings': centroids}
+    # one normalized matrix so every detected face of a frame is matched in a single matmul
+    target_embeddings = np.array(centroids, dtype=np.float32).reshape(-1, 512)
+    target_embeddings /= np.maximum(np.linalg.norm(target_embeddings, axis=1, keepdims=True), 1e-12)
+    modules.globals.simple_map = {'source_faces': faces, 'target_embeddings': target_embeddings}
     return None
 
 def add_blank_map() -> Any:
@@ -97,78 +285,181 @@ def get_unique_faces_from_target_image() -> Any:
 def get_unique_faces_from_target_video() -> Any:
     try:
         modules.globals.source_target_map = []
-        frame_face_embeddings = []
-        face_embeddings = []
-    
+
         print('Creating temp resources...')
         clean_temp(modules.globals.target_path)
         create_temp(modules.globals.target_path)
         print('Extracting frames...')
         extract_frames(modules.globals.target_path)
-
-        temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
-
-        i = 0
-        for temp_frame_path in tqdm(temp_frame_paths, desc="Extracting face embeddings from frames"):
-            temp_frame = cv2.imread(temp_frame_path)
-            many_faces = get_many_faces(temp_frame)
-
-            for face in many_faces:
-                face_embeddings.append(face.normed_embedding)
-            
-            frame_face_embeddings.append({'frame': i, 'faces': many_faces, 'location': temp_frame_path})
-            i += 1
-
-        centroids = find_cluster_centroids(face_embeddings)
-
-        for frame in frame_face_embeddings:
-            for face in frame['faces']:
-                closest_centroid_index, _ = find_closest_centroid(centroids, face.normed_embedding)
-                face['target_centroid'] = closest_centroid_index
+        check_cancelled()
+
+        temp_frame_paths = sorted(get_temp_frame_paths(modules.globals.target_path))
+        analysis_directory_path = get_analysis_directory_path(modules.globals.target_path, get_analysis_key())
+        if load_target_analysis(analysis_directory_path):
+            print('Loaded face analysis from', analysis_directory_path)
+            return None
+
+        store = create_face_store(analysis_directory_path)
+
+        if modules.globals.analysis_sample_fps:
+            # discovery only sees sampled frames, the rest are assigned lazily while swapping
+            for temp_frame_path, faces in sample_target_faces(temp_frame_paths).items():
+                store.add_frame(temp_frame_path, faces)
+            store.sampled = True
+        else:
+            for temp_frame_path in tqdm(temp_frame_paths, desc="Extracting face embeddings from frames"):
+                check_cancelled()
+                temp_frame = cv2.imread(temp_frame_path)
+                store.add_frame(temp_frame_path, get_many_faces(temp_frame) or [])
+        store.finalize()
+
+        centroids = find_cluster_centroids(store.embedding)
+        store.assign_clusters(centroids)
+        modules.globals.target_face_store = store
 
         for i in range(len(centroids)):
             modules.globals.source_target_map.append({
                 'id' : i
             })
 
-            temp = []
-            for frame in tqdm(frame_face_embeddings, desc=f"Mapping frame embeddings to centroids-{i}"):
-                temp.append({'frame': frame['frame'], 'faces': [face for face in frame['faces'] if face['target_centroid'] == i], 'location': frame['location']})
-
-            modules.globals.source_target_map[i]['target_faces_in_frame'] = temp
-
-        # dump_faces(centroids, frame_face_embeddings)
+        # dump_faces(centroids, store)
         default_target_face()
+        save_target_analysis(analysis_directory_path)
     except ValueError:
         return None
-    
+
+
+def sample_target_faces(temp_frame_paths: List[str]) -> Dict[str, Any]:
+    stride = max(1, int(round(detect_fps(modules.globals.target_path) / modules.globals.analysis_sample_fps)))
+    frames = set(range(0, len(temp_frame_paths), stride))
+    frames.update(find_scene_cuts(temp_frame_paths))
+
+    detections = {}
+    detect_target_faces(temp_frame_paths, frames, detections)
+    frames = densify_target_frames(detections, stride, len(temp_frame_paths))
+    if frames:
+        detect_target_faces(temp_frame_paths, frames, detections)
+    return {temp_frame_paths[frame]: detections[frame] for frame in sorted(detections)}
+
+
+def detect_target_faces(temp_frame_paths: List[str], frames: Any, detections: Dict[int, Any]) -> None:
+    for frame in tqdm(sorted(frames), desc="Extracting face embeddings from sampled frames"):
+        check_cancelled()
+        if frame not in detections:
+            detections[frame] = get_many_faces(cv2.imread(temp_frame_paths[frame])) or []
+
+
+def find_scene_cuts(temp_frame_paths: List[str]) -> List[int]:
+    # a coarse grayscale histogram is enough to spot hard cuts, where new faces tend to appear
+    scene_cuts = []
+    previous_histogram = None
+    for frame, temp_frame_path in enumerate(tqdm(temp_frame_paths, desc="Detecting scene cuts")):
+        check_cancelled()
+        temp_frame = cv2.imread(temp_frame_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if temp_frame is None:
+            continue
+        histogram = cv2.calcHist([temp_frame], [0], None, [32], [0, 256])
+        cv2.normalize(histogram, histogram)
+        if previous_histogram is not None and cv2.compareHist(previous_histogram, histogram, cv2.HISTCMP_CORREL) < SCENE_CUT_CORRELATION:
+            scene_cuts.append(frame)
+        previous_histogram = histogram
+    return scene_cuts
+
+
+def densify_target_frames(detections: Dict[int, Any], stride: int, frame_count: int) -> List[int]:
+    frames = [frame for frame, faces in detections.items() for _ in faces]
+    if stride == 1 or len(frames) < 2:
+        return []
+    embeddings = np.array([face.normed_embedding for faces in detections.values() for face in faces], dtype=np.float32)
+    similarities = embeddings @ np.asarray(find_cluster_centroids(embeddings), dtype=np.float32).T
+    clusters = np.argmax(similarities, axis=1)
+    frames = np.array(frames)
+
+    dense_frames = set()
+    for cluster in np.unique(clusters):
+        members = clusters == cluster
+        # small or loose clusters get extra frames between their sampled neighbours
+        if members.sum() < LOW_CONFIDENCE_MEMBERS or similarities[members, cluster].mean() < LOW_CONFIDENCE_SIMILARITY:
+            for frame in frames[members]:
+                for offset in range(-stride + 1, stride, max(1, stride // 4)):
+                    if 0 <= frame + offset < frame_count and frame + offset not in detections:
+                        dense_frames.add(int(frame + offset))
+    return sorted(dense_frames)
+
+
+def get_analysis_key() -> str:
+    # anything that changes detections or clusters has to invalidate the saved analysis
+    settings = {
+        'target': get_file_hash(modules.globals.target_path),
+        'analyser': FACE_ANALYSER_NAME,
+        'det_size': FACE_ANALYSER_DET_SIZE,
+        'max_k': 10,
+        'float16': modules.globals.face_store_float16,
+        'sample_fps': modules.globals.analysis_sample_fps,
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def save_target_analysis(analysis_directory_path: str) -> None:
+    store = modules.globals.target_face_store
+    Path(analysis_directory_path).mkdir(parents=True, exist_ok=True)
+    targets = {}
+    for map in modules.globals.source_target_map:
+        if 'target' in map:
+            targets[map['id']] = int(map['target']['row'])
+            cv2.imwrite(os.path.join(analysis_directory_path, f"target_{map['id']}.png"), map['target']['cv2'])
+    store.save(analysis_directory_path, {'targets': targets})
+
+
+def load_target_analysis(analysis_directory_path: str) -> bool:
+    temp_directory_path = get_temp_directory_path(modules.globals.target_path)
+    store = FaceStore.load(analysis_directory_path, temp_directory_path, modules.globals.face_store_mmap)
+    if store is None:
+        return False
+    modules.globals.target_face_store = store
+    targets = store.metadata.get('targets', {})
+    for i in range(len(store.centroids)):
+        map = {'id' : i}
+        if str(i) in targets:
+            row = targets[str(i)]
+            map['target'] = {
+                            'cv2' : cv2.imread(os.path.join(analysis_directory_path, f"target_{i}.png")),
+                            'face' : store.face(row),
+                            'row' : row
+                            }
+        modules.globals.source_target_map.append(map)
+    return True
+
+
+def create_face_store(analysis_directory_path: str) -> FaceStore:
+    embedding_dtype = np.float16 if modules.globals.face_store_float16 else np.float32
+    directory = None
+    if modules.globals.face_store_mmap:
+        # not under temp, clean_temp removes that while the store still maps its files
+        directory = os.path.join(analysis_directory_path, 'faces')
+    return FaceStore(embedding_dtype, directory)
+
 
 def default_target_face():
+    store = modules.globals.target_face_store
     for map in modules.globals.source_target_map:
-        best_face = None
-        best_frame = None
-        for frame in map['target_faces_in_frame']:
-            if len(frame['faces']) > 0:
-                best_face = frame['faces'][0]
-                best_frame = frame
-                break
-
-        for frame in map['target_faces_in_frame']:
-            for face in frame['faces']:
-                if face['det_score'] > best_face['det_score']:
-                    best_face = face
-                    best_frame = frame
+        rows = store.rows(cluster=map['id'])
+        if len(rows) == 0:
+            continue
+        best_row = rows[np.argmax(store.det_score[rows])]
+        best_face = store.face(best_row)
 
         x_min, y_min, x_max, y_max = best_face['bbox']
 
-        target_frame = cv2.imread(best_frame['location'])
+        target_frame = cv2.imread(store.locations[store.frame[best_row]])
         map['target'] = {
                         'cv2' : target_frame[int(y_min):int(y_max), int(x_min):int(x_max)],
-                        'face' : best_face
+                        'face' : best_face,
+                        'row' : best_row
                         }
 
 
-def dump_faces(centroids: Any, frame_face_embeddings: list):
+def dump_faces(centroids: Any, store: FaceStore):
     temp_directory_path = get_temp_directory_path(modules.globals.target_path)
 
     for i in range(len(centroids)):
@@ -176,14 +467,12 @@ def dump_faces(centroids: Any, frame_face_embeddings: list):
             shutil.rmtree(temp_directory_path + f"/{i}")
         Path(temp_directory_path + f"/{i}").mkdir(parents=True, exist_ok=True)
 
-        for frame in tqdm(frame_face_embeddings, desc=f"Copying faces to temp/./{i}"):
-            temp_frame = cv2.imread(frame['location'])
+        rows = store.rows(cluster=i)
+        for frame in tqdm(np.unique(store.frame[rows]), desc=f"Copying faces to temp/./{i}"):
+            temp_frame = cv2.imread(store.locations[frame])
 
-            j = 0
-            for face in frame['faces']:
-                if face['target_centroid'] == i:
-                    x_min, y_min, x_max, y_max = face['bbox']
+            for j, row in enumerate(rows[store.frame[rows] == frame]):
+                x_min, y_min, x_max, y_max = store.bbox[row]
 
-                    if temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)].size > 0:
-                        cv2.imwrite(temp_directory_path + f"/{i}/{frame['frame']}_{j}.png", temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)])
-                j += 1
\ No newline at end of file
+                if temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)].size > 0:
+                    cv2.imwrite(temp_directory_path + f"/{i}/{frame}_{j}.png", temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)])
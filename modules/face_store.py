@@ -0,0 +1,190 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from modules.typing import Face
+
+EMBEDDING_SIZE = 512
+ASSIGN_BLOCK_SIZE = 65536
+
+
+class FaceStore:
+    """Columnar storage for every face detected in a target video.
+
+    One row per detection, rows ordered by frame. Columns are contiguous numpy
+    arrays (optionally memory-mapped from ``directory``), so mapping and swapping
+    read views instead of keeping an insightface ``Face`` per detection alive.
+    """
+
+    COLUMNS = {
+        'frame': ((), np.int32),
+        'bbox': ((4,), np.float32),
+        'kps': ((5, 2), np.float32),
+        'det_score': ((), np.float32),
+        'cluster': ((), np.int32),
+    }
+
+    def __init__(self, embedding_dtype: Any = np.float32, directory: Optional[str] = None):
+        self.embedding_dtype = np.dtype(embedding_dtype)
+        self.directory = directory
+        self.locations: List[str] = []
+        self.location_index: Dict[str, int] = {}
+        self.frame_offsets = np.zeros(1, dtype=np.int64)
+        self.size = 0
+        self.columns: Dict[str, Any] = {}
+        self.centroids = np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        self.metadata: Dict[str, Any] = {}
+        self.path: Optional[str] = None
+        # sampled stores only hold some frames, the others are detected while swapping
+        self.sampled = False
+        self._buffers: Dict[str, Any] = {name: [] for name in self.column_specs()}
+        self._files: Dict[str, Any] = {}
+        if directory:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self._files = {name: open(os.path.join(directory, f'{name}.bin'), 'wb') for name in self.column_specs()}
+
+    def column_specs(self) -> Dict[str, Any]:
+        return {**self.COLUMNS, 'embedding': ((EMBEDDING_SIZE,), self.embedding_dtype)}
+
+    def add_frame(self, location: str, faces: List[Face]) -> None:
+        frame = len(self.locations)
+        self.locations.append(location)
+        if not faces:
+            return
+        values = {
+            'frame': np.full(len(faces), frame, dtype=np.int32),
+            'bbox': np.array([face.bbox for face in faces], dtype=np.float32),
+            'kps': np.array([face.kps for face in faces], dtype=np.float32),
+            'det_score': np.array([face.det_score for face in faces], dtype=np.float32),
+            'cluster': np.full(len(faces), -1, dtype=np.int32),
+            'embedding': np.array([face.normed_embedding for face in faces], dtype=self.embedding_dtype),
+        }
+        for name, value in values.items():
+            if self._files:
+                self._files[name].write(value.tobytes())
+            else:
+                self._buffers[name].append(value)
+        self.size += len(faces)
+
+    def finalize(self) -> None:
+        for name, (shape, dtype) in self.column_specs().items():
+            if self._files:
+                self._files[name].close()
+                if self.size:
+                    self.columns[name] = np.memmap(os.path.join(self.directory, f'{name}.bin'), dtype=dtype, mode='r+', shape=(self.size,) + shape)
+                else:
+                    self.columns[name] = np.empty((0,) + shape, dtype=dtype)
+            elif self._buffers[name]:
+                self.columns[name] = np.concatenate(self._buffers[name])
+            else:
+                self.columns[name] = np.empty((0,) + shape, dtype=dtype)
+        self._buffers = {}
+        self._files = {}
+        self.build_index()
+
+    def build_index(self) -> None:
+        # rows are appended in frame order, so each frame owns one contiguous slice
+        self.location_index = {location: frame for frame, location in enumerate(self.locations)}
+        self.frame_offsets = np.searchsorted(self.frame, np.arange(len(self.locations) + 1), side='left')
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def frame(self) -> Any:
+        return self.columns['frame']
+
+    @property
+    def bbox(self) -> Any:
+        return self.columns['bbox']
+
+    @property
+    def kps(self) -> Any:
+        return self.columns['kps']
+
+    @property
+    def det_score(self) -> Any:
+        return self.columns['det_score']
+
+    @property
+    def cluster(self) -> Any:
+        return self.columns['cluster']
+
+    @property
+    def embedding(self) -> Any:
+        return self.columns['embedding']
+
+    def assign_clusters(self, centroids: Any) -> None:
+        centroids = np.asarray(centroids, dtype=np.float32)
+        self.centroids = centroids
+        # blocked so a memory-mapped store never materialises every embedding in float32
+        for start in range(0, self.size, ASSIGN_BLOCK_SIZE):
+            embeddings = np.asarray(self.embedding[start:start + ASSIGN_BLOCK_SIZE], dtype=np.float32)
+            self.cluster[start:start + ASSIGN_BLOCK_SIZE] = np.argmax(embeddings @ centroids.T, axis=1)
+
+    def nearest_clusters(self, faces: List[Face]) -> Any:
+        if not faces:
+            return np.empty(0, dtype=np.int32)
+        embeddings = np.array([face.normed_embedding for face in faces], dtype=np.float32)
+        return np.argmax(embeddings @ self.centroids.T, axis=1)
+
+    def rows(self, frame: Optional[int] = None, cluster: Optional[int] = None) -> Any:
+        mask = np.ones(self.size, dtype=bool)
+        if frame is not None:
+            mask &= self.frame == frame
+        if cluster is not None:
+            mask &= self.cluster == cluster
+        return np.flatnonzero(mask)
+
+    def frame_rows(self, location: str) -> Any:
+        frame = self.location_index.get(location)
+        if frame is None:
+            return np.empty(0, dtype=np.int64)
+        return np.arange(self.frame_offsets[frame], self.frame_offsets[frame + 1])
+
+    def face(self, row: int) -> Face:
+        return Face(
+            bbox=self.bbox[row],
+            kps=self.kps[row],
+            det_score=float(self.det_score[row]),
+            embedding=np.asarray(self.embedding[row], dtype=np.float32),
+            target_centroid=int(self.cluster[row]),
+        )
+
+    def faces(self, rows: Any) -> List[Face]:
+        return [self.face(row) for row in rows]
+
+    def save(self, directory: str, metadata: Dict[str, Any]) -> None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.path = directory
+        for name in self.column_specs():
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(self.columns[name]))
+        np.save(os.path.join(directory, 'centroids.npy'), self.centroids)
+        # frame paths live in a per-run temp directory, only their names are stable
+        self.metadata = {**metadata, 'sampled': self.sampled, 'locations': [os.path.basename(location) for location in self.locations]}
+        with open(os.path.join(directory, 'analysis.json'), 'w') as file:
+            json.dump(self.metadata, file)
+
+    @classmethod
+    def load(cls, directory: str, frame_directory: str, mmap: bool = False) -> Optional['FaceStore']:
+        metadata_path = os.path.join(directory, 'analysis.json')
+        if not os.path.isfile(metadata_path):
+            return None
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+        store = cls()
+        for name in store.column_specs():
+            store.columns[name] = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+        store.embedding_dtype = store.columns['embedding'].dtype
+        store.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        store.locations = [os.path.join(frame_directory, location) for location in metadata['locations']]
+        store.size = len(store.columns['frame'])
+        store.metadata = metadata
+        store.sampled = metadata.get('sampled', False)
+        store.path = directory
+        store._buffers = {}
+        store.build_index()
+        return store
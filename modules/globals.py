@@ -11,6 +11,14 @@ file_types = [
 
 source_target_map = []
 simple_map = {}
+map_faces_threshold = 0.2
+identity_gallery_path = None
+identity_gallery_coarse = False
+target_face_store = None
+face_store_float16 = False
+analysis_sample_fps = 0
+face_store_mmap = False
+incremental_render = False
 
 source_path = None
 target_path = None
@@ -25,10 +33,31 @@ many_faces = False
 map_faces = False
 color_correction = False  # New global variable for color correction toggle
 nsfw_filter = False
+nsfw_backend = "onnx"
 video_encoder = None
 video_quality = None
 live_mirror = False
 live_resizable = True
+live_pipeline_depth = 2
+live_latency_budget = 0
+live_target_fps = 0
+live_video_path = None
+live = False
+live_camera_index = 0
+live_output_path = "-"
+live_output_mode = "ffmpeg"
+live_record_path = None
+live_record_audio = None
+server = False
+server_port = 8765
+server_max_jobs = 2
+watch = False
+watch_interval = 2.0
+watch_settle = 5.0
+queue_path = None
+queue_class_limits = None
+job_retries = 2
+job_priority = 0
 max_memory = None
 execution_providers: List[str] = []
 execution_threads = None
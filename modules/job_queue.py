@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from modules.utilities import is_video
+
+RESOURCE_CLASSES = ['image', 'video', 'enhancer']
+RETRY_BACKOFF = 30.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    source TEXT,
+    target TEXT NOT NULL,
+    output TEXT NOT NULL,
+    frame_processors TEXT NOT NULL,
+    options TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    resource_class TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, created_at);
+'''
+
+
+def get_resource_class(target_path: str, frame_processors: List[str]) -> str:
+    if 'face_enhancer' in frame_processors:
+        return 'enhancer'
+    if is_video(target_path):
+        return 'video'
+    return 'image'
+
+
+def is_output_current(source_path: Optional[str], target_path: str, output_path: str) -> bool:
+    """Whether the output exists and is newer than its source and target."""
+    if not os.path.isfile(output_path):
+        return False
+    input_paths = [path for path in (source_path, target_path) if path and os.path.isfile(path)]
+    return all(os.path.getmtime(output_path) >= os.path.getmtime(path) for path in input_paths)
+
+
+def parse_class_limits(value: str) -> Dict[str, int]:
+    """Parse ``image=2,video=1`` into per class limits, unnamed classes are unlimited."""
+    class_limits = {}
+    for item in filter(None, (value or '').split(',')):
+        resource_class, _, limit = item.partition('=')
+        if resource_class not in RESOURCE_CLASSES:
+            raise ValueError(f'unknown resource class {resource_class}')
+        class_limits[resource_class] = int(limit)
+        if class_limits[resource_class] < 1:
+            raise ValueError(f'limit of {resource_class} must be at least 1')
+    return class_limits
+
+
+class JobQueue:
+    """Durable job queue in SQLite.
+
+    Jobs are taken by priority and then age. Failed attempts go back to the
+    queue with exponential backoff until ``max_attempts``, and jobs that were
+    running when the process stopped are queued again by ``recover``.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ':memory:':
+                self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(SCHEMA)
+
+    def to_dict(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['frame_processors'] = json.loads(job['frame_processors'])
+        job['options'] = json.loads(job['options'])
+        return job
+
+    def recover(self) -> int:
+        with self.lock:
+            return self.connection.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'").rowcount
+
+    def enqueue(self, source_path: Optional[str], target_path: str, output_path: str, frame_processors: List[str], options: Dict[str, Any], priority: int = 0, max_attempts: int = 1, unique: bool = False) -> Optional[Dict[str, Any]]:
+        """Add a job, or return None when ``unique`` and the same triple is already queued or running."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            if unique:
+                existing = self.connection.execute(
+                    "SELECT 1 FROM jobs WHERE source IS ? AND target = ? AND output = ? AND status IN ('queued', 'running')",
+                    (source_path, target_path, output_path),
+                ).fetchone()
+                if existing:
+                    return None
+            self.connection.execute(
+                'INSERT INTO jobs (id, source, target, output, frame_processors, options, priority, resource_class, status, max_attempts, created_at) '
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, source_path, target_path, output_path, json.dumps(frame_processors), json.dumps(options), priority, get_resource_class(target_path, frame_processors), max(1, max_attempts), time.time()),
+            )
+        return self.get(job_id)
+
+    def next_job(self, excluded_classes: List[str] = ()) -> Optional[Dict[str, Any]]:
+        classes = ', '.join('?' * len(excluded_classes))
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT * FROM jobs WHERE status = 'queued' AND next_attempt_at <= ? AND resource_class NOT IN ({classes}) "
+                'ORDER BY priority DESC, created_at LIMIT 1',
+                (time.time(), *excluded_classes),
+            ).fetchone()
+        return self.to_dict(row)
+
+    def next_attempt_time(self) -> Optional[float]:
+        """Return when the earliest job waiting out its retry backoff becomes ready."""
+        with self.lock:
+            row = self.connection.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE status = 'queued' AND next_attempt_at > ?", (time.time(),)).fetchone()
+        return row[0]
+
+    def claim(self, job_id: str) -> None:
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self.lock:
+            self.connection.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?', (status, error, time.time(), job_id))
+
+    def fail(self, job_id: str, error: Optional[str], retry: bool = True) -> str:
+        job = self.get(job_id)
+        if not retry or job['attempts'] >= job['max_attempts']:
+            self.finish(job_id, 'failed', error)
+            return 'failed'
+        next_attempt_at = time.time() + RETRY_BACKOFF * 2 ** (job['attempts'] - 1)
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = 'queued', error = ?, next_attempt_at = ? WHERE id = ?", (error, next_attempt_at, job_id))
+        return 'queued'
+
+    def cancel(self, job_id: str) -> bool:
+        with self.lock:
+            return self.connection.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self.to_dict(row)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM jobs ORDER BY created_at').fetchall()
+        return [self.to_dict(row) for row in rows]
+
+    def count(self, *statuses: str) -> int:
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' * len(statuses))})", statuses).fetchone()[0]
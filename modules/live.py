@@ -0,0 +1,365 @@
+import queue
+import threading
+import time
+from collections import deque
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import modules.globals
+from modules.face_analyser import get_one_face, set_detection_size, reset_detection_size
+from modules.typing import Frame
+
+
+class FrameSlot:
+    """Single-slot handoff between live stages; a new frame replaces an unread one."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> None:
+        # never blocks, the timeout only lets stages treat the slot like a queue
+        with self._condition:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        with self._condition:
+            if self._item is None:
+                self._condition.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+
+def fit_image_to_size(image: Frame, width: int, height: int) -> Frame:
+    if width is None or height is None or width <= 0 or height <= 0:
+        return image
+    h, w, _ = image.shape
+    ratio_h = 0.0
+    ratio_w = 0.0
+    ratio_w = width / w
+    ratio_h = height / h
+    # Use the smaller ratio to ensure the image fits within the given dimensions
+    ratio = min(ratio_w, ratio_h)
+
+    # Compute new dimensions, ensuring they're at least 1 pixel
+    new_width = max(1, int(ratio * w))
+    new_height = max(1, int(ratio * h))
+    new_size = (new_width, new_height)
+
+    return cv2.resize(image, dsize=new_size)
+
+
+def get_live_source_face() -> Any:
+    if modules.globals.source_path:
+        return get_one_face(cv2.imread(modules.globals.source_path))
+    return None
+
+
+# capture to display latencies kept for the percentile report
+LATENCY_WINDOW = 300
+# a stage failing this many frames in a row (no face in the source, a broken model) ends the session
+MAX_STAGE_ERRORS = 30
+
+QUALITY_LEVELS = [
+    {'detection_size': 640, 'detection_interval': 1, 'scale': 1.0, 'enhancer': True},
+    {'detection_size': 640, 'detection_interval': 1, 'scale': 1.0, 'enhancer': False},
+    {'detection_size': 480, 'detection_interval': 2, 'scale': 1.0, 'enhancer': False},
+    {'detection_size': 320, 'detection_interval': 2, 'scale': 0.75, 'enhancer': False},
+    {'detection_size': 320, 'detection_interval': 3, 'scale': 0.5, 'enhancer': False},
+]
+
+
+class QualityController:
+    """Steps live quality down and up a fixed ladder to hold a target FPS.
+
+    Dropping a level needs a few consecutive slow measurements and raising one
+    needs a longer run of fast ones, so the output does not oscillate between
+    levels around the target.
+    """
+
+    DEGRADE_RATIO = 0.9
+    UPGRADE_RATIO = 1.2
+    DEGRADE_MEASUREMENTS = 2
+    UPGRADE_MEASUREMENTS = 6
+
+    def __init__(self, target_fps: float, latency_budget: float = 0.0):
+        self.target_fps = target_fps
+        self.latency_budget = latency_budget
+        self.level = 0
+        self._slow_count = 0
+        self._fast_count = 0
+        self.apply()
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return QUALITY_LEVELS[self.level]
+
+    def apply(self) -> None:
+        set_detection_size(self.settings['detection_size'])
+
+    def restore(self) -> None:
+        # the analyser is shared with preview and batch jobs, which expect the default size
+        reset_detection_size()
+
+    def update(self, fps: float, latency: float) -> None:
+        is_slow = fps < self.target_fps * self.DEGRADE_RATIO or bool(self.latency_budget and latency > self.latency_budget)
+        is_fast = fps > self.target_fps * self.UPGRADE_RATIO and not (self.latency_budget and latency > self.latency_budget / 2)
+        self._slow_count = self._slow_count + 1 if is_slow else 0
+        self._fast_count = self._fast_count + 1 if is_fast else 0
+        if self._slow_count >= self.DEGRADE_MEASUREMENTS and self.level < len(QUALITY_LEVELS) - 1:
+            self.set_level(self.level + 1)
+        elif self._fast_count >= self.UPGRADE_MEASUREMENTS and self.level > 0:
+            self.set_level(self.level - 1)
+
+    def set_level(self, level: int) -> None:
+        self.level = level
+        self._slow_count = 0
+        self._fast_count = 0
+        self.apply()
+
+    def get_status_text(self) -> str:
+        settings = self.settings
+        return f"Q{self.level} det {settings['detection_size']}/{settings['detection_interval']} scale {settings['scale']:.0%} enh {'on' if settings['enhancer'] else 'off'}"
+
+
+class LivePipeline:
+    """Runs the live frame path as overlapping stages on successive frames.
+
+    Capture keeps only the newest camera frame. Detection, swapping, enhancing
+    and presentation each run on their own thread, linked by queues of
+    ``depth`` frames, so frame N+1 is detected while frame N is swapped. Frames
+    older than ``latency_budget`` seconds are dropped between stages and the
+    output is a single slot, so latency stays bounded when a stage falls behind.
+    A frame a stage fails on is dropped; when a stage keeps failing the
+    pipeline stops with the failure in ``error``, so callers see ``is_running``
+    turn false instead of waiting for frames that never come.
+    """
+
+    def __init__(self, capturer: Any, frame_processors: List[ModuleType], present: Callable[[Frame], Any] = None, depth: int = 2, latency_budget: float = 0.0, controller: QualityController = None, recorder: Any = None):
+        self.capturer = capturer
+        self.controller = controller
+        self.recorder = recorder
+        self.frame_processors = frame_processors
+        self.present = present
+        self.depth = max(1, depth)
+        self.latency_budget = latency_budget
+        self.frame_size: Tuple[int, int] = (0, 0)
+        self.input_slot = FrameSlot()
+        self.output_slot = FrameSlot()
+        self.stage_timings: Dict[str, float] = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.dropped = 0
+        self.fps = 0.0
+        self.is_running = False
+        self.error = None
+        self.source_face = None
+        self._threads: List[threading.Thread] = []
+        self._fps_time = time.time()
+        self._fps_count = 0
+        self._detect_count = 0
+        self._last_faces = None
+
+    def build_stages(self) -> List[Tuple[str, Callable[[Dict[str, Any]], Dict[str, Any]]]]:
+        stages = [('detect', self._detect)]
+        if any(frame_processor.NAME != "DLC.FACE-ENHANCER" for frame_processor in self.frame_processors):
+            stages.append(('swap', self._swap))
+        if any(frame_processor.NAME == "DLC.FACE-ENHANCER" for frame_processor in self.frame_processors):
+            stages.append(('enhance', self._enhance))
+        stages.append(('overlay', self._overlay))
+        if self.present:
+            stages.append(('present', self._present))
+        return stages
+
+    def start(self) -> None:
+        self.is_running = True
+        self.error = None
+        stages = self.build_stages()
+        queues = [self.input_slot] + [queue.Queue(maxsize=self.depth) for _ in stages[1:]] + [self.output_slot]
+        self._threads = [threading.Thread(target=self._capture_loop, name="live-capture", daemon=True)]
+        for i, (name, stage) in enumerate(stages):
+            self._threads.append(threading.Thread(target=self._stage_loop, args=(name, stage, queues[i], queues[i + 1]), name=f"live-{name}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.is_running = False
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
+        if self.controller:
+            self.controller.restore()
+
+    def get_frame(self, timeout: Optional[float] = 0) -> Any:
+        packet = self.output_slot.get(timeout)
+        if packet is None:
+            return None
+        self.latencies.append(time.perf_counter() - packet['captured_at'])
+        return packet['frame']
+
+    def get_latency_percentiles(self) -> Dict[str, float]:
+        if not self.latencies:
+            return {}
+        percentiles = np.percentile(np.array(self.latencies), [50, 90, 99]) * 1000
+        return {'p50': percentiles[0], 'p90': percentiles[1], 'p99': percentiles[2]}
+
+    def get_latency_text(self) -> str:
+        return "latency " + " ".join(f"{name} {value:.0f}ms" for name, value in self.get_latency_percentiles().items())
+
+    def get_timings_text(self) -> str:
+        return " ".join(f"{name} {timing * 1000:.0f}ms" for name, timing in list(self.stage_timings.items()))
+
+    def _capture_loop(self) -> None:
+        while self.is_running:
+            # the capture time comes from the grab itself, so driver and handoff delays count as latency
+            ret, frame, captured_at = self.capturer.read_timestamped(timeout=0.1)
+            if not ret:
+                if not self.capturer.is_running:
+                    self.is_running = False
+                continue
+            self.input_slot.put({'frame': frame, 'captured_at': captured_at})
+
+    def _stage_loop(self, name: str, stage: Callable[[Dict[str, Any]], Dict[str, Any]], source: Any, destination: Any) -> None:
+        errors = 0
+        while self.is_running:
+            try:
+                packet = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if packet is None:
+                continue
+            if self.latency_budget and time.perf_counter() - packet['captured_at'] > self.latency_budget:
+                self.dropped += 1
+                continue
+            start_time = time.perf_counter()
+            try:
+                packet = stage(packet)
+            except Exception as exception:
+                self.dropped += 1
+                errors += 1
+                if errors == 1:
+                    print(f'[DLC.LIVE] {name} failed, dropping the frame: {exception}')
+                if errors >= MAX_STAGE_ERRORS:
+                    self.error = f'{name} failed on {errors} frames in a row: {exception}'
+                    self.is_running = False
+                continue
+            errors = 0
+            # exponential moving average keeps the report steady without storing history
+            elapsed = time.perf_counter() - start_time
+            self.stage_timings[name] = self.stage_timings.get(name, elapsed) * 0.9 + elapsed * 0.1
+            while self.is_running:
+                try:
+                    destination.put(packet, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def _detect(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+        temp_frame = packet['frame'].copy()
+        if modules.globals.live_mirror:
+            temp_frame = cv2.flip(temp_frame, 1)
+        width, height = self.frame_size if all(self.frame_size) else (temp_frame.shape[1], temp_frame.shape[0])
+        detection_interval = 1
+        if self.controller:
+            width, height = int(width * self.controller.settings['scale']), int(height * self.controller.settings['scale'])
+            detection_interval = self.controller.settings['detection_interval']
+        packet['frame'] = fit_image_to_size(temp_frame, width, height)
+        # between detections the previous faces are reused, landmarks lag by at most a few frames
+        if self._detect_count % detection_interval and self._last_faces is not None and self._last_faces[0] == packet['frame'].shape:
+            packet['faces'] = self._last_faces[1]
+        else:
+            packet['faces'] = None
+            for frame_processor in self.frame_processors:
+                if hasattr(frame_processor, 'get_target_faces'):
+                    packet['faces'] = frame_processor.get_target_faces(packet['frame'])
+            self._last_faces = (packet['frame'].shape, packet['faces'])
+        self._detect_count += 1
+        return packet
+
+    def _swap(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+        if not modules.globals.map_faces and self.source_face is None:
+            self.source_face = get_live_source_face()
+        if modules.globals.map_faces:
+            modules.globals.target_path = None
+        for frame_processor in self.frame_processors:
+            if frame_processor.NAME == "DLC.FACE-ENHANCER":
+                continue
+            if modules.globals.map_faces:
+                packet['frame'] = frame_processor.process_frame_v2(packet['frame'], detected_faces=packet['faces'])
+            else:
+                packet['frame'] = frame_processor.process_frame(self.source_face, packet['frame'], packet['faces'])
+        return packet
+
+    def _enhance(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+        if modules.globals.fp_ui["face_enhancer"] and (not self.controller or self.controller.settings['enhancer']):
+            for frame_processor in self.frame_processors:
+                if frame_processor.NAME == "DLC.FACE-ENHANCER":
+                    if modules.globals.map_faces:
+                        packet['frame'] = frame_processor.process_frame_v2(packet['frame'])
+                    else:
+                        packet['frame'] = frame_processor.process_frame(None, packet['frame'])
+        return packet
+
+    def _overlay(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+        if self.recorder:
+            # the overlay draws in place, so the recording gets its own copy only when there is one
+            self.recorder.put(packet['frame'].copy() if modules.globals.show_fps else packet['frame'], packet['captured_at'])
+        # Calculate and display FPS
+        current_time = time.time()
+        self._fps_count += 1
+        if current_time - self._fps_time >= 0.5:
+            self.fps = self._fps_count / (current_time - self._fps_time)
+            self._fps_count = 0
+            self._fps_time = current_time
+            if self.controller:
+                self.controller.update(self.fps, time.perf_counter() - packet['captured_at'])
+
+        if modules.globals.show_fps:
+            cv2.putText(
+                packet['frame'],
+                f"FPS: {self.fps:.1f}",
+                (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                1,
+                (0, 255, 0),
+                2,
+            )
+            cv2.putText(
+                packet['frame'],
+                self.get_timings_text(),
+                (10, 60),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (0, 255, 0),
+                1,
+            )
+            cv2.putText(
+                packet['frame'],
+                self.get_latency_text(),
+                (10, 85),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (0, 255, 0),
+                1,
+            )
+            if self.controller:
+                cv2.putText(
+                    packet['frame'],
+                    self.controller.get_status_text(),
+                    (10, 110),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    (0, 255, 0),
+                    1,
+                )
+        return packet
+
+    def _present(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+        packet['frame'] = self.present(packet['frame'])
+        return packet
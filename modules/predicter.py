@@ -1,36 +1,157 @@
+import io
+import threading
+from typing import Any, List
+
 import numpy
-import opennsfw2
 from PIL import Image
-import cv2  # Add OpenCV import
-import modules.globals  # Import globals to access the color correction toggle
+import cv2
+import onnxruntime
+import modules.globals
 
 from modules.typing import Frame
+from modules.utilities import conditional_download, resolve_relative_path
 
 MAX_PROBABILITY = 0.85
+NSFW_BATCH_SIZE = 16
+# open_nsfw (Yahoo) caffe weights exported to onnx, same network opennsfw2 ports to keras
+NSFW_MODEL_URL = 'https://github.com/facefusion/facefusion-assets/releases/download/models/open_nsfw.onnx'
+NSFW_MODEL_SIZE = 224
+NSFW_RESIZE_SIZE = 256
+NSFW_MEAN = numpy.array([104.0, 117.0, 123.0], dtype=numpy.float32)
 
 # Preload the model once for efficiency
 model = None
+NSFW_SESSION = None
+THREAD_LOCK = threading.Lock()
 
-def predict_frame(target_frame: Frame) -> bool:
-    # Convert the frame to RGB before processing if color correction is enabled
-    if modules.globals.color_correction:
-        target_frame = cv2.cvtColor(target_frame, cv2.COLOR_BGR2RGB)
-        
-    image = Image.fromarray(target_frame)
-    image = opennsfw2.preprocess_image(image, opennsfw2.Preprocessing.YAHOO)
+
+def pre_check() -> bool:
+    if modules.globals.nsfw_backend == 'onnx':
+        conditional_download(resolve_relative_path('../models'), [NSFW_MODEL_URL])
+    return True
+
+
+def get_nsfw_session() -> Any:
+    global NSFW_SESSION
+
+    with THREAD_LOCK:
+        if NSFW_SESSION is None:
+            model_path = resolve_relative_path('../models/open_nsfw.onnx')
+            NSFW_SESSION = onnxruntime.InferenceSession(model_path, providers=modules.globals.execution_providers)
+    return NSFW_SESSION
+
+
+def get_opennsfw2_model() -> Any:
     global model
-    if model is None: 
-        model = opennsfw2.make_open_nsfw_model()
-        
-    views = numpy.expand_dims(image, axis=0)
-    _, probability = model.predict(views)[0]
-    return probability > MAX_PROBABILITY
+
+    with THREAD_LOCK:
+        if model is None:
+            import opennsfw2
+            model = opennsfw2.make_open_nsfw_model()
+    return model
+
+
+def warm_up() -> None:
+    # one blank frame through the configured backend loads the model and its kernels
+    predict_probabilities([numpy.zeros((NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3), dtype=numpy.uint8)])
+
+
+def prepare_frame(target_frame: Frame) -> Frame:
+    """Yahoo preprocessing of a BGR frame, step for step as opennsfw2.preprocess_image does it."""
+    image = Image.fromarray(cv2.cvtColor(target_frame, cv2.COLOR_BGR2RGB))
+    image = image.resize((NSFW_RESIZE_SIZE, NSFW_RESIZE_SIZE), resample=Image.BILINEAR)
+    # the weights expect jpeg artifacts, so the resized view takes the same jpeg round trip
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    buffer.seek(0)
+    target_frame = numpy.asarray(Image.open(buffer).convert('RGB'), dtype=numpy.float32)
+    offset = (NSFW_RESIZE_SIZE - NSFW_MODEL_SIZE) // 2
+    target_frame = target_frame[offset:offset + NSFW_MODEL_SIZE, offset:offset + NSFW_MODEL_SIZE, ::-1]
+    return target_frame - NSFW_MEAN
+
+
+def predict_probabilities_onnx(target_frames: List[Frame]) -> List[float]:
+    session = get_nsfw_session()
+    model_input = session.get_inputs()[0]
+    views = numpy.stack([prepare_frame(target_frame) for target_frame in target_frames])
+    if model_input.shape[1] == 3:
+        views = views.transpose(0, 3, 1, 2)
+    # exported graphs with a fixed batch dimension are fed one view at a time
+    if isinstance(model_input.shape[0], int):
+        outputs = [session.run(None, {model_input.name: views[i:i + 1]})[0][0] for i in range(len(views))]
+    else:
+        outputs = session.run(None, {model_input.name: views})[0]
+    return [float(output[1]) for output in outputs]
+
+
+def predict_probabilities_opennsfw2(target_frames: List[Frame]) -> List[float]:
+    import opennsfw2
+
+    views = []
+    for target_frame in target_frames:
+        image = Image.fromarray(cv2.cvtColor(target_frame, cv2.COLOR_BGR2RGB))
+        views.append(opennsfw2.preprocess_image(image, opennsfw2.Preprocessing.YAHOO))
+    outputs = get_opennsfw2_model().predict(numpy.stack(views), verbose=0)
+    return [float(output[1]) for output in outputs]
+
+
+def predict_probabilities(target_frames: List[Frame]) -> List[float]:
+    probabilities = []
+    for i in range(0, len(target_frames), NSFW_BATCH_SIZE):
+        batch = target_frames[i:i + NSFW_BATCH_SIZE]
+        if modules.globals.nsfw_backend == 'onnx':
+            probabilities.extend(predict_probabilities_onnx(batch))
+        else:
+            probabilities.extend(predict_probabilities_opennsfw2(batch))
+    return probabilities
+
+
+def predict_frame(target_frame: Frame) -> bool:
+    return predict_probabilities([target_frame])[0] > MAX_PROBABILITY
+
+
+def predict_frames(target_frames: List[Frame]) -> bool:
+    return any(probability > MAX_PROBABILITY for probability in predict_probabilities(target_frames))
+
+
+def predict_frame_paths(frame_paths: List[str], frame_interval: int = 100) -> bool:
+    # screens frames the job already decoded, stopping at the first batch over the threshold
+    sampled_frame_paths = sorted(frame_paths)[::frame_interval]
+    for i in range(0, len(sampled_frame_paths), NSFW_BATCH_SIZE):
+        target_frames = []
+        for frame_path in sampled_frame_paths[i:i + NSFW_BATCH_SIZE]:
+            target_frame = cv2.imread(frame_path)
+            if target_frame is None:
+                continue
+            target_frames.append(target_frame)
+        if target_frames and predict_frames(target_frames):
+            return True
+    return False
 
 
 def predict_image(target_path: str) -> bool:
-    return opennsfw2.predict_image(target_path) > MAX_PROBABILITY
+    if modules.globals.nsfw_backend != 'onnx':
+        import opennsfw2
+        return opennsfw2.predict_image(target_path) > MAX_PROBABILITY
+    target_frame = cv2.imread(target_path)
+    if target_frame is None:
+        return False
+    return predict_frame(target_frame)
 
 
 def predict_video(target_path: str) -> bool:
-    _, probabilities = opennsfw2.predict_video_frames(video_path=target_path, frame_interval=100)
-    return any(probability > MAX_PROBABILITY for probability in probabilities)
+    if modules.globals.nsfw_backend != 'onnx':
+        import opennsfw2
+        _, probabilities = opennsfw2.predict_video_frames(video_path=target_path, frame_interval=100)
+        return any(probability > MAX_PROBABILITY for probability in probabilities)
+    capture = cv2.VideoCapture(target_path)
+    target_frames = []
+    frame_number = 0
+    while capture.grab():
+        if frame_number % 100 == 0:
+            has_frame, target_frame = capture.retrieve()
+            if has_frame:
+                target_frames.append(target_frame)
+        frame_number += 1
+    capture.release()
+    return predict_frames(target_frames)
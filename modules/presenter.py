@@ -0,0 +1,62 @@
+from typing import Any, Tuple
+
+import customtkinter as ctk
+import cv2
+from PIL import Image
+
+from modules.typing import Frame
+
+
+def get_contained_size(frame_size: Tuple[int, int], size: Tuple[int, int]) -> Tuple[int, int]:
+    width, height = frame_size
+    max_width, max_height = size
+    if max_width <= 1 or max_height <= 1:
+        return width, height
+    ratio = min(max_width / width, max_height / height)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def prepare_frame(temp_frame: Frame, size: Tuple[int, int]) -> Image.Image:
+    """Fit a BGR frame into ``size`` with one resize and wrap it as a PIL image.
+
+    Safe to call off the Tk thread; the returned image shares the RGB buffer
+    instead of copying it again.
+    """
+    frame_size = get_contained_size((temp_frame.shape[1], temp_frame.shape[0]), size)
+    if frame_size != (temp_frame.shape[1], temp_frame.shape[0]):
+        interpolation = cv2.INTER_AREA if frame_size[0] < temp_frame.shape[1] else cv2.INTER_LINEAR
+        temp_frame = cv2.resize(temp_frame, frame_size, interpolation=interpolation)
+    rgb_frame = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
+    return Image.frombuffer('RGB', frame_size, rgb_frame, 'raw', 'RGB', 0, 1)
+
+
+class FramePresenter:
+    """Shows frames on a CTkLabel through a single reused Tk photo image.
+
+    Each frame size gets one CTkImage, sized in widget units so the label
+    scales it back to exactly the frame's pixels on HighDPI displays. Later
+    frames of that size are pasted into the photo image the label displays,
+    since configuring the CTkImage would build a new photo image per frame.
+    """
+
+    def __init__(self, label: Any):
+        self.label = label
+        self.image = None
+        self.photo = None
+        self.size = None
+        self.scaling = None
+
+    def show(self, image: Image.Image) -> None:
+        scaling = ctk.ScalingTracker.get_widget_scaling(self.label)
+        if self.photo is None or self.size != image.size or self.scaling != scaling:
+            self.image = ctk.CTkImage(light_image=image, size=(image.width / scaling, image.height / scaling))
+            self.label.configure(image=self.image)
+            # the label already built and cached this photo image, it is the one on screen
+            self.photo = self.image.create_scaled_photo_image(scaling, 'light')
+            self.size = image.size
+            self.scaling = scaling
+        else:
+            self.photo.paste(image)
+
+    def show_frame(self, temp_frame: Frame, size: Tuple[int, int]) -> None:
+        self.show(prepare_frame(temp_frame, size))
@@ -0,0 +1,195 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Hashable, Optional, Tuple
+
+import cv2
+
+import modules.globals
+from modules.face_analyser import get_one_face, get_identity_gallery
+from modules.processors.frame.core import get_frame_processors_modules
+from modules.typing import Face, Frame
+from modules.utilities import is_image
+
+PREVIEW_CACHE_BYTES = 512 * 1024 * 1024
+PREFETCH_RADIUS = 8
+# forward jumps shorter than this are decoded through instead of seeking to a keyframe
+MAX_GRAB_DISTANCE = 30
+
+
+class FrameCache:
+    """LRU of frames bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int = PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._frames: 'OrderedDict[Hashable, Frame]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Frame]:
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._frames
+
+    def put(self, key: Hashable, frame: Frame) -> None:
+        with self._lock:
+            if key in self._frames:
+                self.size -= self._frames.pop(key).nbytes
+            self._frames[key] = frame
+            self.size += frame.nbytes
+            while self.size > self.max_bytes and len(self._frames) > 1:
+                self.size -= self._frames.popitem(last=False)[1].nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self.size = 0
+
+
+class PreviewService:
+    """Serves preview frames from one open decoder per target.
+
+    Decoded and processed frames share a memory-bounded LRU, the source face
+    is detected once per source file, and the frames after the last request are
+    decoded ahead on a background thread so scrubbing mostly hits the cache.
+    """
+
+    def __init__(self, max_bytes: int = PREVIEW_CACHE_BYTES):
+        self.cache = FrameCache(max_bytes)
+        self.capture = None
+        self.capture_key = None
+        self.position = 0
+        self._decoder_lock = threading.Lock()
+        self._source_face_key = None
+        self._source_face = None
+        self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        self._prefetch_target = None
+
+    def get_source_face(self) -> Optional[Face]:
+        source_path = modules.globals.source_path
+        source_face_key = (source_path, os.path.getmtime(source_path)) if source_path and os.path.isfile(source_path) else None
+        if source_face_key != self._source_face_key:
+            self._source_face = get_one_face(cv2.imread(source_path)) if source_face_key else None
+            self._source_face_key = source_face_key
+        return self._source_face
+
+    def get_target_key(self, target_path: str) -> Tuple[str, Optional[float]]:
+        # an edited or replaced target keeps its path, the mtime tells the versions apart
+        return target_path, os.path.getmtime(target_path) if os.path.isfile(target_path) else None
+
+    def open(self, target_path: str) -> None:
+        if self.capture is not None:
+            self.capture.release()
+        self.capture = cv2.VideoCapture(target_path)
+        # Set MJPEG format to ensure correct color space handling
+        self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        if modules.globals.color_correction:
+            self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        self.capture_key = self.get_target_key(target_path)
+        self.position = 0
+
+    def close(self) -> None:
+        self._prefetch_target = None
+        with self._decoder_lock:
+            if self.capture is not None:
+                self.capture.release()
+            self.capture = None
+            self.capture_key = None
+
+    def decode_frame(self, target_path: str, frame_number: int) -> Optional[Frame]:
+        target_key = self.get_target_key(target_path)
+        key = (target_key, modules.globals.color_correction, frame_number)
+        frame = self.cache.get(key)
+        if frame is not None:
+            return frame
+        with self._decoder_lock:
+            if is_image(target_path):
+                frame = cv2.imread(target_path)
+            else:
+                if self.capture_key != target_key:
+                    self.open(target_path)
+                frame = self.read_frame(frame_number)
+        if frame is not None:
+            self.cache.put(key, frame)
+        return frame
+
+    def read_frame(self, frame_number: int) -> Optional[Frame]:
+        # matches capturer.get_video_frame, which reads frame_number - 1
+        frame_index = max(0, frame_number - 1)
+        if not self.position <= frame_index < self.position + MAX_GRAB_DISTANCE:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            self.position = frame_index
+        while self.position < frame_index:
+            self.capture.grab()
+            self.position += 1
+        has_frame, frame = self.capture.read()
+        if not has_frame:
+            # force a seek on the next read, the decoder position is unknown now
+            self.position = -MAX_GRAB_DISTANCE
+            return None
+        self.position += 1
+        if modules.globals.color_correction:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+    def get_settings_key(self) -> Tuple[Any, ...]:
+        gallery = get_identity_gallery() if modules.globals.identity_gallery_path else None
+        return (
+            tuple(modules.globals.frame_processors),
+            modules.globals.fp_ui.get('face_enhancer'),
+            modules.globals.many_faces,
+            modules.globals.mouth_mask,
+            modules.globals.color_correction,
+            modules.globals.map_faces,
+            modules.globals.identity_gallery_path,
+            modules.globals.map_faces_threshold,
+            gallery.version if gallery is not None else None,
+            self._source_face_key,
+        )
+
+    def get_preview_frame(self, target_path: str, frame_number: int) -> Tuple[Optional[Frame], Optional[Frame]]:
+        """Return the decoded and the processed frame for the preview window."""
+        temp_frame = self.decode_frame(target_path, frame_number)
+        self.prefetch(target_path, frame_number)
+        if temp_frame is None:
+            return None, None
+        source_face = self.get_source_face()
+        key = ('processed', self.get_target_key(target_path), frame_number, self.get_settings_key())
+        processed_frame = self.cache.get(key)
+        if processed_frame is None:
+            processed_frame = temp_frame.copy()
+            for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
+                processed_frame = frame_processor.process_frame(source_face, processed_frame)
+            self.cache.put(key, processed_frame)
+        return temp_frame, processed_frame
+
+    def prefetch(self, target_path: str, frame_number: int) -> None:
+        if is_image(target_path):
+            return
+        self._prefetch_target = (target_path, frame_number)
+        self._prefetcher.submit(self._prefetch, target_path, frame_number)
+
+    def _prefetch(self, target_path: str, frame_number: int) -> None:
+        # forward only, those frames decode straight on while every backward frame is a seek under the decoder lock
+        for offset in range(1, PREFETCH_RADIUS + 1):
+            if self._prefetch_target != (target_path, frame_number):
+                return
+            self.decode_frame(target_path, frame_number + offset)
+
+
+PREVIEW_SERVICE = None
+
+
+def get_preview_service() -> PreviewService:
+    global PREVIEW_SERVICE
+
+    if PREVIEW_SERVICE is None:
+        PREVIEW_SERVICE = PreviewService()
+    return PREVIEW_SERVICE
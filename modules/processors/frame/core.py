@@ -1,5 +1,6 @@
 import sys
 import importlib
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from types import ModuleType
 from typing import Any, List, Callable
@@ -9,6 +10,8 @@ import modules
 import modules.globals                   
 
 FRAME_PROCESSORS_MODULES: List[ModuleType] = []
+# progress and cancellation of the job running on the current thread
+JOB_CONTEXT = threading.local()
 FRAME_PROCESSORS_INTERFACE = [
     'pre_check',
     'pre_start',
@@ -56,14 +59,49 @@ def set_frame_processors_modules_from_ui(frame_processors: List[str]) -> None:
             except:
                 pass
 
+class JobCancelled(Exception):
+    pass
+
+
+def set_job_context(report_progress: Callable[[int, int], None] = None, cancel_event: threading.Event = None, report_status: Callable[[str, str], None] = None) -> None:
+    JOB_CONTEXT.report_progress = report_progress
+    JOB_CONTEXT.cancel_event = cancel_event
+    JOB_CONTEXT.report_status = report_status
+
+
+def get_job_status_reporter() -> Any:
+    return getattr(JOB_CONTEXT, 'report_status', None)
+
+
+def is_cancelled() -> bool:
+    cancel_event = getattr(JOB_CONTEXT, 'cancel_event', None)
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def check_cancelled() -> None:
+    if is_cancelled():
+        raise JobCancelled()
+
+
 def multi_process_frame(source_path: str, temp_frame_paths: List[str], process_frames: Callable[[str, List[str], Any], None], progress: Any = None) -> None:
+    # worker threads do not see the job context, so it is captured here
+    cancel_event = getattr(JOB_CONTEXT, 'cancel_event', None)
+    report_progress = getattr(JOB_CONTEXT, 'report_progress', None)
+
+    def process_path(path: str) -> None:
+        if cancel_event is None or not cancel_event.is_set():
+            process_frames(source_path, [path], progress)
+
     with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
         futures = []
         for path in temp_frame_paths:
-            future = executor.submit(process_frames, source_path, [path], progress)
+            future = executor.submit(process_path, path)
             futures.append(future)
-        for future in futures:
+        for completed, future in enumerate(futures, 1):
             future.result()
+            if report_progress:
+                report_progress(completed, len(futures))
+    check_cancelled()
 
 
 def process_video(source_path: str, frame_paths: list[str], process_frames: Callable[[str, List[str], Any], None]) -> None:
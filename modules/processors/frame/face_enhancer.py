@@ -21,6 +21,7 @@ FACE_ENHANCER = None
 THREAD_SEMAPHORE = threading.Semaphore()
 THREAD_LOCK = threading.Lock()
 NAME = "DLC.FACE-ENHANCER"
+MODEL_NAME = "GFPGANv1.4.pth"
 
 abs_dir = os.path.dirname(os.path.abspath(__file__))
 models_dir = os.path.join(
@@ -33,7 +34,7 @@ def pre_check() -> bool:
     conditional_download(
         download_directory_path,
         [
-            "https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/GFPGANv1.4.pth"
+            f"https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/{MODEL_NAME}"
         ],
     )
     return True
@@ -53,21 +54,37 @@ def get_face_enhancer() -> Any:
 
     with THREAD_LOCK:
         if FACE_ENHANCER is None:
-            model_path = os.path.join(models_dir, "GFPGANv1.4.pth")
-            
-            match platform.system():
-                case "Darwin":  # Mac OS
-                    if torch.backends.mps.is_available():
-                        mps_device = torch.device("mps")
-                        FACE_ENHANCER = gfpgan.GFPGANer(model_path=model_path, upscale=1, device=mps_device)  # type: ignore[attr-defined]
-                    else:
-                        FACE_ENHANCER = gfpgan.GFPGANer(model_path=model_path, upscale=1)  # type: ignore[attr-defined]
-                case _:  # Other OS
-                    FACE_ENHANCER = gfpgan.GFPGANer(model_path=model_path, upscale=1)  # type: ignore[attr-defined]
+            model_path = os.path.join(models_dir, MODEL_NAME)
+            # None lets gfpgan pick cuda or cpu
+            FACE_ENHANCER = gfpgan.GFPGANer(model_path=model_path, upscale=1, device=get_device())  # type: ignore[attr-defined]
 
     return FACE_ENHANCER
 
 
+def get_device() -> Any:
+    match platform.system():
+        case "Darwin":  # Mac OS
+            if torch.backends.mps.is_available():
+                return torch.device("mps")
+    return None
+
+
+def get_model_variant() -> str:
+    # restorations differ slightly between devices, so the device is part of the variant
+    if FACE_ENHANCER is not None:
+        device = FACE_ENHANCER.device
+    else:
+        device = get_device() or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return f"{MODEL_NAME}:{torch.device(device).type}"
+
+
+def warm_up() -> None:
+    face_enhancer = get_face_enhancer()
+    # a blank frame has no face to restore, so feed the restorer network directly
+    with torch.no_grad():
+        face_enhancer.gfpgan(torch.zeros((1, 3, 512, 512), device=face_enhancer.device), return_rgb=False)
+
+
 def enhance_face(temp_frame: Frame) -> Frame:
     with THREAD_SEMAPHORE:
         _, _, temp_frame = get_face_enhancer().enhance(temp_frame, paste_back=True)
@@ -1,7 +1,8 @@
 import os # <-- Added for os.path.exists
-from typing import Any, List
+from typing import Any, List, Optional
 import cv2
 import insightface
+import numpy
 import threading
 
 import modules.globals
@@ -9,13 +10,14 @@ import modules.processors.frame.core
 # Ensure update_status is imported if not already globally accessible
 # If it's part of modules.core, it might already be accessible via modules.core.update_status
 from modules.core import update_status
-from modules.face_analyser import get_one_face, get_many_faces, default_source_face
+from modules.face_analyser import get_one_face, get_many_faces, default_source_face, get_identity_gallery
 from modules.typing import Face, Frame
 from modules.utilities import conditional_download, resolve_relative_path, is_image, is_video
-from modules.cluster_analysis import find_closest_centroid
+from modules.cluster_analysis import match_embeddings
 
 FACE_SWAPPER = None
 THREAD_LOCK = threading.Lock()
+MODEL_NAMES = ['inswapper_128.onnx', 'inswapper_128_fp16.onnx']
 NAME = 'DLC.FACE-SWAPPER'
 
 
@@ -31,7 +33,11 @@ def pre_check() -> bool:
 
 def pre_start() -> bool:
     # --- No changes needed in pre_start ---
-    if not modules.globals.map_faces and not is_image(modules.globals.source_path):
+    if modules.globals.identity_gallery_path and not modules.globals.map_faces:
+        if not len(get_identity_gallery()):
+            update_status('Identity gallery is empty.', NAME)
+            return False
+    elif not modules.globals.map_faces and not is_image(modules.globals.source_path):
         update_status('Select an image for source path.', NAME)
         return False
     elif not modules.globals.map_faces and not get_one_face(cv2.imread(modules.globals.source_path)):
@@ -51,8 +57,8 @@ def get_face_swapper() -> Any:
             # --- MODIFICATION START ---
             # Define paths for both FP32 and FP16 models
             model_dir = resolve_relative_path('../models')
-            model_path_fp32 = os.path.join(model_dir, 'inswapper_128.onnx')
-            model_path_fp16 = os.path.join(model_dir, 'inswapper_128_fp16.onnx')
+            model_path_fp32 = os.path.join(model_dir, MODEL_NAMES[0])
+            model_path_fp16 = os.path.join(model_dir, MODEL_NAMES[1])
             chosen_model_path = None
 
             # Prioritize FP32 model
@@ -80,6 +86,22 @@ def get_face_swapper() -> Any:
     return FACE_SWAPPER
 
 
+def get_model_variant() -> Optional[str]:
+    # the model get_face_swapper loads or has loaded, fp32 and fp16 swaps differ slightly
+    if FACE_SWAPPER is not None:
+        return os.path.basename(FACE_SWAPPER.model_file)
+    model_dir = resolve_relative_path('../models')
+    return next((model_name for model_name in MODEL_NAMES if os.path.exists(os.path.join(model_dir, model_name))), None)
+
+
+def warm_up() -> None:
+    swapper = get_face_swapper()
+    # run the session directly so kernel selection happens without needing a detected face
+    blob = numpy.zeros((1, 3) + tuple(swapper.input_size[::-1]), dtype=numpy.float32)
+    latent = numpy.zeros((1, swapper.emap.shape[0]), dtype=numpy.float32)
+    swapper.session.run(swapper.output_names, {swapper.input_names[0]: blob, swapper.input_names[1]: latent})
+
+
 def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
     # --- No changes needed in swap_face ---
     swapper = get_face_swapper()
@@ -90,7 +112,15 @@ def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
     return swapper.get(temp_frame, target_face, source_face, paste_back=True)
 
 
-def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
+def get_target_faces(temp_frame: Frame) -> List[Face]:
+    # detection on its own, so the live pipeline can run it a frame ahead of swapping
+    if modules.globals.many_faces or modules.globals.map_faces or modules.globals.identity_gallery_path:
+        return get_many_faces(temp_frame) or []
+    target_face = get_one_face(temp_frame)
+    return [target_face] if target_face else []
+
+
+def process_frame(source_face: Face, temp_frame: Frame, target_faces: List[Face] = None) -> Frame:
     # --- No changes needed in process_frame ---
     # Ensure the frame is in RGB format if color correction is enabled
     # Note: InsightFace swapper often expects BGR by default. Double-check if color issues appear.
@@ -100,14 +130,12 @@ def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
     #     temp_frame = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
     #     original_was_bgr = False # Now it's RGB
 
-    if modules.globals.many_faces:
-        many_faces = get_many_faces(temp_frame)
-        if many_faces:
-            for target_face in many_faces:
-                temp_frame = swap_face(source_face, target_face, temp_frame)
+    if target_faces is None:
+        target_faces = get_target_faces(temp_frame)
+    if modules.globals.identity_gallery_path:
+        temp_frame = process_frame_gallery(temp_frame, target_faces)
     else:
-        target_face = get_one_face(temp_frame)
-        if target_face:
+        for target_face in target_faces:
             temp_frame = swap_face(source_face, target_face, temp_frame)
 
     # Convert back if necessary (example, might not be needed depending on workflow)
@@ -117,44 +145,65 @@ def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
     return temp_frame
 
 
-def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
+def process_frame_gallery(temp_frame: Frame, detected_faces: List[Face] = None) -> Frame:
+    # every detected face is looked up in the gallery, unknown faces are left untouched
+    gallery = get_identity_gallery()
+    if detected_faces is None:
+        detected_faces = get_many_faces(temp_frame)
+    if not detected_faces or not len(gallery):
+        return temp_frame
+    scores, indices = gallery.search([detected_face.normed_embedding for detected_face in detected_faces])
+    for detected_face, score, index in zip(detected_faces, scores[:, 0], indices[:, 0]):
+        if score >= modules.globals.map_faces_threshold:
+            temp_frame = swap_face(gallery.source_face(index), detected_face, temp_frame)
+    return temp_frame
+
+
+def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "", detected_faces: List[Face] = None) -> Frame:
     # --- No changes needed in process_frame_v2 ---
     # (Assuming swap_face handles the potential None return from get_face_swapper)
     if is_image(modules.globals.target_path):
         if modules.globals.many_faces:
             source_face = default_source_face()
-            for map_entry in modules.globals.souce_target_map: # Renamed 'map' to 'map_entry'
+            for map_entry in modules.globals.source_target_map: # Renamed 'map' to 'map_entry'
                 target_face = map_entry['target']['face']
                 temp_frame = swap_face(source_face, target_face, temp_frame)
 
         elif not modules.globals.many_faces:
-            for map_entry in modules.globals.souce_target_map: # Renamed 'map' to 'map_entry'
+            for map_entry in modules.globals.source_target_map: # Renamed 'map' to 'map_entry'
                 if "source" in map_entry:
                     source_face = map_entry['source']['face']
                     target_face = map_entry['target']['face']
                     temp_frame = swap_face(source_face, target_face, temp_frame)
 
     elif is_video(modules.globals.target_path):
+        store = modules.globals.target_face_store
+        if temp_frame_path in store.location_index:
+            frame_rows = store.frame_rows(temp_frame_path)
+            frame_faces = store.faces(frame_rows)
+            frame_clusters = store.cluster[frame_rows]
+        else:
+            # frame was skipped by sampled analysis, assign its faces to the known clusters now
+            frame_faces = get_many_faces(temp_frame) or []
+            frame_clusters = store.nearest_clusters(frame_faces)
         if modules.globals.many_faces:
             source_face = default_source_face()
-            for map_entry in modules.globals.souce_target_map: # Renamed 'map' to 'map_entry'
-                target_frame = [f for f in map_entry['target_faces_in_frame'] if f['location'] == temp_frame_path]
-
-                for frame in target_frame:
-                    for target_face in frame['faces']:
+            for map_entry in modules.globals.source_target_map: # Renamed 'map' to 'map_entry'
+                for target_face, cluster in zip(frame_faces, frame_clusters):
+                    if cluster == map_entry['id']:
                         temp_frame = swap_face(source_face, target_face, temp_frame)
 
         elif not modules.globals.many_faces:
-            for map_entry in modules.globals.souce_target_map: # Renamed 'map' to 'map_entry'
+            for map_entry in modules.globals.source_target_map: # Renamed 'map' to 'map_entry'
                 if "source" in map_entry:
-                    target_frame = [f for f in map_entry['target_faces_in_frame'] if f['location'] == temp_frame_path]
                     source_face = map_entry['source']['face']
 
-                    for frame in target_frame:
-                        for target_face in frame['faces']:
+                    for target_face, cluster in zip(frame_faces, frame_clusters):
+                        if cluster == map_entry['id']:
                             temp_frame = swap_face(source_face, target_face, temp_frame)
     else: # Fallback for neither image nor video (e.g., live feed?)
-        detected_faces = get_many_faces(temp_frame)
+        if detected_faces is None:
+            detected_faces = get_many_faces(temp_frame)
         if modules.globals.many_faces:
             if detected_faces:
                 source_face = default_source_face()
@@ -163,19 +212,9 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
 
         elif not modules.globals.many_faces:
             if detected_faces and hasattr(modules.globals, 'simple_map') and modules.globals.simple_map: # Check simple_map exists
-                if len(detected_faces) <= len(modules.globals.simple_map['target_embeddings']):
-                    for detected_face in detected_faces:
-                        closest_centroid_index, _ = find_closest_centroid(modules.globals.simple_map['target_embeddings'], detected_face.normed_embedding)
-                        temp_frame = swap_face(modules.globals.simple_map['source_faces'][closest_centroid_index], detected_face, temp_frame)
-                else:
-                    detected_faces_centroids = [face.normed_embedding for face in detected_faces]
-                    i = 0
-                    for target_embedding in modules.globals.simple_map['target_embeddings']:
-                        closest_centroid_index, _ = find_closest_centroid(detected_faces_centroids, target_embedding)
-                        # Ensure index is valid before accessing detected_faces
-                        if closest_centroid_index < len(detected_faces):
-                            temp_frame = swap_face(modules.globals.simple_map['source_faces'][i], detected_faces[closest_centroid_index], temp_frame)
-                        i += 1
+                detected_embeddings = [detected_face.normed_embedding for detected_face in detected_faces]
+                for face_index, map_index in match_embeddings(detected_embeddings, modules.globals.simple_map['target_embeddings'], modules.globals.map_faces_threshold):
+                    temp_frame = swap_face(modules.globals.simple_map['source_faces'][map_index], detected_faces[face_index], temp_frame)
     return temp_frame
 
 
@@ -183,7 +222,7 @@ def process_frames(source_path: str, temp_frame_paths: List[str], progress: Any
     # --- No changes needed in process_frames ---
     # Note: Ensure get_one_face is called only once if possible for efficiency if !map_faces
     source_face = None
-    if not modules.globals.map_faces:
+    if not modules.globals.map_faces and not modules.globals.identity_gallery_path:
         source_img = cv2.imread(source_path)
         if source_img is not None:
             source_face = get_one_face(source_img)
@@ -201,7 +240,7 @@ def process_frames(source_path: str, temp_frame_paths: List[str], progress: Any
 
         try:
             if not modules.globals.map_faces:
-                if source_face: # Only process if source face was found
+                if source_face or modules.globals.identity_gallery_path: # Only process if source face was found
                     result = process_frame(source_face, temp_frame)
                 else:
                     result = temp_frame # No source face, return original frame
@@ -226,7 +265,9 @@ def process_image(source_path: str, target_path: str, output_path: str) -> None:
         update_status(f"Error: Could not read target image: {target_path}", NAME)
         return
 
-    if not modules.globals.map_faces:
+    if modules.globals.identity_gallery_path and not modules.globals.map_faces:
+        result = process_frame(None, target_frame)
+    elif not modules.globals.map_faces:
         source_img = cv2.imread(source_path)
         if source_img is None:
              update_status(f"Error: Could not read source image: {source_path}", NAME)
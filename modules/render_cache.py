@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import modules.globals
+from modules.face_analyser import default_source_face
+from modules.processors.frame.core import get_frame_processors_modules
+
+RENDER_DIRECTORY = "render"
+RENDER_FILE = "render.json"
+
+
+def get_render_directory_path() -> Optional[str]:
+    store = modules.globals.target_face_store
+    if not modules.globals.incremental_render or not modules.globals.map_faces or store is None or store.path is None:
+        return None
+    return os.path.join(store.path, RENDER_DIRECTORY)
+
+
+def get_face_signature(face: Any) -> Optional[str]:
+    if face is None:
+        return None
+    return hashlib.sha1(np.round(np.asarray(face.normed_embedding, dtype=np.float32), 4).tobytes()).hexdigest()
+
+
+def get_settings_signature() -> str:
+    # a change here affects every frame, so it invalidates the whole cache
+    settings = {
+        'frame_processors': sorted(modules.globals.frame_processors),
+        'many_faces': modules.globals.many_faces,
+        'mouth_mask': modules.globals.mouth_mask,
+        'color_correction': modules.globals.color_correction,
+        'models': {frame_processor.NAME: frame_processor.get_model_variant() for frame_processor in get_frame_processors_modules(modules.globals.frame_processors) if hasattr(frame_processor, 'get_model_variant')},
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def get_mapping_signatures() -> Dict[str, Optional[str]]:
+    signatures = {}
+    for map in modules.globals.source_target_map:
+        if modules.globals.many_faces:
+            source_face = default_source_face()
+        else:
+            source_face = map['source']['face'] if 'source' in map else None
+        signatures[str(map['id'])] = get_face_signature(source_face)
+    return signatures
+
+
+def load_render_state(render_directory_path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(render_directory_path, RENDER_FILE)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def copy_frame(source_path: str, destination_path: str) -> None:
+    # never hard-linked, kept temp frames are overwritten in place by ffmpeg and the processors
+    shutil.copy2(source_path, destination_path)
+
+
+def prepare_incremental_render(temp_frame_paths: List[str]) -> List[str]:
+    """Restore cached output frames and return only the frames that need processing."""
+    render_directory_path = get_render_directory_path()
+    if render_directory_path is None:
+        return temp_frame_paths
+    state = load_render_state(render_directory_path)
+    if state.get('settings') != get_settings_signature() or state.get('frames') != len(temp_frame_paths):
+        return temp_frame_paths
+
+    store = modules.globals.target_face_store
+    previous_signatures = state.get('mappings', {})
+    changed_clusters = [int(cluster) for cluster, signature in get_mapping_signatures().items() if previous_signatures.get(cluster) != signature]
+    affected_frames = set(np.unique(store.frame[np.isin(store.cluster, changed_clusters)]).tolist())
+
+    changed_frame_paths = []
+    for temp_frame_path in temp_frame_paths:
+        cached_frame_path = os.path.join(render_directory_path, os.path.basename(temp_frame_path))
+        # frames skipped by sampled analysis have unknown identities and are always re-rendered
+        frame = store.location_index.get(temp_frame_path)
+        if frame is None or frame in affected_frames or not os.path.isfile(cached_frame_path):
+            changed_frame_paths.append(temp_frame_path)
+        else:
+            copy_frame(cached_frame_path, temp_frame_path)
+    return changed_frame_paths
+
+
+def save_incremental_render(temp_frame_paths: List[str], changed_frame_paths: List[str]) -> None:
+    render_directory_path = get_render_directory_path()
+    if render_directory_path is None:
+        return
+    Path(render_directory_path).mkdir(parents=True, exist_ok=True)
+    for temp_frame_path in changed_frame_paths:
+        copy_frame(temp_frame_path, os.path.join(render_directory_path, os.path.basename(temp_frame_path)))
+    state = {
+        'settings': get_settings_signature(),
+        'mappings': get_mapping_signatures(),
+        'frames': len(temp_frame_paths),
+    }
+    with open(os.path.join(render_directory_path, RENDER_FILE), 'w') as file:
+        json.dump(state, file)
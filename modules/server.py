@@ -0,0 +1,384 @@
+import json
+import os
+import shutil
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import modules.globals
+from modules.core import update_status, process_job
+from modules.job_queue import JobQueue, is_output_current, parse_class_limits
+from modules.processors.frame.core import load_frame_processor_module, set_job_context, JobCancelled
+from modules.utilities import is_image, is_video, normalize_output_path, clean_temp
+
+NAME = 'DLC.SERVER'
+SERVER_HOST = '127.0.0.1'
+FRAME_PROCESSORS = ['face_swapper', 'face_enhancer']
+BOOL_VALUES = {'true': True, '1': True, 'yes': True, 'on': True, 'false': False, '0': False, 'no': False, 'off': False}
+
+
+def parse_bool(value: Any) -> bool:
+    # bool('false') is True, so strings are matched against a fixed set instead
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in BOOL_VALUES:
+        return BOOL_VALUES[value.lower()]
+    raise ValueError(f'{json.dumps(value)} is not a boolean')
+
+
+def parse_int(value: Any) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{json.dumps(value)} is not an integer')
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{json.dumps(value)} is not an integer')
+
+
+def parse_str(value: Any) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f'{json.dumps(value)} is not a string')
+    return value
+
+
+def parse_path(value: Any) -> Optional[str]:
+    # a bare file name has no directory to write the output next to, so paths are made absolute
+    if value is None:
+        return None
+    return os.path.abspath(parse_str(value))
+
+
+# options that live in modules.globals, jobs only share the process when these match
+JOB_OPTIONS = {
+    'many_faces': parse_bool,
+    'mouth_mask': parse_bool,
+    'color_correction': parse_bool,
+    'nsfw_filter': parse_bool,
+    'keep_fps': parse_bool,
+    'keep_audio': parse_bool,
+    'video_encoder': parse_str,
+    'video_quality': parse_int,
+}
+
+
+class Job:
+    """The attempt of a queued job that is running in this process."""
+
+    def __init__(self, row: Dict[str, Any]):
+        self.row = row
+        self.id = row['id']
+        self.message = None
+        self.progress = (0, 0)
+        self.cancel_event = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.row, message=self.message, progress={'completed': self.progress[0], 'total': self.progress[1]})
+
+
+def get_profile(row: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(row['frame_processors']), tuple(sorted(row['options'].items()))
+
+
+class JobServer:
+    """Runs jobs from a JobQueue on the models already loaded in this process.
+
+    Processing options are process globals, so jobs only run side by side
+    when their processors and options match those of the running jobs; a job
+    with a different profile waits until the running ones finish. Jobs are
+    started by priority and age, at most ``class_limits`` at once per
+    resource class, and never two on the same target at once, since they
+    would share its temp directory.
+    """
+
+    def __init__(self, job_queue: JobQueue, max_jobs: int, class_limits: Dict[str, int] = None, max_attempts: int = 1):
+        self.queue = job_queue
+        self.max_jobs = max(1, max_jobs)
+        self.class_limits = class_limits or {}
+        self.max_attempts = max_attempts
+        self.running: Dict[str, Job] = {}
+        self.profile = None
+        # apply_profile overwrites the globals, so defaults come from the options the server started with
+        self.default_frame_processors = list(modules.globals.frame_processors)
+        self.default_options = {name: getattr(modules.globals, name) for name in JOB_OPTIONS}
+        self.condition = threading.Condition()
+        self.workers = [threading.Thread(target=self._worker_loop, name=f'server-job-{i}', daemon=True) for i in range(self.max_jobs)]
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, request: Dict[str, Any], unique: bool = False) -> Optional[Dict[str, Any]]:
+        if not isinstance(request, dict):
+            raise ValueError('request must be an object')
+        source_path = parse_path(request.get('source'))
+        target_path = parse_path(request.get('target'))
+        frame_processors = request.get('frame_processors') or list(self.default_frame_processors)
+        if not isinstance(frame_processors, list):
+            raise ValueError('frame_processors must be a list')
+        if any(frame_processor not in FRAME_PROCESSORS for frame_processor in frame_processors):
+            raise ValueError(f'frame_processors must be chosen from {FRAME_PROCESSORS}')
+        if 'face_swapper' in frame_processors and not modules.globals.identity_gallery_path and not is_image(source_path):
+            raise ValueError('source must be an image')
+        if not is_image(target_path) and not is_video(target_path):
+            raise ValueError('target must be an image or video')
+        request_options = request.get('options') or {}
+        if not isinstance(request_options, dict):
+            raise ValueError('options must be an object')
+        options = dict(self.default_options)
+        for name, value in request_options.items():
+            if name not in JOB_OPTIONS:
+                raise ValueError(f'unknown option {name}')
+            try:
+                options[name] = JOB_OPTIONS[name](value)
+            except ValueError as exception:
+                raise ValueError(f'option {name}: {exception}')
+        output_path = normalize_output_path(source_path, target_path, parse_path(request.get('output')) or os.path.dirname(target_path))
+        if os.path.isdir(output_path):
+            # without a source there is no name to combine, so the target name is prefixed
+            output_path = os.path.join(output_path, 'output-' + os.path.basename(target_path))
+        try:
+            priority = parse_int(request.get('priority', 0))
+        except ValueError as exception:
+            raise ValueError(f'priority: {exception}')
+        with self.condition:
+            job = self.queue.enqueue(source_path, target_path, output_path, frame_processors, options, priority, self.max_attempts, unique)
+            self.condition.notify_all()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.condition:
+            if job_id in self.running:
+                return self.running[job_id].to_dict()
+        return self.queue.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self.condition:
+            running = {job_id: job.to_dict() for job_id, job in self.running.items()}
+        return [running.get(job['id'], job) for job in self.queue.list()]
+
+    def cancel(self, job_id: str) -> None:
+        with self.condition:
+            if job_id in self.running:
+                self.running[job_id].cancel_event.set()
+            elif self.queue.cancel(job_id):
+                self.condition.notify_all()
+
+    def can_start(self, row: Dict[str, Any]) -> bool:
+        if not self.running:
+            return True
+        return get_profile(row) == self.profile and all(job.row['target'] != row['target'] for job in self.running.values())
+
+    def get_full_classes(self) -> List[str]:
+        running_classes = [job.row['resource_class'] for job in self.running.values()]
+        return [resource_class for resource_class, limit in self.class_limits.items() if running_classes.count(resource_class) >= limit]
+
+    def get_wait_time(self) -> Optional[float]:
+        # jobs that are ready but blocked are woken by a finishing job, only backoff needs a timed wake up
+        next_attempt_at = self.queue.next_attempt_time()
+        if next_attempt_at is None:
+            return None
+        return max(0.0, next_attempt_at - time.time())
+
+    def _next_job(self) -> Job:
+        with self.condition:
+            while True:
+                row = self.queue.next_job(self.get_full_classes())
+                if row and self.can_start(row):
+                    break
+                self.condition.wait(self.get_wait_time())
+            self.queue.claim(row['id'])
+            job = Job(self.queue.get(row['id']))
+            if not self.running:
+                self.apply_profile(job.row)
+            self.running[job.id] = job
+            return job
+
+    def apply_profile(self, row: Dict[str, Any]) -> None:
+        for name, value in row['options'].items():
+            setattr(modules.globals, name, value)
+        modules.globals.frame_processors = list(row['frame_processors'])
+        modules.globals.fp_ui['face_enhancer'] = 'face_enhancer' in row['frame_processors']
+        self.profile = get_profile(row)
+
+    def _worker_loop(self) -> None:
+        while True:
+            job = self._next_job()
+            try:
+                self.run_job(job)
+            finally:
+                with self.condition:
+                    del self.running[job.id]
+                    self.condition.notify_all()
+
+    def run_job(self, job: Job) -> None:
+        def report_progress(completed: int, total: int) -> None:
+            job.progress = (completed, total)
+
+        def report_status(message: str, scope: str) -> None:
+            job.message = message
+
+        status = 'failed'
+        error = None
+        retry = True
+        set_job_context(report_progress, job.cancel_event, report_status)
+        try:
+            frame_processors = [load_frame_processor_module(frame_processor) for frame_processor in job.row['frame_processors']]
+            for frame_processor in frame_processors:
+                if not frame_processor.pre_check():
+                    raise RuntimeError(f'{frame_processor.NAME} is not ready')
+            if process_job(job.row['source'], job.row['target'], job.row['output'], frame_processors):
+                status = 'done'
+            else:
+                # skipped or filtered targets fail the same way again, so they are not retried
+                error = job.message
+                retry = False
+        except JobCancelled:
+            clean_temp(job.row['target'])
+            status = 'cancelled'
+        except Exception as exception:
+            clean_temp(job.row['target'])
+            error = str(exception)
+        finally:
+            set_job_context()
+            if status == 'failed':
+                status = self.queue.fail(job.id, error, retry)
+            else:
+                self.queue.finish(job.id, status)
+            update_status(f'Job {job.id} failed, retrying' if status == 'queued' else f'Job {job.id} {status}', NAME)
+
+    def wait_idle(self) -> None:
+        with self.condition:
+            while self.running or self.queue.count('queued'):
+                self.condition.wait()
+
+    def get_state(self) -> Dict[str, Any]:
+        with self.condition:
+            return {'status': 'ok', 'running': len(self.running), 'queued': self.queue.count('queued'), 'max_jobs': self.max_jobs, 'class_limits': self.class_limits}
+
+
+def create_request_handler(job_server: JobServer) -> Any:
+
+    class RequestHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def send_json(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, status: int, message: str) -> None:
+            self.send_json(status, {'error': message})
+
+        def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+            job = job_server.get_job(job_id)
+            if job is None:
+                self.send_error_json(HTTPStatus.NOT_FOUND, 'job not found')
+            return job
+
+        def get_path_parts(self) -> List[str]:
+            return [part for part in self.path.split('?')[0].split('/') if part]
+
+        def do_GET(self) -> None:
+            parts = self.get_path_parts()
+            if parts == ['health']:
+                self.send_json(HTTPStatus.OK, job_server.get_state())
+            elif parts == ['jobs']:
+                self.send_json(HTTPStatus.OK, job_server.list_jobs())
+            elif len(parts) == 2 and parts[0] == 'jobs':
+                job = self.get_job(parts[1])
+                if job:
+                    self.send_json(HTTPStatus.OK, job)
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'output':
+                job = self.get_job(parts[1])
+                if job:
+                    self.send_output(job)
+            else:
+                self.send_error_json(HTTPStatus.NOT_FOUND, 'not found')
+
+        def send_output(self, job: Dict[str, Any]) -> None:
+            output_path = job['output']
+            if job['status'] != 'done' or not os.path.isfile(output_path):
+                self.send_error_json(HTTPStatus.CONFLICT, f"job is {job['status']}")
+                return
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(output_path)))
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(output_path)}"')
+            self.end_headers()
+            with open(output_path, 'rb') as file:
+                shutil.copyfileobj(file, self.wfile)
+
+        def do_POST(self) -> None:
+            if self.get_path_parts() != ['jobs']:
+                self.send_error_json(HTTPStatus.NOT_FOUND, 'not found')
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                job = job_server.submit(request)
+            except (ValueError, TypeError) as exception:
+                self.send_error_json(HTTPStatus.BAD_REQUEST, str(exception))
+                return
+            self.send_json(HTTPStatus.CREATED, job)
+
+        def do_DELETE(self) -> None:
+            parts = self.get_path_parts()
+            if len(parts) != 2 or parts[0] != 'jobs':
+                self.send_error_json(HTTPStatus.NOT_FOUND, 'not found')
+                return
+            if self.get_job(parts[1]):
+                job_server.cancel(parts[1])
+                self.send_json(HTTPStatus.OK, job_server.get_job(parts[1]))
+
+    return RequestHandler
+
+
+def create_job_server() -> JobServer:
+    job_queue = JobQueue(modules.globals.queue_path or ':memory:')
+    recovered = job_queue.recover()
+    if recovered:
+        update_status(f'Requeued {recovered} interrupted jobs', NAME)
+    job_server = JobServer(job_queue, modules.globals.server_max_jobs, parse_class_limits(modules.globals.queue_class_limits), modules.globals.job_retries + 1)
+    job_server.start()
+    return job_server
+
+
+def submit_job_paths(job_server: JobServer, job_paths: List[Tuple[str, str, str]]) -> None:
+    for source_path, target_path, output_path in job_paths:
+        if is_output_current(source_path, target_path, output_path):
+            continue
+        request = {'source': source_path, 'target': target_path, 'output': output_path, 'priority': modules.globals.job_priority}
+        try:
+            job_server.submit(request, unique=True)
+        except ValueError as exception:
+            update_status(f'Skipping {target_path}: {exception}', NAME)
+
+
+def run_queue(job_paths: List[Tuple[str, str, str]]) -> None:
+    """Queue the (source, target, output) triples and run until the queue is drained."""
+    job_server = create_job_server()
+    submit_job_paths(job_server, job_paths)
+    job_server.wait_idle()
+    update_status(f"Queue drained, {job_server.queue.count('failed')} failed jobs in {modules.globals.queue_path}", NAME)
+
+
+def serve() -> None:
+    job_server = create_job_server()
+    if modules.globals.watch:
+        # imported here, the watcher module imports this one
+        from modules.watcher import watch
+        threading.Thread(target=watch, args=(job_server,), name='server-watch', daemon=True).start()
+    # local only, there is no authentication on the job api
+    http_server = ThreadingHTTPServer((SERVER_HOST, modules.globals.server_port), create_request_handler(job_server))
+    http_server.daemon_threads = True
+    update_status(f'Job server listening on http://{SERVER_HOST}:{modules.globals.server_port}', NAME)
+    try:
+        http_server.serve_forever()
+    finally:
+        http_server.server_close()
@@ -0,0 +1,255 @@
+import abc
+import os
+import queue
+import socket
+import struct
+import subprocess
+import threading
+import time
+from typing import Any, List, Optional
+
+import cv2
+
+import modules.globals
+from modules.typing import Frame
+
+RECORDER_QUEUE_SIZE = 64
+SEGMENT_TIME = 10
+SEGMENT_WRAP = 6
+# width, height, channels and capture time precede every raw frame on the socket
+SOCKET_FRAME_HEADER = struct.Struct('<IIId')
+# fastest settings per encoder, libvpx-vp9 has no -preset and fails on it
+ENCODER_SPEED_ARGS = {
+    'libx264': ['-preset', 'ultrafast'],
+    'libx265': ['-preset', 'ultrafast'],
+    'libvpx-vp9': ['-deadline', 'realtime', '-cpu-used', '8'],
+}
+
+
+class StreamWriter(abc.ABC):
+    """Writes processed live frames to a sink opened on the first frame."""
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.frame_size = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.frame_size is not None
+
+    def open(self, width: int, height: int, fps: float) -> None:
+        self.frame_size = (width, height)
+
+    def fit_frame(self, frame: Frame) -> Frame:
+        # adaptive quality can shrink frames, the sink keeps the size it was opened with
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        return frame
+
+    @abc.abstractmethod
+    def write(self, frame: Frame, captured_at: float = 0.0) -> bool:
+        pass
+
+    def close(self) -> None:
+        self.frame_size = None
+
+
+class FFmpegWriter(StreamWriter):
+    """Pipes raw BGR frames into ffmpeg, timestamped by arrival so frame timing is kept."""
+
+    use_wallclock = True
+
+    def get_input_args(self, width: int, height: int, fps: float) -> List[str]:
+        input_args = ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps)]
+        if self.use_wallclock:
+            input_args += ['-use_wallclock_as_timestamps', '1']
+        return input_args + ['-i', 'pipe:0']
+
+    def get_output_args(self) -> List[str]:
+        if self.output_path == '-':
+            return ['-f', 'mpegts', 'pipe:1']
+        if self.output_path.startswith('rtmp://'):
+            return ['-f', 'flv', self.output_path]
+        return [self.output_path]
+
+    def get_command(self, width: int, height: int, fps: float) -> List[str]:
+        return ['ffmpeg', '-hide_banner', '-loglevel', modules.globals.log_level, '-y'] + self.get_input_args(width, height, fps) + [
+            '-c:v', modules.globals.video_encoder,
+        ] + ENCODER_SPEED_ARGS.get(modules.globals.video_encoder, []) + [
+            '-pix_fmt', 'yuv420p', '-vsync', 'vfr',
+        ] + self.get_output_args()
+
+    def open(self, width: int, height: int, fps: float) -> None:
+        super().open(width, height, fps)
+        self.process = subprocess.Popen(self.get_command(width, height, fps), stdin=subprocess.PIPE)
+
+    def write(self, frame: Frame, captured_at: float = 0.0) -> bool:
+        try:
+            self.process.stdin.write(self.fit_frame(frame).tobytes())
+            return True
+        except (BrokenPipeError, OSError):
+            return False
+
+    def close(self) -> None:
+        if self.is_open:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.wait()
+        super().close()
+
+
+class SegmentWriter(FFmpegWriter):
+    """Keeps the last few minutes as rolling segment files, oldest overwritten first."""
+
+    def get_output_args(self) -> List[str]:
+        return [
+            '-f', 'segment', '-segment_time', str(SEGMENT_TIME), '-segment_wrap', str(SEGMENT_WRAP),
+            '-reset_timestamps', '1', self.output_path,
+        ]
+
+
+class LiveRecorder(FFmpegWriter):
+    """Records live frames through ffmpeg from a background thread.
+
+    ``put`` never blocks: frames wait in a bounded queue and are counted as
+    dropped when the encoder falls behind. Each frame is placed on a constant
+    rate timeline by its capture time, repeated or skipped as needed, so stalls
+    keep their real duration and stay in sync with the optional audio input
+    (given as ``format:device``, e.g. ``pulse:default``).
+    """
+
+    use_wallclock = False
+
+    def __init__(self, output_path: str, fps: float = 30.0, audio_input: Optional[str] = None):
+        super().__init__(output_path)
+        self.fps = fps
+        self.audio_input = audio_input
+        self.queue = queue.Queue(maxsize=RECORDER_QUEUE_SIZE)
+        self.dropped = 0
+        self.frame_count = 0
+        self.failed = False
+        self._start_time = 0.0
+        self._thread = None
+
+    def get_input_args(self, width: int, height: int, fps: float) -> List[str]:
+        input_args = super().get_input_args(width, height, fps)
+        if self.audio_input:
+            audio_format, audio_device = self.audio_input.split(':', 1)
+            input_args += ['-f', audio_format, '-i', audio_device]
+        return input_args
+
+    def get_output_args(self) -> List[str]:
+        if self.audio_input:
+            return ['-c:a', 'aac', '-shortest', self.output_path]
+        return [self.output_path]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._record_loop, name='live-recorder', daemon=True)
+        self._thread.start()
+
+    def put(self, frame: Frame, captured_at: float) -> None:
+        try:
+            self.queue.put_nowait((frame, captured_at))
+        except queue.Full:
+            self.dropped += 1
+
+    def _record_loop(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, captured_at = item
+            if self.failed:
+                continue
+            if not self.is_open:
+                self.open(frame.shape[1], frame.shape[0], self.fps)
+                self._start_time = captured_at
+            frame_index = round((captured_at - self._start_time) * self.fps)
+            for _ in range(max(0, frame_index - self.frame_count + 1)):
+                if not self.write(frame):
+                    # keep draining so close() never waits on a full queue
+                    self.failed = True
+                    break
+                self.frame_count += 1
+
+    def close(self) -> None:
+        if self._thread:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        super().close()
+
+
+class SocketWriter(StreamWriter):
+    """Serves raw frames on a Unix socket to one client at a time, dropping frames while none is connected."""
+
+    def __init__(self, output_path: str):
+        super().__init__(output_path)
+        self.server = None
+        self.client: Optional[Any] = None
+        self.dropped = 0
+        self._accept_thread = None
+
+    def open(self, width: int, height: int, fps: float) -> None:
+        super().open(width, height, fps)
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.output_path)
+        self.server.listen(1)
+        self._accept_thread = threading.Thread(target=self._accept_loop, name='live-socket', daemon=True)
+        self._accept_thread.start()
+
+    def _accept_loop(self) -> None:
+        while self.server:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break
+            if self.client:
+                client.close()
+                continue
+            self.client = client
+
+    def write(self, frame: Frame, captured_at: float = 0.0) -> bool:
+        client = self.client
+        if client is None:
+            self.dropped += 1
+            return True
+        frame = self.fit_frame(frame)
+        try:
+            client.sendall(SOCKET_FRAME_HEADER.pack(frame.shape[1], frame.shape[0], frame.shape[2], captured_at or time.perf_counter()))
+            client.sendall(frame.tobytes())
+        except OSError:
+            client.close()
+            self.client = None
+        return True
+
+    def close(self) -> None:
+        server, self.server = self.server, None
+        if server:
+            server.close()
+        if self.client:
+            self.client.close()
+            self.client = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+        super().close()
+
+
+def create_stream_writer(output_mode: str, output_path: str) -> StreamWriter:
+    if output_mode == 'socket':
+        return SocketWriter(output_path)
+    if output_mode == 'segment':
+        return SegmentWriter(output_path)
+    return FFmpegWriter(output_path)
+
+
+def create_live_recorder(fps: float) -> Optional[LiveRecorder]:
+    if not modules.globals.live_record_path:
+        return None
+    recorder = LiveRecorder(modules.globals.live_record_path, fps, modules.globals.live_record_audio)
+    recorder.start()
+    return recorder
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import cv2
+from PIL import Image, ImageOps
+
+import modules.metadata
+from modules.utilities import is_video
+
+THUMBNAIL_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), modules.metadata.name, 'thumbnails')
+THUMBNAIL_MEMORY_SIZE = 256
+# the disk cache is pruned to this on every write, least recently used first
+THUMBNAIL_DISK_BYTES = 64 * 1024 * 1024
+
+THUMBNAILS: 'OrderedDict[str, Image.Image]' = OrderedDict()
+THUMBNAILS_LOCK = threading.Lock()
+
+
+def get_thumbnail_key(file_path: str, size: Tuple[int, int], frame_number: int = 0) -> str:
+    # a changed file gets a new key, so stale thumbnails are never served
+    stat = os.stat(file_path)
+    key = f'{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}|{frame_number}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def read_video_thumbnail_frame(video_path: str, frame_number: int = 0) -> Optional[Image.Image]:
+    capture = cv2.VideoCapture(video_path)
+    try:
+        if frame_number:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        has_frame, frame = capture.read()
+    finally:
+        capture.release()
+    if not has_frame:
+        return None
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def create_thumbnail(file_path: str, size: Tuple[int, int], frame_number: int = 0) -> Optional[Image.Image]:
+    if is_video(file_path):
+        image = read_video_thumbnail_frame(file_path, frame_number)
+        if image is None:
+            return None
+    else:
+        image = Image.open(file_path)
+        # jpeg decodes straight to a reduced scale instead of full resolution
+        image.draft('RGB', (size[0] * 2, size[1] * 2))
+        image = image.convert('RGB')
+    # a cheap reduce to twice the covering size first keeps the filtered fit on a small image
+    scale = max(size[0] / image.width, size[1] / image.height)
+    if scale < 0.5:
+        image = image.resize((max(1, int(image.width * scale * 2)), max(1, int(image.height * scale * 2))), Image.BILINEAR, reducing_gap=2.0)
+    return ImageOps.fit(image, size, Image.BICUBIC)
+
+
+def prune_thumbnail_directory(max_bytes: int) -> None:
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(THUMBNAIL_DIRECTORY) if entry.is_file()]
+    except OSError:
+        return
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except OSError:
+            pass
+
+
+def get_thumbnail(file_path: str, size: Tuple[int, int], frame_number: int = 0) -> Optional[Image.Image]:
+    """Return a cropped thumbnail from memory, the disk cache, or a fresh decode."""
+    key = get_thumbnail_key(file_path, size, frame_number)
+    with THUMBNAILS_LOCK:
+        if key in THUMBNAILS:
+            THUMBNAILS.move_to_end(key)
+            return THUMBNAILS[key]
+    thumbnail_path = os.path.join(THUMBNAIL_DIRECTORY, f'{key}.png')
+    image = None
+    if os.path.isfile(thumbnail_path):
+        try:
+            image = Image.open(thumbnail_path)
+            image.load()
+            # reads refresh the mtime, so pruning drops the thumbnails unused the longest
+            os.utime(thumbnail_path)
+        except OSError:
+            image = None
+    if image is None:
+        image = create_thumbnail(file_path, size, frame_number)
+        if image is None:
+            return None
+        try:
+            Path(THUMBNAIL_DIRECTORY).mkdir(parents=True, exist_ok=True)
+            image.save(thumbnail_path)
+            prune_thumbnail_directory(THUMBNAIL_DISK_BYTES)
+        except OSError:
+            pass
+    with THUMBNAILS_LOCK:
+        THUMBNAILS[key] = image
+        while len(THUMBNAILS) > THUMBNAIL_MEMORY_SIZE:
+            THUMBNAILS.popitem(last=False)
+    return image
@@ -1,31 +1,40 @@
 import os
+import queue
+import threading
+import time
 import webbrowser
 import customtkinter as ctk
-from typing import Callable, Tuple
+from typing import Any, Callable, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 # from cv2_enumerate_cameras import enumerate_cameras  # Add this import
-from PIL import Image, ImageOps
-import time
+from PIL import Image
 import json
 import modules.globals
 import modules.metadata
 from modules.face_analyser import (
-    get_one_face,
+    get_one_face_from_file,
     get_unique_faces_from_target_image,
     get_unique_faces_from_target_video,
     add_blank_map,
     has_valid_map,
     simplify_maps,
 )
-from modules.capturer import get_video_frame, get_video_frame_total
-from modules.processors.frame.core import get_frame_processors_modules
+from modules.capturer import get_video_frame_total
+from modules.processors.frame.core import get_frame_processors_modules, set_job_context, check_cancelled, JobCancelled
 from modules.utilities import (
     is_image,
     is_video,
     resolve_relative_path,
     has_image_extension,
+    clean_temp,
 )
 from modules.video_capture import VideoCapturer
+from modules.live import LivePipeline, QualityController
+from modules.preview import get_preview_service
+from modules.thumbnails import get_thumbnail, read_video_thumbnail_frame
+from modules.presenter import FramePresenter, prepare_frame
+from modules.stream_writer import create_live_recorder
 from modules.gettext import LanguageManager
 import platform
 
@@ -57,6 +66,10 @@ POPUP_LIVE_SCROLL_HEIGHT = 700
 MAPPER_PREVIEW_MAX_HEIGHT = 100
 MAPPER_PREVIEW_MAX_WIDTH = 100
 
+LIVE_DISPLAY_INTERVAL = 5
+UI_EVENT_INTERVAL = 50
+PROGRESS_INTERVAL = 0.1
+
 DEFAULT_BUTTON_WIDTH = 200
 DEFAULT_BUTTON_HEIGHT = 40
 
@@ -65,7 +78,15 @@ RECENT_DIRECTORY_TARGET = None
 RECENT_DIRECTORY_OUTPUT = None
 
 _ = None
+UI_EVENTS = queue.Queue()
+DETECTION_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ui-detect")
+THUMBNAIL_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ui-thumbnail")
+THUMBNAIL_REQUESTS = {}
+JOB_THREAD = None
+JOB_CANCEL_EVENT = None
+start_button = None
 preview_label = None
+preview_presenter = None
 preview_slider = None
 source_label = None
 target_label = None
@@ -86,6 +107,7 @@ def init(start: Callable[[], None], destroy: Callable[[], None], lang: str) -> c
     _ = lang_manager._
     ROOT = create_root(start, destroy)
     PREVIEW = create_preview(ROOT)
+    process_ui_events()
 
     return ROOT
 
@@ -306,8 +328,13 @@ def create_root(start: Callable[[], None], destroy: Callable[[], None]) -> ctk.C
     )
     show_mouth_mask_box_switch.place(relx=0.6, rely=0.55)
 
+    global start_button
+
     start_button = ctk.CTkButton(
-        root, text=_("Start"), cursor="hand2", command=lambda: analyze_target(start, root)
+        root,
+        text=_("Start"),
+        cursor="hand2",
+        command=lambda: cancel_job() if is_job_running() else analyze_target(start, root),
     )
     start_button.place(relx=0.15, rely=0.80, relwidth=0.2, relheight=0.05)
 
@@ -399,17 +426,24 @@ def analyze_target(start: Callable[[], None], root: ctk.CTk):
     if modules.globals.map_faces:
         modules.globals.source_target_map = []
 
-        if is_image(modules.globals.target_path):
-            update_status("Getting unique faces")
-            get_unique_faces_from_target_image()
-        elif is_video(modules.globals.target_path):
-            update_status("Getting unique faces")
-            get_unique_faces_from_target_video()
-
-        if len(modules.globals.source_target_map) > 0:
-            create_source_target_popup(start, root, modules.globals.source_target_map)
-        else:
-            update_status("No faces found in target")
+        def show_source_target_popup() -> None:
+            if len(modules.globals.source_target_map) > 0:
+                create_source_target_popup(start, root, modules.globals.source_target_map)
+            else:
+                update_status("No faces found in target")
+
+        # the target analysis runs as a cancellable job, the mapper opens when it finishes
+        def analyze() -> None:
+            if is_image(modules.globals.target_path):
+                update_status("Getting unique faces")
+                get_unique_faces_from_target_image()
+            elif is_video(modules.globals.target_path):
+                update_status("Getting unique faces")
+                get_unique_faces_from_target_video()
+            check_cancelled()
+            call_in_ui(show_source_target_popup)
+
+        run_job(analyze)
     else:
         select_output_path(start)
 
@@ -494,49 +528,76 @@ def update_popup_source(
         filetypes=[img_ft],
     )
 
-    if "source" in map[button_num]:
-        map[button_num].pop("source")
-        source_label_dict[button_num].destroy()
-        del source_label_dict[button_num]
+    clear_mapper_face(map, button_num, "source", source_label_dict)
 
     if source_path == "":
         return map
     else:
-        cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
+        load_mapper_face(
+            scrollable_frame, map, button_num, "source", source_path, source_label_dict, 1, 10, update_pop_status
+        )
+        return map
 
-        if face:
-            x_min, y_min, x_max, y_max = face["bbox"]
 
-            map[button_num]["source"] = {
-                "cv2": cv2_img[int(y_min): int(y_max), int(x_min): int(x_max)],
-                "face": face,
-            }
+def clear_mapper_face(map: list, button_num: int, role: str, label_dict: dict) -> None:
+    # a detection still pending has a placeholder label but no map entry yet
+    map[button_num].pop(role, None)
+    label = label_dict.pop(button_num, None)
+    if label is not None:
+        label.destroy()
+
+
+def load_mapper_face(
+        scrollable_frame: ctk.CTkScrollableFrame,
+        map: list,
+        button_num: int,
+        role: str,
+        image_path: str,
+        label_dict: dict,
+        column: int,
+        padx: int,
+        update_mapper_status: Callable[[str], None],
+) -> None:
+    # a placeholder holds the cell while the face is detected on a worker
+    label = ctk.CTkLabel(
+        scrollable_frame,
+        text=_("Detecting..."),
+        width=MAPPER_PREVIEW_MAX_WIDTH,
+        height=MAPPER_PREVIEW_MAX_HEIGHT,
+    )
+    label.grid(row=button_num, column=column, padx=padx, pady=10)
+    label_dict[button_num] = label
 
-            image = Image.fromarray(
-                cv2.cvtColor(map[button_num]["source"]["cv2"], cv2.COLOR_BGR2RGB)
-            )
-            image = image.resize(
-                (MAPPER_PREVIEW_MAX_WIDTH, MAPPER_PREVIEW_MAX_HEIGHT), Image.LANCZOS
-            )
-            tk_image = ctk.CTkImage(image, size=image.size)
+    def on_detected(result) -> None:
+        # the cell may have been replaced, cleared or closed while detecting
+        if label_dict.get(button_num) is not label or not label.winfo_exists():
+            return
+        if result is None:
+            label.destroy()
+            del label_dict[button_num]
+            update_mapper_status("Face could not be detected in last upload!")
+            return
+        face, face_image = result
+        map[button_num][role] = {"cv2": face_image, "face": face}
+        image = Image.fromarray(cv2.cvtColor(face_image, cv2.COLOR_BGR2RGB))
+        image = image.resize(
+            (MAPPER_PREVIEW_MAX_WIDTH, MAPPER_PREVIEW_MAX_HEIGHT), Image.LANCZOS
+        )
+        label.configure(image=ctk.CTkImage(image, size=image.size), text=f"{role[0].upper()}-{button_num}")
 
-            source_image = ctk.CTkLabel(
-                scrollable_frame,
-                text=f"S-{button_num}",
-                width=MAPPER_PREVIEW_MAX_WIDTH,
-                height=MAPPER_PREVIEW_MAX_HEIGHT,
-            )
-            source_image.grid(row=button_num, column=1, padx=10, pady=10)
-            source_image.configure(image=tk_image)
-            source_label_dict[button_num] = source_image
-        else:
-            update_pop_status("Face could not be detected in last upload!")
-        return map
+    detect_face_async(image_path, on_detected)
+
+
+def detect_face_async(image_path: str, on_detected: Callable[[Any], None]) -> None:
+    def on_done(future) -> None:
+        result = None if future.exception() else future.result()
+        call_in_ui(lambda: on_detected(result))
+
+    DETECTION_EXECUTOR.submit(get_one_face_from_file, image_path).add_done_callback(on_done)
 
 
 def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
-    global preview_label, preview_slider
+    global preview_label, preview_presenter, preview_slider
 
     preview = ctk.CTkToplevel(parent)
     preview.withdraw()
@@ -547,6 +608,7 @@ def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
 
     preview_label = ctk.CTkLabel(preview, text=None)
     preview_label.pack(fill="both", expand=True)
+    preview_presenter = FramePresenter(preview_label)
 
     preview_slider = ctk.CTkSlider(
         preview, from_=0, to=0, command=lambda frame_value: update_preview(frame_value)
@@ -556,6 +618,11 @@ def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
 
 
 def update_status(text: str) -> None:
+    if status_label is None:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        call_in_ui(lambda: update_status(text))
+        return
     status_label.configure(text=_(text))
     ROOT.update()
 
@@ -591,9 +658,9 @@ def select_source_path() -> None:
     if is_image(source_path):
         modules.globals.source_path = source_path
         RECENT_DIRECTORY_SOURCE = os.path.dirname(modules.globals.source_path)
-        image = render_image_preview(modules.globals.source_path, (200, 200))
-        source_label.configure(image=image)
+        show_thumbnail(source_label, modules.globals.source_path, (200, 200))
     else:
+        show_thumbnail(source_label, None, (200, 200))
         modules.globals.source_path = None
         source_label.configure(image=None)
 
@@ -615,11 +682,8 @@ def swap_faces_paths() -> None:
 
     PREVIEW.withdraw()
 
-    source_image = render_image_preview(modules.globals.source_path, (200, 200))
-    source_label.configure(image=source_image)
-
-    target_image = render_image_preview(modules.globals.target_path, (200, 200))
-    target_label.configure(image=target_image)
+    show_thumbnail(source_label, modules.globals.source_path, (200, 200))
+    show_thumbnail(target_label, modules.globals.target_path, (200, 200))
 
 
 def select_target_path() -> None:
@@ -634,14 +698,13 @@ def select_target_path() -> None:
     if is_image(target_path):
         modules.globals.target_path = target_path
         RECENT_DIRECTORY_TARGET = os.path.dirname(modules.globals.target_path)
-        image = render_image_preview(modules.globals.target_path, (200, 200))
-        target_label.configure(image=image)
+        show_thumbnail(target_label, modules.globals.target_path, (200, 200))
     elif is_video(target_path):
         modules.globals.target_path = target_path
         RECENT_DIRECTORY_TARGET = os.path.dirname(modules.globals.target_path)
-        video_frame = render_video_preview(target_path, (200, 200))
-        target_label.configure(image=video_frame)
+        show_thumbnail(target_label, target_path, (200, 200))
     else:
+        show_thumbnail(target_label, None, (200, 200))
         modules.globals.target_path = None
         target_label.configure(image=None)
 
@@ -670,12 +733,84 @@ def select_output_path(start: Callable[[], None]) -> None:
     if output_path:
         modules.globals.output_path = output_path
         RECENT_DIRECTORY_OUTPUT = os.path.dirname(modules.globals.output_path)
-        start()
+        run_job(start)
+
+
+def call_in_ui(callback: Callable[[], None]) -> None:
+    # Tk widgets may only be touched from the main thread, workers queue their updates instead
+    UI_EVENTS.put(callback)
+
+
+def process_ui_events() -> None:
+    while True:
+        try:
+            callback = UI_EVENTS.get_nowait()
+        except queue.Empty:
+            break
+        callback()
+    ROOT.after(UI_EVENT_INTERVAL, process_ui_events)
+
+
+def run_in_ui(callback: Callable[[], None]) -> None:
+    # headless runs have no event loop draining the queue, so the callback runs in place
+    if ROOT is None or threading.current_thread() is threading.main_thread():
+        callback()
+    else:
+        call_in_ui(callback)
+
+
+def is_job_running() -> bool:
+    return JOB_THREAD is not None and JOB_THREAD.is_alive()
+
+
+def run_job(job: Callable[[], None]) -> None:
+    global JOB_THREAD, JOB_CANCEL_EVENT
+
+    if is_job_running():
+        update_status("Processing is already running.")
+        return
+    JOB_CANCEL_EVENT = threading.Event()
+    last_progress_time = 0.0
+
+    def report_progress(completed: int, total: int) -> None:
+        nonlocal last_progress_time
+        # throttled so a fast job does not flood the event queue
+        if completed == total or time.perf_counter() - last_progress_time >= PROGRESS_INTERVAL:
+            last_progress_time = time.perf_counter()
+            call_in_ui(lambda: update_status(f"Processing frame {completed}/{total}"))
+
+    def run() -> None:
+        set_job_context(report_progress, JOB_CANCEL_EVENT)
+        try:
+            job()
+        except JobCancelled:
+            if modules.globals.target_path:
+                clean_temp(modules.globals.target_path)
+            call_in_ui(lambda: update_status("Processing cancelled!"))
+        except Exception as exception:
+            message = f"Processing failed: {exception}"
+            call_in_ui(lambda: update_status(message))
+        finally:
+            set_job_context()
+            call_in_ui(lambda: start_button.configure(text=_("Start")))
+
+    JOB_THREAD = threading.Thread(target=run, name="ui-job", daemon=True)
+    JOB_THREAD.start()
+    start_button.configure(text=_("Cancel"))
+
+
+def cancel_job() -> None:
+    if is_job_running():
+        JOB_CANCEL_EVENT.set()
+        update_status("Cancelling...")
 
 
 def check_and_ignore_nsfw(target, destroy: Callable = None) -> bool:
     """Check if the target is NSFW.
     TODO: Consider to make blur the target.
+
+    The prediction runs on the calling thread, which may be a job worker,
+    while destroy runs on the ui thread.
     """
     from numpy import ndarray
     from modules.predicter import predict_image, predict_video, predict_frame
@@ -686,8 +821,8 @@ def check_and_ignore_nsfw(target, destroy: Callable = None) -> bool:
         check_nsfw = predict_frame
     if check_nsfw and check_nsfw(target):
         if destroy:
-            destroy(
-                to_quit=False
+            run_in_ui(
+                lambda: destroy(to_quit=False)
             )  # Do not need to destroy the window frame if the target is NSFW
         update_status("Processing ignored!")
         return True
@@ -695,51 +830,47 @@ def check_and_ignore_nsfw(target, destroy: Callable = None) -> bool:
         return False
 
 
-def fit_image_to_size(image, width: int, height: int):
-    if width is None or height is None or width <= 0 or height <= 0:
-        return image
-    h, w, _ = image.shape
-    ratio_h = 0.0
-    ratio_w = 0.0
-    ratio_w = width / w
-    ratio_h = height / h
-    # Use the smaller ratio to ensure the image fits within the given dimensions
-    ratio = min(ratio_w, ratio_h)
-    
-    # Compute new dimensions, ensuring they're at least 1 pixel
-    new_width = max(1, int(ratio * w))
-    new_height = max(1, int(ratio * h))
-    new_size = (new_width, new_height)
-
-    return cv2.resize(image, dsize=new_size)
-
-
 def render_image_preview(image_path: str, size: Tuple[int, int]) -> ctk.CTkImage:
-    image = Image.open(image_path)
     if size:
-        image = ImageOps.fit(image, size, Image.LANCZOS)
+        image = get_thumbnail(image_path, size)
+    else:
+        image = Image.open(image_path)
     return ctk.CTkImage(image, size=image.size)
 
 
 def render_video_preview(
         video_path: str, size: Tuple[int, int], frame_number: int = 0
 ) -> ctk.CTkImage:
-    capture = cv2.VideoCapture(video_path)
-    if frame_number:
-        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-    has_frame, frame = capture.read()
-    if has_frame:
-        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        if size:
-            image = ImageOps.fit(image, size, Image.LANCZOS)
+    if size:
+        image = get_thumbnail(video_path, size, frame_number)
+    else:
+        image = read_video_thumbnail_frame(video_path, frame_number)
+    if image is not None:
         return ctk.CTkImage(image, size=image.size)
-    capture.release()
-    cv2.destroyAllWindows()
+
+
+def show_thumbnail(label: ctk.CTkLabel, file_path: str, size: Tuple[int, int]) -> None:
+    # only the latest request per label may set its image
+    THUMBNAIL_REQUESTS[str(label)] = file_path
+    if file_path is None:
+        label.configure(image=None)
+        return
+
+    def on_loaded(image) -> None:
+        if THUMBNAIL_REQUESTS.get(str(label)) == file_path:
+            label.configure(image=ctk.CTkImage(image, size=image.size) if image else None)
+
+    def on_done(future) -> None:
+        image = None if future.exception() else future.result()
+        call_in_ui(lambda: on_loaded(image))
+
+    THUMBNAIL_EXECUTOR.submit(get_thumbnail, file_path, size).add_done_callback(on_done)
 
 
 def toggle_preview() -> None:
     if PREVIEW.state() == "normal":
         PREVIEW.withdraw()
+        get_preview_service().close()
     elif modules.globals.source_path and modules.globals.target_path:
         init_preview()
         update_preview()
@@ -758,21 +889,19 @@ def init_preview() -> None:
 def update_preview(frame_number: int = 0) -> None:
     if modules.globals.source_path and modules.globals.target_path:
         update_status("Processing...")
-        temp_frame = get_video_frame(modules.globals.target_path, frame_number)
-        if modules.globals.nsfw_filter and check_and_ignore_nsfw(temp_frame):
+        preview_service = get_preview_service()
+        if modules.globals.nsfw_filter:
+            temp_frame = preview_service.decode_frame(modules.globals.target_path, int(frame_number))
+            # the classifier takes bgr frames, color correction decodes previews as rgb
+            if modules.globals.color_correction and temp_frame is not None:
+                temp_frame = cv2.cvtColor(temp_frame, cv2.COLOR_RGB2BGR)
+            if check_and_ignore_nsfw(temp_frame):
+                return
+        _, temp_frame = preview_service.get_preview_frame(modules.globals.target_path, int(frame_number))
+        if temp_frame is None:
+            update_status("Processing failed!")
             return
-        for frame_processor in get_frame_processors_modules(
-                modules.globals.frame_processors
-        ):
-            temp_frame = frame_processor.process_frame(
-                get_one_face(cv2.imread(modules.globals.source_path)), temp_frame
-            )
-        image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
-        image = ImageOps.contain(
-            image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
-        )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
+        preview_presenter.show_frame(temp_frame, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT))
         update_status("Processing succeed!")
         PREVIEW.deiconify()
 
@@ -871,7 +1000,7 @@ def get_available_cameras():
 def create_webcam_preview(camera_index: int):
     global preview_label, PREVIEW
 
-    cap = VideoCapturer(camera_index)
+    cap = VideoCapturer(modules.globals.live_video_path or camera_index)
     if not cap.start(PREVIEW_DEFAULT_WIDTH, PREVIEW_DEFAULT_HEIGHT, 60):
         update_status("Failed to start camera")
         return
@@ -880,84 +1009,50 @@ def create_webcam_preview(camera_index: int):
     PREVIEW.deiconify()
 
     frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
-    source_image = None
-    prev_time = time.time()
-    fps_update_interval = 0.5
-    frame_count = 0
-    fps = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        temp_frame = frame.copy()
-
-        if modules.globals.live_mirror:
-            temp_frame = cv2.flip(temp_frame, 1)
-
-        if modules.globals.live_resizable:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
-            )
-
-        else:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
-            )
-
-        if not modules.globals.map_faces:
-            if source_image is None and modules.globals.source_path:
-                source_image = get_one_face(cv2.imread(modules.globals.source_path))
-
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame(None, temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame(source_image, temp_frame)
-        else:
-            modules.globals.target_path = None
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame_v2(temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame_v2(temp_frame)
-
-        # Calculate and display FPS
-        current_time = time.time()
-        frame_count += 1
-        if current_time - prev_time >= fps_update_interval:
-            fps = frame_count / (current_time - prev_time)
-            frame_count = 0
-            prev_time = current_time
-
-        if modules.globals.show_fps:
-            cv2.putText(
-                temp_frame,
-                f"FPS: {fps:.1f}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1,
-                (0, 255, 0),
-                2,
-            )
-
-        image = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-        image = ImageOps.contain(
-            image, (temp_frame.shape[1], temp_frame.shape[0]), Image.LANCZOS
+    def present_frame(temp_frame):
+        # frames processed at a reduced scale are brought back up to the window size here
+        return prepare_frame(temp_frame, pipeline.frame_size)
+
+    controller = None
+    if modules.globals.live_target_fps:
+        controller = QualityController(
+            modules.globals.live_target_fps, modules.globals.live_latency_budget / 1000
         )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
-        ROOT.update()
+    recorder = create_live_recorder(cap.cap.get(cv2.CAP_PROP_FPS) or 30)
+    pipeline = LivePipeline(
+        cap,
+        frame_processors,
+        present_frame,
+        modules.globals.live_pipeline_depth,
+        modules.globals.live_latency_budget / 1000,
+        controller,
+        recorder,
+    )
+    pipeline.frame_size = (PREVIEW.winfo_width(), PREVIEW.winfo_height())
+    pipeline.start()
+
+    # the Tk thread only shows presented frames, every other stage runs on the pipeline threads
+    def update_webcam_frame() -> None:
+        if PREVIEW.state() == "withdrawn" or not pipeline.is_running:
+            pipeline.stop()
+            cap.release()
+            PREVIEW.withdraw()
+            if pipeline.error:
+                update_status(f"Live session stopped: {pipeline.error}")
+            if pipeline.latencies:
+                update_status(f"Live session {pipeline.get_latency_text()}, dropped {cap.dropped + pipeline.dropped} frames")
+            if recorder:
+                recorder.close()
+                update_status(f"Recorded {recorder.frame_count} frames, dropped {recorder.dropped}")
+            return
 
-        if PREVIEW.state() == "withdrawn":
-            break
+        pipeline.frame_size = (PREVIEW.winfo_width(), PREVIEW.winfo_height())
+        image = pipeline.get_frame()
+        if image is not None:
+            preview_presenter.show(image)
+        ROOT.after(LIVE_DISPLAY_INTERVAL, update_webcam_frame)
 
-    cap.release()
-    PREVIEW.withdraw()
+    update_webcam_frame()
 
 
 def create_source_target_popup_for_webcam(
@@ -1113,44 +1208,14 @@ def update_webcam_source(
         filetypes=[img_ft],
     )
 
-    if "source" in map[button_num]:
-        map[button_num].pop("source")
-        source_label_dict_live[button_num].destroy()
-        del source_label_dict_live[button_num]
+    clear_mapper_face(map, button_num, "source", source_label_dict_live)
 
     if source_path == "":
         return map
     else:
-        cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
-
-        if face:
-            x_min, y_min, x_max, y_max = face["bbox"]
-
-            map[button_num]["source"] = {
-                "cv2": cv2_img[int(y_min): int(y_max), int(x_min): int(x_max)],
-                "face": face,
-            }
-
-            image = Image.fromarray(
-                cv2.cvtColor(map[button_num]["source"]["cv2"], cv2.COLOR_BGR2RGB)
-            )
-            image = image.resize(
-                (MAPPER_PREVIEW_MAX_WIDTH, MAPPER_PREVIEW_MAX_HEIGHT), Image.LANCZOS
-            )
-            tk_image = ctk.CTkImage(image, size=image.size)
-
-            source_image = ctk.CTkLabel(
-                scrollable_frame,
-                text=f"S-{button_num}",
-                width=MAPPER_PREVIEW_MAX_WIDTH,
-                height=MAPPER_PREVIEW_MAX_HEIGHT,
-            )
-            source_image.grid(row=button_num, column=1, padx=10, pady=10)
-            source_image.configure(image=tk_image)
-            source_label_dict_live[button_num] = source_image
-        else:
-            update_pop_live_status("Face could not be detected in last upload!")
+        load_mapper_face(
+            scrollable_frame, map, button_num, "source", source_path, source_label_dict_live, 1, 10, update_pop_live_status
+        )
         return map
 
 
@@ -1165,42 +1230,12 @@ def update_webcam_target(
         filetypes=[img_ft],
     )
 
-    if "target" in map[button_num]:
-        map[button_num].pop("target")
-        target_label_dict_live[button_num].destroy()
-        del target_label_dict_live[button_num]
+    clear_mapper_face(map, button_num, "target", target_label_dict_live)
 
     if target_path == "":
         return map
     else:
-        cv2_img = cv2.imread(target_path)
-        face = get_one_face(cv2_img)
-
-        if face:
-            x_min, y_min, x_max, y_max = face["bbox"]
-
-            map[button_num]["target"] = {
-                "cv2": cv2_img[int(y_min): int(y_max), int(x_min): int(x_max)],
-                "face": face,
-            }
-
-            image = Image.fromarray(
-                cv2.cvtColor(map[button_num]["target"]["cv2"], cv2.COLOR_BGR2RGB)
-            )
-            image = image.resize(
-                (MAPPER_PREVIEW_MAX_WIDTH, MAPPER_PREVIEW_MAX_HEIGHT), Image.LANCZOS
-            )
-            tk_image = ctk.CTkImage(image, size=image.size)
-
-            target_image = ctk.CTkLabel(
-                scrollable_frame,
-                text=f"T-{button_num}",
-                width=MAPPER_PREVIEW_MAX_WIDTH,
-                height=MAPPER_PREVIEW_MAX_HEIGHT,
-            )
-            target_image.grid(row=button_num, column=4, padx=20, pady=10)
-            target_image.configure(image=tk_image)
-            target_label_dict_live[button_num] = target_image
-        else:
-            update_pop_live_status("Face could not be detected in last upload!")
+        load_mapper_face(
+            scrollable_frame, map, button_num, "target", target_path, target_label_dict_live, 4, 20, update_pop_live_status
+        )
         return map
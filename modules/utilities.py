@@ -1,4 +1,5 @@
 import glob
+import hashlib
 import mimetypes
 import os
 import platform
@@ -14,6 +15,7 @@ import modules.globals
 
 TEMP_FILE = "temp.mp4"
 TEMP_DIRECTORY = "temp"
+ANALYSIS_DIRECTORY = "analysis"
 
 # monkey patch ssl for mac
 if platform.system().lower() == "darwin":
@@ -129,6 +131,20 @@ def get_temp_directory_path(target_path: str) -> str:
     return os.path.join(target_directory_path, TEMP_DIRECTORY, target_name)
 
 
+def get_analysis_directory_path(target_path: str, key: str) -> str:
+    target_name, _ = os.path.splitext(os.path.basename(target_path))
+    target_directory_path = os.path.dirname(target_path)
+    return os.path.join(target_directory_path, ANALYSIS_DIRECTORY, f"{target_name}-{key}")
+
+
+def get_file_hash(file_path: str) -> str:
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
 def get_temp_output_path(target_path: str) -> str:
     temp_directory_path = get_temp_directory_path(target_path)
     return os.path.join(temp_directory_path, TEMP_FILE)
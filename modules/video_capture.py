@@ -1,8 +1,9 @@
 import cv2
 import numpy as np
-from typing import Optional, Tuple, Callable
+from typing import Optional, Tuple, Callable, Union
 import platform
 import threading
+import time
 
 # Only import Windows-specific library if on Windows
 if platform.system() == "Windows":
@@ -10,16 +11,28 @@ if platform.system() == "Windows":
 
 
 class VideoCapturer:
-    def __init__(self, device_index: int):
+    """Grabs frames on its own thread and hands out only the newest one.
+
+    ``device_index`` may also be a video file path, which is played back at
+    its native frame rate as a stand-in camera.
+    """
+
+    def __init__(self, device_index: Union[int, str]):
         self.device_index = device_index
         self.frame_callback = None
         self._current_frame = None
-        self._frame_ready = threading.Event()
+        self._current_timestamp = 0.0
+        self._frame_number = 0
+        self._read_number = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self.dropped = 0
         self.is_running = False
+        self.is_file = isinstance(device_index, str)
         self.cap = None
 
         # Initialize Windows-specific components if on Windows
-        if platform.system() == "Windows":
+        if platform.system() == "Windows" and not self.is_file:
             self.graph = FilterGraph()
             # Verify device exists
             devices = self.graph.get_input_devices()
@@ -31,7 +44,9 @@ class VideoCapturer:
     def start(self, width: int = 960, height: int = 540, fps: int = 60) -> bool:
         """Initialize and start video capture"""
         try:
-            if platform.system() == "Windows":
+            if self.is_file:
+                self.cap = cv2.VideoCapture(self.device_index)
+            elif platform.system() == "Windows":
                 # Windows-specific capture methods
                 capture_methods = [
                     (self.device_index, cv2.CAP_DSHOW),  # Try DirectShow first
@@ -55,12 +70,17 @@ class VideoCapturer:
             if not self.cap or not self.cap.isOpened():
                 raise RuntimeError("Failed to open camera")
 
-            # Configure format
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-            self.cap.set(cv2.CAP_PROP_FPS, fps)
+            if not self.is_file:
+                # Configure format
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                self.cap.set(cv2.CAP_PROP_FPS, fps)
+                # a one frame driver queue keeps frames from going stale before they are grabbed
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
             self.is_running = True
+            self._thread = threading.Thread(target=self._capture_loop, name="video-capture", daemon=True)
+            self._thread.start()
             return True
 
         except Exception as e:
@@ -69,24 +89,60 @@ class VideoCapturer:
                 self.cap.release()
             return False
 
-    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
-        """Read a frame from the camera"""
-        if not self.is_running or self.cap is None:
-            return False, None
-
-        ret, frame = self.cap.read()
-        if ret:
-            self._current_frame = frame
+    def _capture_loop(self) -> None:
+        frame_interval = 0.0
+        if self.is_file:
+            frame_interval = 1.0 / (self.cap.get(cv2.CAP_PROP_FPS) or 30)
+        next_frame_time = time.perf_counter()
+        while self.is_running:
+            if frame_interval:
+                # pace file playback like a camera, falling behind drops frames instead of slowing down
+                delay = next_frame_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_frame_time += frame_interval
+            cap = self.cap
+            if cap is None:
+                break
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timestamp = time.perf_counter()
+            with self._condition:
+                if self._frame_number > self._read_number:
+                    self.dropped += 1
+                self._current_frame = frame
+                self._current_timestamp = timestamp
+                self._frame_number += 1
+                self._condition.notify_all()
             if self.frame_callback:
                 self.frame_callback(frame)
-            return True, frame
-        return False, None
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+
+    def read_timestamped(self, timeout: Optional[float] = 1.0) -> Tuple[bool, Optional[np.ndarray], float]:
+        """Wait for a frame newer than the last one read and return it with its capture time"""
+        with self._condition:
+            if self._frame_number == self._read_number and self.is_running:
+                self._condition.wait(timeout)
+            if self._frame_number == self._read_number:
+                return False, None, 0.0
+            self._read_number = self._frame_number
+            return True, self._current_frame, self._current_timestamp
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        """Read a frame from the camera"""
+        ret, frame, _ = self.read_timestamped()
+        return ret, frame
 
     def release(self) -> None:
         """Stop capture and release resources"""
-        if self.is_running and self.cap is not None:
-            self.cap.release()
+        if self.cap is not None:
             self.is_running = False
+            if self._thread and self._thread is not threading.current_thread():
+                self._thread.join(timeout=1.0)
+            self.cap.release()
             self.cap = None
 
     def set_frame_callback(self, callback: Callable[[np.ndarray], None]) -> None:
@@ -0,0 +1,107 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import modules.globals
+from modules.core import update_status, get_folder_output_path
+from modules.server import JobServer, create_job_server, submit_job_paths
+
+NAME = 'DLC.WATCH'
+
+
+class FolderWatcher:
+    """Polls a folder, or a single file, for files that stopped changing.
+
+    A file is reported once its size and modification time are the same on
+    two polls and at least ``settle_time`` seconds old, so files still being
+    copied are not picked up, and reported again whenever it changes.
+    """
+
+    def __init__(self, path: str, settle_time: float):
+        self.path = path
+        self.settle_time = settle_time
+        self.previous: Dict[str, Tuple[int, int]] = {}
+        self.stable: Dict[str, Tuple[int, int]] = {}
+
+    @property
+    def files(self) -> List[str]:
+        return sorted(self.stable)
+
+    def list_files(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        if os.path.isfile(self.path):
+            stat = os.stat(self.path)
+            files[self.path] = (stat.st_size, stat.st_mtime_ns)
+            return files
+        try:
+            entries = os.scandir(self.path)
+        except OSError:
+            return files
+        with entries:
+            for entry in entries:
+                # dot files are mostly partial uploads and editor temp files
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self) -> List[str]:
+        """Return the files that became stable since the last poll."""
+        files = self.list_files()
+        now = time.time()
+        changed = []
+        for path, key in files.items():
+            if self.stable.get(path) == key:
+                continue
+            if self.previous.get(path) == key and now - key[1] / 1e9 >= self.settle_time:
+                self.stable[path] = key
+                changed.append(path)
+        for path in set(self.stable) - set(files):
+            del self.stable[path]
+        self.previous = files
+        return changed
+
+
+def create_watcher(folder: Optional[str], file_path: Optional[str]) -> Optional[FolderWatcher]:
+    path = folder or file_path
+    if not path:
+        return None
+    return FolderWatcher(path, modules.globals.watch_settle)
+
+
+def get_changed_job_paths(source_paths: List[Optional[str]], target_paths: List[str], changed_sources: List[str], changed_targets: List[str]) -> List[Tuple[Optional[str], str, str]]:
+    """Pair changed sources with every target and every other source with the changed targets."""
+    # outputs written next to the targets must not come back as new targets
+    output_paths = {get_folder_output_path(source_path, target_path) for source_path in source_paths for target_path in target_paths}
+    job_paths = []
+    for source_path in source_paths:
+        for target_path in target_paths if source_path in changed_sources else changed_targets:
+            if target_path not in output_paths:
+                job_paths.append((source_path, target_path, get_folder_output_path(source_path, target_path)))
+    return job_paths
+
+
+def watch(job_server: Optional[JobServer] = None) -> None:
+    """Queue new and changed -sf/-tf pairs on warm models until interrupted."""
+    if not modules.globals.source_folder and not modules.globals.target_folder:
+        update_status('Watch mode needs a source or target folder', NAME)
+        return
+    if job_server is None:
+        job_server = create_job_server()
+    source_watcher = create_watcher(modules.globals.source_folder, modules.globals.source_path)
+    target_watcher = create_watcher(modules.globals.target_folder, modules.globals.target_path)
+    if target_watcher is None:
+        update_status('Watch mode needs a target folder or file', NAME)
+        return
+    update_status(f'Watching {", ".join(watcher.path for watcher in (source_watcher, target_watcher) if watcher)}', NAME)
+    while True:
+        changed_sources = source_watcher.poll() if source_watcher else []
+        changed_targets = target_watcher.poll()
+        if changed_sources or changed_targets:
+            source_paths = source_watcher.files if source_watcher else [None]
+            submit_job_paths(job_server, get_changed_job_paths(source_paths, target_watcher.files, changed_sources, changed_targets))
+        time.sleep(modules.globals.watch_interval)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+
+from modules.cluster_analysis import find_cluster_centroids
+
+
+def make_embeddings(families: int, identities: int = 1, per_identity: int = 120, seed: int = 0):
+    """Faces of ``families`` groups of look-alike identities, which the largest inertia drop separates."""
+    rng = np.random.default_rng(seed)
+    family_centers = rng.normal(size=(families, 1, 512))
+    centers = (family_centers + rng.normal(scale=0.3, size=(families, identities, 512))).reshape(-1, 512)
+    embeddings = np.repeat(centers, per_identity, axis=0) + rng.normal(scale=0.1, size=(len(centers) * per_identity, 512))
+    # consecutive video frames repeat the same face almost exactly
+    embeddings = np.vstack([embeddings, embeddings[::3] + rng.normal(scale=1e-4, size=embeddings[::3].shape)])
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(np.float32)
+
+
+def find_cluster_centroids_exhaustive(embeddings, max_k=10):
+    # the original implementation, a fresh k-means++ fit on every embedding for each k
+    inertia = []
+    cluster_centroids = []
+    for k in range(1, max_k + 1):
+        kmeans = KMeans(n_clusters=k, random_state=0).fit(embeddings)
+        inertia.append(kmeans.inertia_)
+        cluster_centroids.append(kmeans.cluster_centers_)
+    diffs = [inertia[i] - inertia[i + 1] for i in range(len(inertia) - 1)]
+    return cluster_centroids[diffs.index(max(diffs)) + 1]
+
+
+def assign(embeddings, centroids):
+    return np.argmax(embeddings @ np.asarray(centroids, dtype=np.float32).T, axis=1)
+
+
+def test_empty_embeddings_have_no_centroids():
+    assert find_cluster_centroids(np.empty((0, 512), dtype=np.float32)).shape == (0, 512)
+    assert len(find_cluster_centroids([])) == 0
+
+
+@pytest.mark.parametrize('identities', [1, 3])
+def test_assignments_match_exhaustive_clustering(identities):
+    embeddings = make_embeddings(2, identities)
+    centroids = find_cluster_centroids(embeddings)
+    expected = find_cluster_centroids_exhaustive(embeddings)
+    assert len(centroids) == len(expected)
+    assert adjusted_rand_score(assign(embeddings, expected), assign(embeddings, centroids)) == 1.0
@@ -0,0 +1,50 @@
+import sys
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.core
+import modules.globals
+import modules.server
+
+
+def test_queue_alone_runs_headless_and_drains_the_queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, 'argv', ['run.py', '--queue', str(tmp_path / 'jobs.db')])
+    modules.core.parse_args()
+    assert modules.globals.headless
+
+    drained = []
+    monkeypatch.setattr(modules.server, 'run_queue', drained.append)
+    modules.core.start()
+    assert drained == [[]]
+
+
+def test_warm_up_includes_the_nsfw_model_when_filtering(monkeypatch):
+    import modules.face_analyser
+    import modules.predicter
+
+    warmed = []
+    monkeypatch.setattr(modules.globals, 'frame_processors', [])
+    monkeypatch.setattr(modules.globals, 'headless', True)
+    monkeypatch.setattr(modules.face_analyser, 'warm_up', lambda: warmed.append('analyser'))
+    monkeypatch.setattr(modules.predicter, 'warm_up', lambda: warmed.append('predicter'))
+    monkeypatch.setattr(modules.globals, 'nsfw_filter', False)
+    modules.core.warm_up()
+    assert warmed == ['analyser']
+    monkeypatch.setattr(modules.globals, 'nsfw_filter', True)
+    modules.core.warm_up()
+    assert sorted(warmed[1:]) == ['analyser', 'predicter']
+
+
+@pytest.mark.parametrize('nsfw_filter', [False, True])
+def test_pre_check_passes_with_ffmpeg(monkeypatch, nsfw_filter):
+    import modules.predicter
+
+    monkeypatch.setattr(modules.core.shutil, 'which', lambda name: '/usr/bin/' + name)
+    monkeypatch.setattr(modules.predicter, 'pre_check', lambda: True)
+    monkeypatch.setattr(modules.globals, 'map_faces', False)
+    monkeypatch.setattr(modules.globals, 'nsfw_filter', nsfw_filter)
+    assert modules.core.pre_check()
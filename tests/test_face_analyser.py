@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.globals
+from modules.face_analyser import IdentityGallery
+
+
+def test_identity_gallery_add_dedupes_repeated_targets():
+    rng = np.random.default_rng(0)
+    targets = rng.normal(size=(3, 512))
+    sources = rng.normal(size=(3, 512))
+    gallery = IdentityGallery()
+    assert all(gallery.add(target, source) for target, source in zip(targets, sources))
+    # a second run over the same target maps the same faces again
+    assert not any(gallery.add(target, source) for target, source in zip(targets, sources[::-1]))
+    assert len(gallery) == 3
+    np.testing.assert_allclose(gallery.source_embeddings[0], sources[2] / np.linalg.norm(sources[2]), rtol=1e-5)
+
+
+def test_sampled_analysis_assigns_lazy_faces_like_exhaustive_analysis():
+    from insightface.app.common import Face
+    from sklearn.metrics import adjusted_rand_score
+
+    from modules.cluster_analysis import find_cluster_centroids
+    from modules.face_store import FaceStore
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(2, 512))
+    frames = []
+    for frame in range(300):
+        # identities come and go by shot, a few frames hold both
+        identities = [frame // 50 % 2] + ([1 - frame // 50 % 2] if frame % 7 == 0 else [])
+        frames.append([Face(bbox=np.zeros(4), kps=np.zeros((5, 2)), det_score=1.0, embedding=centers[identity] + rng.normal(scale=0.3, size=512)) for identity in identities])
+
+    exhaustive_store = FaceStore()
+    sampled_store = FaceStore()
+    stride = 10
+    for frame, faces in enumerate(frames):
+        exhaustive_store.add_frame(str(frame), faces)
+        if frame % stride == 0:
+            sampled_store.add_frame(str(frame), faces)
+    for store in (exhaustive_store, sampled_store):
+        store.finalize()
+        store.assign_clusters(find_cluster_centroids(store.embedding))
+
+    lazy_frames = [frame for frame in range(len(frames)) if frame % stride]
+    expected = np.concatenate([exhaustive_store.cluster[exhaustive_store.frame_rows(str(frame))] for frame in lazy_frames])
+    actual = np.concatenate([sampled_store.nearest_clusters(frames[frame]) for frame in lazy_frames])
+    assert adjusted_rand_score(expected, actual) == 1.0
+
+
+def test_target_analysis_stops_when_the_job_is_cancelled(monkeypatch):
+    import threading
+
+    import modules.face_analyser
+    from modules.processors.frame.core import JobCancelled, set_job_context
+
+    detected = []
+    monkeypatch.setattr(modules.face_analyser, 'get_many_faces', lambda frame: detected.append(frame) or [])
+    cancel_event = threading.Event()
+    cancel_event.set()
+    set_job_context(None, cancel_event)
+    try:
+        with pytest.raises(JobCancelled):
+            modules.face_analyser.detect_target_faces(['missing.png'] * 3, range(3), {})
+        with pytest.raises(JobCancelled):
+            modules.face_analyser.find_scene_cuts(['missing.png'] * 3)
+    finally:
+        set_job_context()
+    assert detected == []
+
+
+@pytest.mark.parametrize('size, n_lists, expected', [(0, None, None), (1, None, 1), (3, 10, 3), (4, 0, 2)])
+def test_identity_gallery_coarse_index_fits_the_gallery(size, n_lists, expected):
+    rng = np.random.default_rng(0)
+    gallery = IdentityGallery(rng.normal(size=(size, 512)), rng.normal(size=(size, 512)))
+    gallery.build_coarse_index(n_lists)
+    if expected is None:
+        assert gallery.coarse_centroids is None
+    else:
+        assert len(gallery.coarse_centroids) == expected
+        assert len(gallery.coarse_assignments) == size
+
+
+def test_memory_mapped_face_store_survives_clean_temp(monkeypatch, tmp_path):
+    from insightface.app.common import Face
+
+    from modules.face_analyser import create_face_store
+    from modules.utilities import clean_temp, create_temp
+
+    target_path = str(tmp_path / 'target.mp4')
+    monkeypatch.setattr(modules.globals, 'target_path', target_path)
+    monkeypatch.setattr(modules.globals, 'face_store_mmap', True)
+    monkeypatch.setattr(modules.globals, 'keep_frames', False)
+    create_temp(target_path)
+    store = create_face_store(str(tmp_path / 'analysis'))
+    embedding = np.ones(512)
+    store.add_frame('0001.png', [Face(bbox=np.zeros(4), kps=np.zeros((5, 2)), det_score=1.0, embedding=embedding)])
+    store.finalize()
+    clean_temp(target_path)
+    assert os.path.isfile(os.path.join(store.directory, 'embedding.bin'))
+    np.testing.assert_allclose(store.embedding[0], embedding / np.linalg.norm(embedding), rtol=1e-5)
+
+
+def test_file_faces_cache_keeps_the_most_recent_files(monkeypatch, tmp_path):
+    import modules.face_analyser
+    from modules.face_analyser import get_one_face_from_file
+
+    monkeypatch.setattr(modules.face_analyser, 'FILE_FACES', modules.face_analyser.OrderedDict())
+    monkeypatch.setattr(modules.face_analyser, 'FILE_FACES_SIZE', 2)
+    detected = []
+    monkeypatch.setattr(modules.face_analyser, 'get_one_face', lambda image: detected.append(image) and None)
+    paths = []
+    for name in ('a.png', 'b.png', 'c.png'):
+        (tmp_path / name).write_bytes(b'')
+        paths.append(str(tmp_path / name))
+    for image_path in (paths[0], paths[1], paths[0], paths[2], paths[0]):
+        get_one_face_from_file(image_path)
+    # b was least recently used when c arrived, a stayed cached throughout
+    assert len(detected) == 3
+    assert [key[0] for key in modules.face_analyser.FILE_FACES] == [paths[2], paths[0]]
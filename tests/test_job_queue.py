@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+pytest.importorskip('tqdm')
+
+from modules.job_queue import JobQueue
+
+
+def enqueue(job_queue, target, priority=0, max_attempts=1):
+    return job_queue.enqueue('source.jpg', target, f'output-{target}', ['face_swapper'], {}, priority, max_attempts)
+
+
+def test_next_job_prefers_priority_then_age():
+    job_queue = JobQueue()
+    first = enqueue(job_queue, 'a.jpg')
+    urgent = enqueue(job_queue, 'b.jpg', priority=5)
+    assert job_queue.next_job()['id'] == urgent['id']
+    job_queue.claim(urgent['id'])
+    assert job_queue.next_job()['id'] == first['id']
+
+
+def test_next_job_skips_full_classes():
+    job_queue = JobQueue()
+    enqueue(job_queue, 'a.jpg')
+    assert job_queue.next_job(['image']) is None
+
+
+def test_failed_job_is_retried_after_backoff():
+    job_queue = JobQueue()
+    job = enqueue(job_queue, 'a.jpg', max_attempts=2)
+    job_queue.claim(job['id'])
+    assert job_queue.fail(job['id'], 'boom') == 'queued'
+    assert job_queue.next_job() is None
+    job_queue.claim(job['id'])
+    assert job_queue.fail(job['id'], 'boom') == 'failed'
+
+
+def test_next_attempt_time_ignores_ready_jobs():
+    job_queue = JobQueue()
+    enqueue(job_queue, 'a.jpg')
+    assert job_queue.next_attempt_time() is None
+    retried = enqueue(job_queue, 'b.jpg', max_attempts=2)
+    job_queue.claim(retried['id'])
+    job_queue.fail(retried['id'], 'boom')
+    # the ready job must not hide the backoff deadline, or a blocked worker would wait untimed
+    assert job_queue.next_attempt_time() > time.time()
+
+
+def test_recover_requeues_running_jobs(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    job = enqueue(JobQueue(path), 'a.jpg')
+    JobQueue(path).claim(job['id'])
+    job_queue = JobQueue(path)
+    assert job_queue.recover() == 1
+    assert job_queue.get(job['id'])['status'] == 'queued'
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.globals
+from modules.live import FrameSlot, LivePipeline
+
+
+class FakeCapturer:
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.is_running = True
+        self._sent = threading.Event()
+
+    def read_timestamped(self, timeout=None):
+        if self._sent.is_set():
+            time.sleep(timeout or 0)
+            return False, None, 0.0
+        self._sent.set()
+        return True, self.frame, time.perf_counter()
+
+
+class FakeSwapper:
+    NAME = 'DLC.FACE-SWAPPER'
+
+    def get_target_faces(self, frame):
+        return []
+
+    def process_frame(self, source_face, frame, faces=None):
+        frame[:] = 255
+        return frame
+
+
+def test_frame_slot_put_accepts_timeout():
+    slot = FrameSlot()
+    slot.put('frame', timeout=0.1)
+    assert slot.get(0) == 'frame'
+
+
+def test_pipeline_delivers_frame(monkeypatch):
+    monkeypatch.setattr(modules.globals, 'show_fps', False)
+    monkeypatch.setattr(modules.globals, 'live_mirror', False)
+    monkeypatch.setattr(modules.globals, 'map_faces', False)
+    monkeypatch.setattr('modules.live.get_live_source_face', lambda: None)
+    pipeline = LivePipeline(FakeCapturer(np.zeros((48, 64, 3), dtype=np.uint8)), [FakeSwapper()])
+    pipeline.start()
+    try:
+        frame = pipeline.get_frame(timeout=5.0)
+    finally:
+        pipeline.stop()
+    assert frame is not None
+    assert frame.shape == (48, 64, 3)
+    assert frame.min() == 255
+
+
+class FailingSwapper(FakeSwapper):
+
+    def process_frame(self, source_face, frame, faces=None):
+        raise ValueError('no source face')
+
+
+class RepeatingCapturer(FakeCapturer):
+
+    def read_timestamped(self, timeout=None):
+        time.sleep(0.001)
+        return True, self.frame.copy(), time.perf_counter()
+
+
+def test_pipeline_stops_when_a_stage_keeps_failing(monkeypatch):
+    monkeypatch.setattr(modules.globals, 'show_fps', False)
+    monkeypatch.setattr(modules.globals, 'live_mirror', False)
+    monkeypatch.setattr(modules.globals, 'map_faces', False)
+    monkeypatch.setattr('modules.live.get_live_source_face', lambda: None)
+    pipeline = LivePipeline(RepeatingCapturer(np.zeros((48, 64, 3), dtype=np.uint8)), [FailingSwapper()])
+    pipeline.start()
+    try:
+        deadline = time.perf_counter() + 5.0
+        while pipeline.is_running and time.perf_counter() < deadline:
+            assert pipeline.get_frame(timeout=0.1) is None
+    finally:
+        pipeline.stop()
+    assert not pipeline.is_running
+    assert 'no source face' in pipeline.error
+    assert pipeline.dropped >= 30
@@ -0,0 +1,104 @@
+import glob
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('onnxruntime')
+
+import modules.globals
+import modules.predicter
+from modules.predicter import NSFW_BATCH_SIZE, NSFW_MODEL_SIZE, predict_probabilities, prepare_frame
+from modules.utilities import resolve_relative_path
+
+MEDIA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
+
+
+def get_fixture_frames():
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(MEDIA_DIRECTORY, '*.png')))]
+    rng = np.random.default_rng(0)
+    frames.append(rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8))
+    frames.append(np.tile(np.linspace(0, 255, 300, dtype=np.uint8)[:, None, None], (1, 200, 3)))
+    return frames
+
+
+class FakeSession:
+    """Stands in for the onnx session, scoring each view by its mean so results can be matched to frames."""
+
+    def __init__(self, shape):
+        self.input = SimpleNamespace(name='input', shape=shape)
+        self.batches = []
+
+    def get_inputs(self):
+        return [self.input]
+
+    def run(self, output_names, feed):
+        views = feed[self.input.name]
+        self.batches.append(views.shape)
+        probabilities = (views.reshape(len(views), -1).mean(axis=1) + 128) / 512
+        return [np.stack([1 - probabilities, probabilities], axis=1)]
+
+
+@pytest.mark.parametrize('frame', get_fixture_frames())
+def test_prepare_frame_matches_opennsfw2(frame):
+    opennsfw2 = pytest.importorskip('opennsfw2')
+    expected = opennsfw2.preprocess_image(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), opennsfw2.Preprocessing.YAHOO)
+    actual = prepare_frame(frame)
+    assert actual.shape == expected.shape == (224, 224, 3)
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
+
+
+def test_prepare_frame_ignores_color_correction(monkeypatch):
+    frame = get_fixture_frames()[-1]
+    monkeypatch.setattr(modules.globals, 'color_correction', False)
+    without_correction = prepare_frame(frame)
+    monkeypatch.setattr(modules.globals, 'color_correction', True)
+    np.testing.assert_array_equal(prepare_frame(frame), without_correction)
+
+
+@pytest.mark.parametrize('shape, layout, batched', [
+    (['batch', NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3], 'nhwc', True),
+    (['batch', 3, NSFW_MODEL_SIZE, NSFW_MODEL_SIZE], 'nchw', True),
+    ([1, 3, NSFW_MODEL_SIZE, NSFW_MODEL_SIZE], 'nchw', False),
+    ([1, NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3], 'nhwc', False),
+])
+def test_predict_probabilities_onnx_feeds_the_model_layout_in_batches(monkeypatch, shape, layout, batched):
+    session = FakeSession(shape)
+    monkeypatch.setattr(modules.predicter, 'get_nsfw_session', lambda: session)
+    monkeypatch.setattr(modules.globals, 'nsfw_backend', 'onnx')
+    frames = [np.full((64, 96, 3), value, dtype=np.uint8) for value in range(0, 2 * NSFW_BATCH_SIZE + 5)]
+    probabilities = predict_probabilities(frames)
+
+    view_shape = (NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3) if layout == 'nhwc' else (3, NSFW_MODEL_SIZE, NSFW_MODEL_SIZE)
+    if batched:
+        assert session.batches == [(NSFW_BATCH_SIZE,) + view_shape] * 2 + [(5,) + view_shape]
+    else:
+        assert session.batches == [(1,) + view_shape] * len(frames)
+    expected = [(prepare_frame(frame).mean() + 128) / 512 for frame in frames]
+    np.testing.assert_allclose(probabilities, expected, rtol=1e-5)
+
+
+def test_onnx_probabilities_match_opennsfw2(monkeypatch):
+    pytest.importorskip('opennsfw2')
+    from opennsfw2._download import get_default_weights_path
+
+    if not os.path.isfile(resolve_relative_path('../models/open_nsfw.onnx')) or not os.path.isfile(get_default_weights_path()):
+        pytest.skip('needs the open_nsfw onnx model and the opennsfw2 weights')
+    frames = get_fixture_frames()
+    monkeypatch.setattr(modules.globals, 'execution_providers', ['CPUExecutionProvider'])
+    monkeypatch.setattr(modules.globals, 'nsfw_backend', 'onnx')
+    onnx_probabilities = predict_probabilities(frames)
+    monkeypatch.setattr(modules.globals, 'nsfw_backend', 'opennsfw2')
+    opennsfw2_probabilities = predict_probabilities(frames)
+    np.testing.assert_allclose(onnx_probabilities, opennsfw2_probabilities, atol=1e-3)
+
+
+def test_warm_up_runs_the_configured_backend(monkeypatch):
+    session = FakeSession(['batch', NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3])
+    monkeypatch.setattr(modules.predicter, 'get_nsfw_session', lambda: session)
+    monkeypatch.setattr(modules.globals, 'nsfw_backend', 'onnx')
+    modules.predicter.warm_up()
+    assert session.batches == [(1, NSFW_MODEL_SIZE, NSFW_MODEL_SIZE, 3)]
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.face_analyser
+import modules.globals
+from modules.face_analyser import IdentityGallery
+from modules.preview import PreviewService
+
+
+def test_decode_frame_reloads_an_image_target_changed_on_disk(tmp_path):
+    target_path = str(tmp_path / 'target.png')
+    cv2.imwrite(target_path, np.zeros((8, 8, 3), dtype=np.uint8))
+    preview_service = PreviewService()
+    assert preview_service.decode_frame(target_path, 0).max() == 0
+
+    cv2.imwrite(target_path, np.full((8, 8, 3), 255, dtype=np.uint8))
+    mtime = os.path.getmtime(target_path) + 10
+    os.utime(target_path, (mtime, mtime))
+    assert preview_service.decode_frame(target_path, 0).min() == 255
+
+
+def test_settings_key_follows_map_faces_and_the_identity_gallery(monkeypatch, tmp_path):
+    gallery = IdentityGallery()
+    monkeypatch.setattr(modules.face_analyser, 'IDENTITY_GALLERY', gallery)
+    monkeypatch.setattr(modules.globals, 'map_faces', False)
+    monkeypatch.setattr(modules.globals, 'identity_gallery_path', None)
+    preview_service = PreviewService()
+    keys = [preview_service.get_settings_key()]
+
+    monkeypatch.setattr(modules.globals, 'map_faces', True)
+    keys.append(preview_service.get_settings_key())
+    monkeypatch.setattr(modules.globals, 'identity_gallery_path', str(tmp_path / 'gallery.npz'))
+    keys.append(preview_service.get_settings_key())
+    rng = np.random.default_rng(0)
+    gallery.add(rng.normal(size=512), rng.normal(size=512))
+    keys.append(preview_service.get_settings_key())
+    assert len(set(keys)) == len(keys)
+
+
+def test_prefetch_only_decodes_ahead(monkeypatch):
+    from modules.preview import PREFETCH_RADIUS
+
+    preview_service = PreviewService()
+    decoded = []
+    monkeypatch.setattr(preview_service, 'decode_frame', lambda target_path, frame_number: decoded.append(frame_number))
+    preview_service._prefetch_target = ('target.mp4', 20)
+    preview_service._prefetch('target.mp4', 20)
+    assert decoded == list(range(21, 21 + PREFETCH_RADIUS))
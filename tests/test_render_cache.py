@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.globals
+import modules.render_cache
+from modules.render_cache import get_settings_signature
+
+
+def test_settings_signature_follows_the_model_variants(monkeypatch):
+    variants = {'DLC.FACE-SWAPPER': 'inswapper_128.onnx', 'DLC.FACE-ENHANCER': 'GFPGANv1.4.pth:cpu'}
+    frame_processors = [SimpleNamespace(NAME=name, get_model_variant=lambda name=name: variants[name]) for name in variants]
+    monkeypatch.setattr(modules.globals, 'frame_processors', ['face_swapper', 'face_enhancer'])
+    monkeypatch.setattr(modules.render_cache, 'get_frame_processors_modules', lambda names: frame_processors)
+    signature = get_settings_signature()
+    assert get_settings_signature() == signature
+
+    variants['DLC.FACE-SWAPPER'] = 'inswapper_128_fp16.onnx'
+    swapper_signature = get_settings_signature()
+    assert swapper_signature != signature
+
+    variants['DLC.FACE-ENHANCER'] = 'GFPGANv1.4.pth:cuda'
+    assert get_settings_signature() != swapper_signature
+
+
+def test_cached_frames_do_not_share_storage_with_temp_frames(tmp_path):
+    from modules.render_cache import copy_frame
+
+    temp_frame_path = tmp_path / '0001.png'
+    cached_frame_path = tmp_path / 'render.png'
+    temp_frame_path.write_bytes(b'rendered')
+    copy_frame(str(temp_frame_path), str(cached_frame_path))
+    # the way ffmpeg and cv2.imwrite rewrite a kept temp frame
+    with open(temp_frame_path, 'r+b') as file:
+        file.write(b'raw')
+    assert cached_frame_path.read_bytes() == b'rendered'
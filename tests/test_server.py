@@ -0,0 +1,102 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('cv2')
+pytest.importorskip('insightface')
+
+import modules.globals
+import modules.server
+from modules.job_queue import JobQueue
+from modules.server import JobServer, create_request_handler
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    for name in ('source.png', 'target.png'):
+        (tmp_path / name).write_bytes(b'')
+    monkeypatch.setattr(modules.globals, 'frame_processors', ['face_swapper'])
+    monkeypatch.setattr(modules.globals, 'identity_gallery_path', None)
+    processed = threading.Event()
+    release = threading.Event()
+
+    def process_job(source_path, target_path, output_path, frame_processors):
+        processed.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(modules.server, 'process_job', process_job)
+    monkeypatch.setattr(modules.server, 'load_frame_processor_module', lambda name: SimpleNamespace(NAME=name, pre_check=lambda: True))
+    job_server = JobServer(JobQueue(), 1)
+    job_server.start()
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), create_request_handler(job_server))
+    threading.Thread(target=http_server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def request(method, path, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', http_server.server_address[1], timeout=5)
+        connection.request(method, path, body=None if body is None else json.dumps(body) if not isinstance(body, bytes) else body)
+        response = connection.getresponse()
+        payload = json.loads(response.read())
+        connection.close()
+        return response.status, payload
+
+    yield SimpleNamespace(request=request, job_server=job_server, processed=processed, release=release, path=tmp_path)
+    release.set()
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def test_jobs_api_submits_reads_and_cancels(client):
+    status, job = client.request('POST', '/jobs', {'source': 'source.png', 'target': 'target.png', 'options': {'many_faces': 'false', 'keep_fps': True}})
+    assert status == 201
+    assert job['target'] == str(client.path / 'target.png')
+    assert job['output'] == str(client.path / 'source-target.png')
+    assert job['options']['many_faces'] is False and job['options']['keep_fps'] is True
+    assert client.processed.wait(5)
+    status, running = client.request('GET', f"/jobs/{job['id']}")
+    assert status == 200 and running['status'] == 'running'
+
+    # the only worker is busy, so the second job stays queued and can be cancelled outright
+    status, queued = client.request('POST', '/jobs', {'source': 'source.png', 'target': 'target.png', 'priority': '3'})
+    assert status == 201 and queued['priority'] == 3
+    status, cancelled = client.request('DELETE', f"/jobs/{queued['id']}")
+    assert status == 200 and cancelled['status'] == 'cancelled'
+
+    client.release.set()
+    client.job_server.wait_idle()
+    status, done = client.request('GET', f"/jobs/{job['id']}")
+    assert status == 200 and done['status'] == 'done'
+
+
+@pytest.mark.parametrize('body', [
+    b'not json',
+    b'[1, 2]',
+    {'source': 'source.png', 'target': 'target.png', 'options': ['many_faces']},
+    {'source': 'source.png', 'target': 'target.png', 'options': {'many_faces': 'maybe'}},
+    {'source': 'source.png', 'target': 'target.png', 'options': {'video_quality': 'high'}},
+    {'source': 'source.png', 'target': 'target.png', 'options': {'unknown': True}},
+    {'source': 'source.png', 'target': 'target.png', 'priority': 'urgent'},
+    {'source': 'source.png', 'target': 'target.png', 'priority': [1]},
+    {'source': 'source.png', 'target': 'target.png', 'frame_processors': 'face_swapper'},
+    {'source': 'source.png', 'target': 'target.png', 'frame_processors': ['face_painter']},
+    {'source': 'source.png', 'target': 'missing.png'},
+    {'source': 'source.png', 'target': 7},
+])
+def test_jobs_api_rejects_invalid_requests(client, body):
+    status, payload = client.request('POST', '/jobs', body)
+    assert status == 400
+    assert payload['error']
+    assert client.job_server.list_jobs() == []
+
+
+@pytest.mark.parametrize('method, path', [('GET', '/jobs/missing'), ('DELETE', '/jobs/missing'), ('GET', '/nothing'), ('POST', '/nothing')])
+def test_jobs_api_returns_not_found(client, method, path):
+    status, payload = client.request(method, path, {} if method == 'POST' else None)
+    assert status == 404
+    assert payload['error']
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+import modules.globals
+from modules.stream_writer import FFmpegWriter, LiveRecorder, StreamWriter
+
+
+def test_stream_writer_requires_write():
+    with pytest.raises(TypeError):
+        StreamWriter('-')
+
+
+@pytest.mark.parametrize('writer', [FFmpegWriter('out.mp4'), LiveRecorder('out.mkv')])
+@pytest.mark.parametrize('video_encoder, present, absent', [
+    ('libx264', ['-preset', 'ultrafast'], '-deadline'),
+    ('libx265', ['-preset', 'ultrafast'], '-deadline'),
+    ('libvpx-vp9', ['-deadline', 'realtime'], '-preset'),
+])
+def test_ffmpeg_command_passes_speed_args_the_encoder_supports(monkeypatch, writer, video_encoder, present, absent):
+    monkeypatch.setattr(modules.globals, 'video_encoder', video_encoder)
+    command = writer.get_command(640, 480, 30.0)
+    index = command.index(present[0])
+    assert command[index:index + len(present)] == present
+    assert absent not in command
+    assert command[command.index('-c:v') + 1] == video_encoder
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+pytest.importorskip('cv2')
+Image = pytest.importorskip('PIL.Image')
+
+import modules.thumbnails
+from modules.thumbnails import get_thumbnail, prune_thumbnail_directory
+
+
+def test_prune_thumbnail_directory_drops_least_recently_used(monkeypatch, tmp_path):
+    monkeypatch.setattr(modules.thumbnails, 'THUMBNAIL_DIRECTORY', str(tmp_path))
+    for i, name in enumerate(['old', 'used', 'new']):
+        path = tmp_path / f'{name}.png'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+    # reading refreshes the mtime, so the used thumbnail outlives the newer one
+    os.utime(tmp_path / 'used.png', (2000, 2000))
+    prune_thumbnail_directory(150)
+    assert sorted(os.listdir(tmp_path)) == ['used.png']
+
+
+def test_get_thumbnail_keeps_the_disk_cache_under_its_cap(monkeypatch, tmp_path):
+    thumbnail_directory = tmp_path / 'thumbnails'
+    monkeypatch.setattr(modules.thumbnails, 'THUMBNAIL_DIRECTORY', str(thumbnail_directory))
+    monkeypatch.setattr(modules.thumbnails, 'THUMBNAILS', modules.thumbnails.OrderedDict())
+    for i in range(5):
+        image_path = tmp_path / f'{i}.png'
+        Image.new('RGB', (64, 64), (i * 40, 0, 0)).save(image_path)
+        get_thumbnail(str(image_path), (32, 32))
+    sizes = [entry.stat().st_size for entry in os.scandir(thumbnail_directory)]
+    monkeypatch.setattr(modules.thumbnails, 'THUMBNAIL_DISK_BYTES', max(sizes) * 2)
+    Image.new('RGB', (64, 64), (0, 255, 0)).save(tmp_path / 'last.png')
+    get_thumbnail(str(tmp_path / 'last.png'), (32, 32))
+    assert sum(entry.stat().st_size for entry in os.scandir(thumbnail_directory)) <= max(sizes) * 2
+    assert len(os.listdir(thumbnail_directory)) < 6
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('customtkinter')
+pytest.importorskip('insightface')
+
+from modules.ui import clear_mapper_face
+
+
+class FakeLabel:
+
+    def __init__(self):
+        self.destroyed = False
+
+    def destroy(self):
+        self.destroyed = True
+
+
+@pytest.mark.parametrize('detected', [False, True])
+def test_clear_mapper_face_removes_pending_and_detected_labels(detected):
+    label = FakeLabel()
+    map = [{'id': 0, 'source': {'face': None}} if detected else {'id': 0}]
+    label_dict = {0: label}
+    clear_mapper_face(map, 0, 'source', label_dict)
+    assert label.destroyed
+    assert label_dict == {}
+    assert map == [{'id': 0}]